@@ -0,0 +1,314 @@
+# Резервные копии БД: копирование порциями страниц в фоновом потоке,
+# пропуск неизмененной базы, сжатие и ротация.
+#
+#   python backup.py list
+#   python backup.py backup [--force]
+#   python backup.py verify [файл ...]
+#   python backup.py restore файл [--db registers.db]
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from database import DB_NAME
+
+BACKUP_DIR = 'backups'
+STATE_FILE = 'backup_state.json'
+
+# registers_20240101_120000.db.gz - текущий формат, .bak - несжатые копии
+# прежних версий, они тоже попадают под ротацию
+BACKUP_RE = re.compile(r'^(?P<base>.+)_(?P<stamp>\d{8}_\d{6})\.(?:db\.gz|bak)$')
+
+
+class BackupService:
+    def __init__(self, db_name=DB_NAME, backup_dir=BACKUP_DIR, pages=1024, keep_hourly=24,
+                 keep_daily=7, keep_weekly=8):
+        self.db_name = db_name
+        self.backup_dir = backup_dir
+        self.pages = pages  # страниц за шаг Connection.backup
+        self.keep_hourly = keep_hourly
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.base = os.path.splitext(os.path.basename(db_name))[0]
+        self._thread = None
+        self._stop = threading.Event()
+        self._data_version = None
+
+    # --- фоновый режим ---
+
+    def start(self, interval=3600):
+        # Первая копия сразу, далее раз в interval секунд, пока открыто приложение
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                        name='backup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, interval):
+        conn = None
+        try:
+            while not self._stop.is_set():
+                try:
+                    # Первый запуск: базу создаст приложение, копировать пока нечего
+                    if conn is None and os.path.exists(self.db_name):
+                        # Собственное соединение: data_version меняется при
+                        # фиксации изменений любыми другими соединениями
+                        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+                    if conn is not None:
+                        self.run_once(conn)
+                except Exception as e:
+                    print(f"Backup error: {str(e)}")
+                if not interval or self._stop.wait(interval):
+                    break
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # --- копирование ---
+
+    def _state_path(self):
+        return os.path.join(self.backup_dir, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path(), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        with open(self._state_path(), 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+
+    def _file_signature(self):
+        # Размер и время изменения файла БД и журнала WAL
+        signature = []
+        for path in (self.db_name, self.db_name + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature += [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                signature += [None, None]
+        return signature
+
+    def _cleanup_temp(self):
+        for name in os.listdir(self.backup_dir):
+            if name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.backup_dir, name))
+                except OSError:
+                    pass
+
+    def run_once(self, conn=None, force=False):
+        # Возвращает имя новой копии или None, если база не менялась
+        if conn is None and not os.path.exists(self.db_name):
+            return None
+        os.makedirs(self.backup_dir, exist_ok=True)
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_name)
+        try:
+            # data_version сравнимо только в пределах одного соединения, поэтому
+            # запоминается лишь для постоянного соединения фонового потока
+            data_version = None if own_conn else conn.execute('PRAGMA data_version').fetchone()[0]
+            if not force and data_version is not None and data_version == self._data_version:
+                return None
+            state = self._load_state()
+            signature = self._file_signature()
+            if not force and state.get('signature') == signature:
+                self._data_version = data_version
+                return None
+            self._cleanup_temp()
+            name = self._snapshot(conn, state, force)
+            self._data_version = data_version
+            state['signature'] = signature
+            self._save_state(state)
+        finally:
+            if own_conn:
+                conn.close()
+        self.prune()
+        return name
+
+    def _snapshot(self, conn, state, force):
+        # Снимок через backup API порциями по self.pages страниц: писатели
+        # не блокируются на все время копирования
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.backup_dir)
+        os.close(handle)
+        target = sqlite3.connect(temp_path)
+        try:
+            conn.backup(target, pages=self.pages)
+        finally:
+            target.close()
+        try:
+            digest = file_sha256(temp_path)
+            if not force and digest == state.get('sha256') and os.path.exists(
+                    os.path.join(self.backup_dir, state.get('file', ''))):
+                # Файл изменился (например, контрольная точка WAL), данные - нет
+                return None
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            name = f'{self.base}_{timestamp}.db.gz'
+            path = os.path.join(self.backup_dir, name)
+            with open(temp_path, 'rb') as src, gzip.open(path + '.tmp', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(path + '.tmp', path)
+            state.update(sha256=digest, file=name)
+            print(f"Backup created: {path}")
+            return name
+        finally:
+            os.remove(temp_path)
+
+    # --- ротация ---
+
+    def list_backups(self):
+        # (время, имя) по возрастанию времени
+        backups = []
+        if not os.path.isdir(self.backup_dir):
+            return backups
+        for name in os.listdir(self.backup_dir):
+            match = BACKUP_RE.match(name)
+            if match and match.group('base') == self.base:
+                backups.append((datetime.strptime(match.group('stamp'), '%Y%m%d_%H%M%S'), name))
+        backups.sort()
+        return backups
+
+    def select_kept(self, backups, now=None):
+        # Последняя копия каждого часа за keep_hourly часов, каждого дня за
+        # keep_daily дней и каждой недели за keep_weekly недель; самая свежая - всегда
+        now = now or datetime.now()
+        kept = set()
+        rules = [
+            (timedelta(hours=self.keep_hourly), lambda t: t.strftime('%Y%m%d%H')),
+            (timedelta(days=self.keep_daily), lambda t: t.strftime('%Y%m%d')),
+            (timedelta(weeks=self.keep_weekly), lambda t: '%d-%02d' % t.isocalendar()[:2]),
+        ]
+        for period, bucket in rules:
+            latest = {}
+            for stamp, name in backups:
+                if now - stamp <= period:
+                    latest[bucket(stamp)] = name
+            kept.update(latest.values())
+        if backups:
+            kept.add(backups[-1][1])
+        return kept
+
+    def prune(self, now=None):
+        backups = self.list_backups()
+        kept = self.select_kept(backups, now)
+        removed = []
+        for _, name in backups:
+            if name not in kept:
+                os.remove(os.path.join(self.backup_dir, name))
+                removed.append(name)
+        return removed
+
+    # --- проверка и восстановление ---
+
+    def _resolve(self, name):
+        return name if os.path.exists(name) else os.path.join(self.backup_dir, name)
+
+    def _unpack(self, name):
+        path = self._resolve(name)
+        handle, temp_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return temp_path
+
+    def verify(self, name):
+        # (True, 'ok') или (False, описание ошибки)
+        temp_path = None
+        try:
+            temp_path = self._unpack(name)
+            conn = sqlite3.connect(temp_path)
+            try:
+                result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+            finally:
+                conn.close()
+            return result == 'ok', result
+        except (OSError, EOFError, sqlite3.Error) as e:
+            return False, str(e)
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+
+    def restore(self, name, db_name=None):
+        # Копия проверяется и переносится в базу через backup API, поэтому
+        # файлы WAL/SHM остаются согласованными. Приложение должно быть закрыто
+        ok, message = self.verify(name)
+        if not ok:
+            raise ValueError(f"Копия {name} повреждена: {message}")
+        temp_path = self._unpack(name)
+        try:
+            source = sqlite3.connect(temp_path)
+            target = sqlite3.connect(db_name or self.db_name)
+            try:
+                source.backup(target, pages=self.pages)
+            finally:
+                target.close()
+                source.close()
+        finally:
+            os.remove(temp_path)
+        # Следующий запуск не должен принять восстановленную базу за неизмененную
+        state = self._load_state()
+        state.pop('signature', None)
+        self._save_state(state)
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Резервные копии базы реестров")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    backup_cmd = commands.add_parser('backup')
+    backup_cmd.add_argument('--force', action='store_true')
+    verify_cmd = commands.add_parser('verify')
+    verify_cmd.add_argument('files', nargs='*')
+    restore_cmd = commands.add_parser('restore')
+    restore_cmd.add_argument('file')
+    args = parser.parse_args(argv)
+
+    service = BackupService(args.db, args.dir)
+    if args.command == 'list':
+        for stamp, name in service.list_backups():
+            size = os.path.getsize(os.path.join(service.backup_dir, name))
+            print(f"{stamp:%d.%m.%Y %H:%M:%S}  {size:>12}  {name}")
+    elif args.command == 'backup':
+        name = service.run_once(force=args.force)
+        if name is None:
+            print("База не изменилась, копия не нужна")
+    elif args.command == 'verify':
+        names = args.files or [name for _, name in service.list_backups()]
+        failed = 0
+        for name in names:
+            ok, message = service.verify(name)
+            failed += not ok
+            print(f"{'OK ' if ok else 'ERR'}  {name}  {'' if ok else message}")
+        return 1 if failed else 0
+    elif args.command == 'restore':
+        service.restore(args.file)
+        print(f"База {args.db} восстановлена из {args.file}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
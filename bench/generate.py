@@ -0,0 +1,189 @@
+# Синтетические реестры для замеров: договоры (тип 1) и соглашения (тип 2)
+# с ИНН, кадастровыми номерами, датами ДД.ММ.ГГГГ, оплатами и пенями.
+# Строки повторяются при том же seed; книга Excel - в том же виде, что
+# выгрузки, которые загружают пользователи.
+#
+#   python bench/generate.py --type 1 --rows 100000 договоры.xlsx
+#   python bench/generate.py --type 2 --rows 20000 --sheets 4 соглашения.xlsx
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DATE_COLUMNS  # noqa: E402
+from importer import import_columns  # noqa: E402
+
+FIRST_DAY = date(2015, 1, 1)
+DAYS = (date(2024, 12, 31) - FIRST_DAY).days
+
+COMPANIES = ('ООО "Вега"', 'ООО "Стройресурс"', 'АО "Агрохолдинг"', 'ООО "Волга-Инвест"',
+             'ООО "Жилстрой"', 'ЗАО "Нива"', 'ООО "Самаратранс"', 'АО "Энергия"')
+SURNAMES = ('Иванов', 'Петров', 'Сидорова', 'Кузнецов', 'Смирнова', 'Попов', 'Васильева',
+            'Соколов', 'Михайлова', 'Новиков', 'Федоров', 'Морозова')
+INITIALS = 'АБВГДЕИКЛМНОПС'
+SETTLEMENTS = ('г. Самара', 'г. Тольятти', 'г. Сызрань', 'г. Новокуйбышевск', 'с. Красный Яр',
+               'пгт. Безенчук', 'с. Кинель-Черкассы', 'г. Чапаевск')
+STREETS = ('ул. Ленина', 'ул. Садовая', 'ул. Молодежная', 'ул. Полевая', 'пр. Кирова',
+           'ул. Заводская', 'ул. Победы', 'ул. Лесная')
+USES = ('для индивидуального жилищного строительства', 'для ведения личного подсобного хозяйства',
+        'для сельскохозяйственного производства', 'склады', 'объекты дорожного сервиса',
+        'магазины', 'для размещения производственной базы')
+GROUNDS = ('пп. 6 п. 2 ст. 39.3 ЗК РФ', 'ст. 39.17 ЗК РФ', 'ст. 39.20 ЗК РФ',
+           'пп. 6 п. 2 ст. 39.3, ст. 39.17, ст. 39.20 ЗК РФ')
+NOTES = ('', '', '', '', 'оплата частями', 'направлена претензия', 'передано в суд',
+         'уточнение платежа', 'письмо покупателю')
+
+
+def inn(rnd, digits):
+    return ''.join(str(rnd.randint(0, 9)) for _ in range(digits))
+
+
+def party(rnd):
+    # Юрлица - 10 цифр ИНН, граждане - 12
+    if rnd.random() < 0.4:
+        return f'{rnd.choice(COMPANIES)}, ИНН {inn(rnd, 10)}'
+    return f'{rnd.choice(SURNAMES)} {rnd.choice(INITIALS)}.{rnd.choice(INITIALS)}., ИНН {inn(rnd, 12)}'
+
+
+def cadastral(rnd):
+    number = f'63:{rnd.randint(1, 38):02d}:{rnd.randint(101001, 2405009):07d}:{rnd.randint(1, 3999)}'
+    return (f'{number}, Самарская обл., {rnd.choice(SETTLEMENTS)}, '
+            f'{rnd.choice(STREETS)}, д. {rnd.randint(1, 180)}')
+
+
+def dmy(value):
+    return value.strftime('%d.%m.%Y') if value else None
+
+
+def payment(rnd, price, signed):
+    # Оплата: в срок, с опозданием, частичная, с переплатой или еще нет;
+    # возвращает (дата оплаты, сумма, начисленные пени, оплаченные пени)
+    kind = rnd.random()
+    due = signed + timedelta(days=7)
+    if kind < 0.15:
+        return None, None, None, None
+    if kind < 0.55:
+        return signed + timedelta(days=rnd.randint(1, 7)), price, None, None
+    late = rnd.randint(1, 400)
+    penalty = round(price * 0.0003 * late, 2)
+    paid = price
+    if kind < 0.7:
+        paid = round(price * rnd.uniform(0.3, 0.95), 2)
+    elif kind < 0.75:
+        paid = round(price * rnd.uniform(1.01, 1.1), 2)
+    paid_penalty = round(penalty * rnd.choice((0, 0.5, 1, 1)), 2)
+    return due + timedelta(days=late), paid, penalty, paid_penalty
+
+
+def contract(rnd, number):
+    signed = FIRST_DAY + timedelta(days=rnd.randint(0, DAYS))
+    area = round(rnd.lognormvariate(7, 1.1), 1)
+    price = round(area * rnd.uniform(40, 900), 2)
+    paid_on, paid, penalty, paid_penalty = payment(rnd, price, signed)
+    return {
+        'Номер договора': f'{number}-{signed.year % 100:02d}',
+        'Дата заключения договора': signed,
+        'Покупатель, ИНН': party(rnd),
+        'Кадастровый номер ЗУ, адрес ЗУ': cadastral(rnd),
+        'Площадь ЗУ, кв. м': area,
+        'Разрешенное использование ЗУ': rnd.choice(USES),
+        'Основание предоставления': rnd.choice(GROUNDS),
+        'Цена ЗУ по договору, руб.': price,
+        'Срок оплаты по договору': signed + timedelta(days=7),
+        'Фактическая дата оплаты': paid_on,
+        '№ выписки учета поступлений, № ПП': f'ПП {rnd.randint(1, 9999)}' if paid_on else None,
+        'Оплачено': paid,
+        'примечание': rnd.choice(NOTES) or None,
+        'начисленные ПЕНИ': penalty,
+        'оплачено пеней': paid_penalty,
+        'Дата выписки учета поступлений, № ПП': paid_on + timedelta(days=rnd.randint(0, 5)) if paid_on else None,
+        'Возврат имеющейся переплаты': round(paid - price, 2) if paid and paid > price and rnd.random() < 0.3 else None,
+    }
+
+
+def agreement(rnd, number):
+    signed = FIRST_DAY + timedelta(days=rnd.randint(0, DAYS))
+    area = round(rnd.lognormvariate(6.5, 0.9), 1)
+    price = round(area * rnd.uniform(5, 300), 2)
+    paid_on, paid, penalty, paid_penalty = payment(rnd, price, signed)
+    order = f'приказ № {rnd.randint(1, 3000)} от {dmy(signed - timedelta(days=rnd.randint(5, 60)))}'
+    return {
+        '№ соглашения': f'С-{number}',
+        'Дата заключения': signed,
+        'Собственник, ИНН': party(rnd),
+        'Кадастровый номер образуемого ЗУ, адрес ЗУ': cadastral(rnd),
+        'Площадь образуемого ЗУ, кв. м': area,
+        'реквизиты приказа ГК ПО по им. Отнош.': order,
+        'Размер платы за увеличение площади ЗУ, руб.': price,
+        'Срок оплаты': signed + timedelta(days=7),
+        'Фактическая дата оплаты': paid_on,
+        '№ выписки учета поступлений, № ПП': f'ПП {rnd.randint(1, 9999)}' if paid_on else None,
+        'Оплачено': paid,
+        'примечание': rnd.choice(NOTES) or None,
+        'начисленные ПЕНИ': penalty,
+        'оплачено пеней': paid_penalty,
+        'Возврат имеющейся переплаты': round(paid - price, 2) if paid and paid > price and rnd.random() < 0.3 else None,
+    }
+
+
+GENERATORS = {1: contract, 2: agreement}
+
+
+def generate_rows(file_type, count, seed=1):
+    # Строки в порядке колонок импорта (без вычисляемых); даты - ДД.ММ.ГГГГ
+    rnd = random.Random(seed)
+    columns = import_columns(file_type)
+    dates = set(DATE_COLUMNS[file_type])
+    make = GENERATORS[file_type]
+    for number in range(1, count + 1):
+        values = make(rnd, number)
+        yield [dmy(values.get(col)) if col in dates else values.get(col) for col in columns]
+
+
+def to_dataframe(file_type, rows):
+    # Как при создании записи в окне реестра: даты разбираются pandas и
+    # в БД попадают в формате ISO
+    import pandas as pd
+    df = pd.DataFrame(list(rows), columns=import_columns(file_type))
+    for col in DATE_COLUMNS[file_type]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format='%d.%m.%Y', errors='coerce')
+    return df
+
+
+def write_workbook(file_type, path, rows, sheets=1):
+    # Книга write_only: строки делятся между листами поровну, у каждого листа
+    # своя строка заголовков
+    from openpyxl import Workbook
+
+    rows = list(rows)
+    columns = import_columns(file_type)
+    workbook = Workbook(write_only=True)
+    per_sheet = -(-len(rows) // sheets) if rows else 0
+    for number in range(sheets):
+        worksheet = workbook.create_sheet(f'Лист{number + 1}')
+        worksheet.append(columns)
+        for row in rows[number * per_sheet:(number + 1) * per_sheet]:
+            worksheet.append(row)
+    workbook.save(path)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетический реестр в книге Excel')
+    parser.add_argument('--type', type=int, choices=[1, 2], default=1, help='1 - договоры, 2 - соглашения')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--sheets', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('file')
+    args = parser.parse_args()
+
+    count = write_workbook(args.type, args.file, generate_rows(args.type, args.rows, args.seed), args.sheets)
+    print(f'{args.file}: {count} строк, листов: {args.sheets}')
+
+
+if __name__ == '__main__':
+    main()
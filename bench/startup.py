@@ -0,0 +1,86 @@
+# Время запуска до окна входа: импорт main.py в отдельном процессе
+# с -X importtime. Тяжелые модули (pandas, numpy, tkcalendar...) должны
+# загружаться при первом использовании, а не при запуске.
+# Код выхода 1, если медиана превышает бюджет или загружен запрещенный модуль.
+#
+#   python bench/startup.py --runs 7 --budget-ms 150
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которым не место при запуске окна входа
+FORBIDDEN = ('pandas', 'numpy', 'tkcalendar', 'babel', 'dateutil', 'openpyxl', 'xlrd')
+
+
+def parse_importtime(output):
+    # Строки вида "import time:   self [us] | cumulative | imported package";
+    # возвращает {модуль: (собственное, суммарное)} в мкс
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        modules[name] = (int(parts[0]), int(parts[1]))
+    return modules
+
+
+def measure(module, python):
+    # Свежий процесс без байткода в памяти: как запуск на рабочем месте
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'Не удалось импортировать {module}:\n{result.stderr}')
+    return parse_importtime(result.stderr)
+
+
+def top_level(name):
+    return name.split('.', 1)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта модулей при запуске')
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=150.0,
+                        help='допустимая медиана суммарного времени импорта')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--python', default=sys.executable)
+    args = parser.parse_args()
+
+    # Первый прогон прогревает кэш байткода и не учитывается
+    measure(args.module, args.python)
+    runs = [measure(args.module, args.python) for _ in range(args.runs)]
+    totals = [run[args.module][1] / 1000 for run in runs if args.module in run]
+    median = statistics.median(totals)
+    last = runs[-1]
+
+    print(f'импорт {args.module}: медиана {median:.1f} мс, '
+          f'мин {min(totals):.1f}, макс {max(totals):.1f} ({args.runs} запусков)')
+    print(f'{"модуль":<40}{"суммарно, мс":>14}')
+    direct = [(name, times[1]) for name, times in last.items() if name != args.module]
+    for name, cumulative in sorted(direct, key=lambda item: -item[1])[:args.top]:
+        print(f'{name:<40}{cumulative / 1000:>14.1f}')
+
+    failed = False
+    loaded = sorted({top_level(name) for name in last} & set(FORBIDDEN))
+    if loaded:
+        print(f'ОШИБКА: при запуске загружаются {", ".join(loaded)}')
+        failed = True
+    if median > args.budget_ms:
+        print(f'ОШИБКА: {median:.1f} мс больше бюджета {args.budget_ms:.0f} мс')
+        failed = True
+    if not failed:
+        print(f'в пределах бюджета {args.budget_ms:.0f} мс')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
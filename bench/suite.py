@@ -0,0 +1,252 @@
+# Сквозные замеры на синтетическом реестре (bench/generate.py) без интерфейса:
+# импорт, чтение, правки ячеек, фильтры и сортировка окна реестра, выгрузки.
+# Результаты сохраняются в JSON; --compare сравнивает с прошлым прогоном,
+# код выхода 1, если какой-то замер стал медленнее порога.
+#
+#   python bench/suite.py --rows 100000 --output base.json
+#   python bench/suite.py --rows 100000 --output new.json --compare base.json --threshold 10
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exporter  # noqa: E402
+import importer  # noqa: E402
+from database import DATE_COLUMNS, ConnectionManager, DatabaseHandler  # noqa: E402
+from generate import generate_rows, to_dataframe, write_workbook  # noqa: E402
+from register_model import RegisterModel  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+EDIT_COLUMNS = {
+    1: ['Оплачено', 'оплачено пеней', 'Фактическая дата оплаты', 'Дата заключения договора'],
+    2: ['Оплачено', 'оплачено пеней', 'Фактическая дата оплаты', 'Дата заключения']
+}
+
+# Запросы фильтра окна реестра: текст, диапазон сумм, диапазон дат
+FILTERS = {
+    1: [('text', 'Покупатель, ИНН', 'ооо'),
+        ('number', 'Цена ЗУ по договору, руб.', '>= 100000'),
+        ('date', 'Срок оплаты по договору', '01.01.2020..31.12.2021')],
+    2: [('text', 'Собственник, ИНН', 'ооо'),
+        ('number', 'Размер платы за увеличение площади ЗУ, руб.', '>= 50000'),
+        ('date', 'Срок оплаты', '01.01.2020..31.12.2021')]
+}
+
+SORT_COLUMNS = {
+    1: [('text', 'Покупатель, ИНН'), ('number', 'Цена ЗУ по договору, руб.'),
+        ('date', 'Дата заключения договора')],
+    2: [('text', 'Собственник, ИНН'), ('number', 'Размер платы за увеличение площади ЗУ, руб.'),
+        ('date', 'Дата заключения')]
+}
+
+
+def check_filter(index, kind, column, query):
+    # Запрос должен разбираться так, как задуман: иначе замеряется не тот
+    # фильтр (например, диапазон дат, ставший поиском подстроки)
+    position = index.model.position_of(column)
+    spec = index.parse(position, query)
+    parsed = spec[0] if spec else None
+    if parsed == 'range':
+        parsed = 'date' if position in index.date_positions else 'number'
+    if parsed != kind:
+        raise ValueError(f'Фильтр {column!r} {query!r}: разобран как {parsed}, ожидался {kind}')
+
+
+def timed(repeat, run, setup=None):
+    # Время каждого повтора; setup готовит повтор и в замер не входит
+    runs = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        started = time.perf_counter()
+        run(state) if setup else run()
+        runs.append(time.perf_counter() - started)
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'runs': runs}
+
+
+class Suite:
+    def __init__(self, tmp, file_type, rows, repeat, edits, seed):
+        self.tmp = tmp
+        self.file_type = file_type
+        self.rows = rows
+        self.repeat = repeat
+        self.edits = edits
+        self.seed = seed
+        self.results = {}
+        self._databases = 0
+
+    def fresh_database(self):
+        self._databases += 1
+        path = os.path.join(self.tmp, f'bench{self._databases}.db')
+        manager = ConnectionManager(path)
+        return DatabaseHandler(path, manager=manager)
+
+    def record(self, name, result, **extra):
+        result.update(extra)
+        self.results[name] = result
+        print(f'{name:<28}{result["median_s"]:>12.3f}{result["min_s"]:>12.3f}')
+
+    def run(self):
+        file_type = self.file_type
+        rows = list(generate_rows(file_type, self.rows, self.seed))
+        workbook = os.path.join(self.tmp, 'register.xlsx')
+        write_workbook(file_type, workbook, rows)
+        df = to_dataframe(file_type, rows)
+        print(f'{"замер":<28}{"медиана, с":>12}{"мин, с":>12}')
+
+        # Импорт - каждый повтор в новую БД
+        opened = []
+
+        def new_db():
+            db = self.fresh_database()
+            opened.append(db)
+            return db
+
+        self.record('import_from_dataframe',
+                    timed(self.repeat, lambda db: db.import_from_dataframe(file_type, df), new_db),
+                    rows=len(rows))
+        self.record('import_workbook',
+                    timed(self.repeat, lambda db: importer.import_workbook(db, file_type, workbook), new_db),
+                    rows=len(rows))
+        for db in opened[:-1]:
+            db.manager.close()
+        db = opened[-1]
+
+        # Повторный импорт тех же строк: upsert без изменений
+        self.record('reimport_unchanged',
+                    timed(self.repeat, lambda: db.import_from_dataframe(file_type, df)), rows=len(rows))
+
+        records = []
+        self.record('get_all_records',
+                    timed(self.repeat, lambda: records.__setitem__(slice(None), db.get_all_records(file_type))),
+                    rows=len(records))
+
+        # Правка ячейки пересчитывает вычисляемые колонки и пишет журнал изменений
+        rnd = random.Random(self.seed)
+        ids = [record[0] for record in records]
+        dates = set(DATE_COLUMNS[file_type])
+
+        def edits():
+            # Даты - в формате хранения ГГГГ-ММ-ДД, как их передает окно реестра
+            for _ in range(self.edits):
+                column = rnd.choice(EDIT_COLUMNS[file_type])
+                if column in dates:
+                    value = (date(2015, 1, 1) + timedelta(days=rnd.randint(0, 3652))).isoformat()
+                else:
+                    value = round(rnd.uniform(0, 1_000_000), 2)
+                db.update_record(file_type, rnd.choice(ids), column, value)
+
+        result = timed(self.repeat, edits)
+        self.record('update_record', result, edits=self.edits,
+                    edit_ms=result['median_s'] / self.edits * 1000)
+
+        # Фильтры и сортировка окна реестра; массивы поиска и перестановки
+        # строятся заново в каждом повторе - как при первом обращении
+        model = RegisterModel(file_type)
+        self.record('model_load', timed(self.repeat, lambda: model.load(records)), rows=len(records))
+        for kind, column, query in FILTERS[file_type]:
+            check_filter(SearchIndex(model), kind, column, query)
+            self.record(f'filter_{kind}',
+                        timed(self.repeat, lambda index: index.search(column, query),
+                              lambda: SearchIndex(model)),
+                        column=column, query=query)
+        for kind, column in SORT_COLUMNS[file_type]:
+            def unsorted():
+                # load() применяет выбранную сортировку - сбрасываем ее до загрузки
+                model.sort_position = None
+                model.load(records)
+
+            self.record(f'sort_{kind}', timed(self.repeat, lambda _: model.sort(column, False), unsorted),
+                        column=column)
+
+        self.record('export_excel',
+                    timed(self.repeat, lambda: exporter.write_excel(
+                        db, file_type, os.path.join(self.tmp, 'export.xlsx'), include_editor=True)),
+                    rows=len(records))
+        self.record('export_xml',
+                    timed(self.repeat, lambda: exporter.write_xml_report(
+                        db, file_type, os.path.join(self.tmp, 'report.xml'))),
+                    rows=len(records))
+        self.record('export_xml_gzip',
+                    timed(self.repeat, lambda: exporter.write_xml_report(
+                        db, file_type, os.path.join(self.tmp, 'report.xml.gz'))),
+                    rows=len(records))
+        db.manager.close()
+        return self.results
+
+
+def metadata(args):
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'file_type': args.type,
+        'rows': args.rows,
+        'repeat': args.repeat,
+        'edits': args.edits,
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'machine': platform.node(),
+    }
+
+
+def compare(results, baseline, threshold):
+    # Сравнение медиан; возвращает названия замеров, ставших медленнее порога (%)
+    meta, old = baseline['meta'], baseline['results']
+    if meta.get('rows') != results['meta']['rows'] or meta.get('file_type') != results['meta']['file_type']:
+        print('ВНИМАНИЕ: прогоны на разных данных '
+              f'({meta.get("rows")} строк, тип {meta.get("file_type")})')
+    print(f'{"замер":<28}{"было, с":>12}{"стало, с":>12}{"изменение":>12}')
+    slower = []
+    for name, result in results['results'].items():
+        if name not in old:
+            continue
+        before, after = old[name]['median_s'], result['median_s']
+        change = (after - before) / before * 100 if before else 0.0
+        mark = ''
+        if change > threshold:
+            slower.append(name)
+            mark = '  медленнее'
+        print(f'{name:<28}{before:>12.3f}{after:>12.3f}{change:>+11.1f}%{mark}')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры операций с реестром')
+    parser.add_argument('--type', type=int, choices=[1, 2], default=1, help='1 - договоры, 2 - соглашения')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--edits', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона')
+    parser.add_argument('--threshold', type=float, default=10.0, help='допустимое замедление, %%')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        suite = Suite(tmp, args.type, args.rows, args.repeat, args.edits, args.seed)
+        results = {'meta': metadata(args), 'results': suite.run()}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print(f'Медленнее на {args.threshold:.0f}% и больше: {", ".join(slower)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
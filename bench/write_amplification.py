@@ -0,0 +1,127 @@
+# Сравнение числа записей строк на одно редактирование ячейки:
+# старая схема с триггерами пересчета (миграции 1-2) против текущей схемы.
+#
+#   python bench/write_amplification.py --rows 100000 --edits 2000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ConnectionManager, DatabaseHandler  # noqa: E402
+from migrations import MIGRATIONS  # noqa: E402
+
+INSERT_SQL = '''INSERT INTO contracts (
+    "Номер договора", "Дата заключения договора", "Цена ЗУ по договору, руб.",
+    "Срок оплаты по договору", "Фактическая дата оплаты", "Оплачено",
+    "начисленные ПЕНИ", "оплачено пеней"
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
+EDIT_COLUMNS = ['Оплачено', 'оплачено пеней', 'Фактическая дата оплаты', 'Дата заключения договора']
+
+
+def generate_rows(count, seed=1):
+    rnd = random.Random(seed)
+    for number in range(1, count + 1):
+        day, month, year = rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(2015, 2024)
+        price = round(rnd.uniform(10_000, 5_000_000), 2)
+        yield (
+            number,
+            f'{day:02d}.{month:02d}.{year}',
+            price,
+            f'{min(day + 7, 28):02d}.{month:02d}.{year}',
+            f'{rnd.randint(1, 28):02d}.{month:02d}.{year}',
+            round(price * rnd.choice([0.5, 1, 1]), 2),
+            round(rnd.uniform(0, 10_000), 2),
+            round(rnd.uniform(0, 10_000), 2),
+        )
+
+
+def edit_value(column, rnd):
+    if column in ('Фактическая дата оплаты', 'Дата заключения договора'):
+        return f'{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.{rnd.randint(2015, 2024)}'
+    return round(rnd.uniform(0, 1_000_000), 2)
+
+
+def run(name, manager, update, rows, edits):
+    started = time.perf_counter()
+    with manager.transaction() as conn:
+        conn.executemany(INSERT_SQL, generate_rows(rows))
+    insert_time = time.perf_counter() - started
+
+    rnd = random.Random(2)
+    before = conn.total_changes
+    started = time.perf_counter()
+    for _ in range(edits):
+        update(rnd.randint(1, rows), rnd.choice(EDIT_COLUMNS), rnd)
+    edit_time = time.perf_counter() - started
+    written = conn.total_changes - before
+    missing = conn.execute(
+        'SELECT count(*) FROM contracts WHERE "Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" IS NULL'
+    ).fetchone()[0]
+    return {
+        'schema': name,
+        'insert_s': insert_time,
+        'edit_ms': edit_time / edits * 1000,
+        'rows_per_edit': written / edits,
+        'uncomputed_rows': missing,
+    }
+
+
+def bench_legacy(path, rows, edits):
+    manager = ConnectionManager(path)
+    with manager.transaction() as conn:
+        cursor = conn.cursor()
+        for version, _, step in MIGRATIONS:
+            if version <= 2:
+                step(cursor)
+        cursor.execute('PRAGMA user_version = 2')
+
+    def update(record_id, column, rnd):
+        with manager.transaction() as conn:
+            conn.execute(f'UPDATE contracts SET "{column}" = ? WHERE id = ?',
+                         (edit_value(column, rnd), record_id))
+
+    try:
+        return run('triggers (v2)', manager, update, rows, edits)
+    finally:
+        manager.close()
+
+
+def bench_current(path, rows, edits):
+    manager = ConnectionManager(path)
+    db = DatabaseHandler(path, manager=manager)
+
+    def update(record_id, column, rnd):
+        db.update_record(1, record_id, column, edit_value(column, rnd))
+
+    try:
+        return run(f'generated (v{db.schema_version})', manager, update, rows, edits)
+    finally:
+        manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Записи строк на одну правку ячейки')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--edits', type=int, default=2_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            bench_legacy(os.path.join(tmp, 'legacy.db'), args.rows, args.edits),
+            bench_current(os.path.join(tmp, 'current.db'), args.rows, args.edits),
+        ]
+
+    print(f'{args.rows} строк, {args.edits} правок одной ячейки')
+    print(f'{"схема":<16}{"вставка, с":>12}{"правка, мс":>12}{"строк/правку":>14}{"без расчета":>13}')
+    for r in results:
+        print(f'{r["schema"]:<16}{r["insert_s"]:>12.2f}{r["edit_ms"]:>12.3f}'
+              f'{r["rows_per_edit"]:>14.2f}{r["uncomputed_rows"]:>13}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# Командная строка для плановых заданий: импорт, выгрузки, отчет XML,
+# резервная копия и пересчет без интерфейса (tkinter не загружается).
+# Ход работы и результат печатаются в stdout строками JSON, итог - код выхода.
+#
+#   python -m cli import --type 1 реестр.xlsx
+#   python -m cli batch-import --type 1 --workers 4 папка/ другой.xls
+#   python -m cli export --type 1 выгрузка.xlsx
+#   python -m cli xml --type 2 --date-column "Срок оплаты" --start 01.01.2024 отчет.xml.gz
+#   python -m cli backup [--force]
+#   python -m cli recalc [--type 1]
+#   python -m cli migrate
+import argparse
+import contextlib
+import json
+import sqlite3
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2  # код argparse при ошибке в аргументах
+EXIT_PARTIAL = 3  # часть файлов не загружена
+EXIT_BUSY = 4  # БД занята другим клиентом дольше времени ожидания
+EXIT_INTERRUPTED = 130
+
+
+class Reporter:
+    # События в stdout: {"event": "progress"|"done"|"error", ...}
+    PROGRESS_INTERVAL = 0.5  # с
+
+    def __init__(self, command, quiet=False, stream=None):
+        self.command = command
+        self.quiet = quiet
+        self.stream = stream or sys.stdout
+        self._last = 0.0
+
+    def emit(self, event, **data):
+        record = {'event': event, 'command': self.command}
+        record.update(data)
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.stream.flush()
+
+    def progress(self, done, total=None):
+        now = time.monotonic()
+        if self.quiet or (now - self._last < self.PROGRESS_INTERVAL and done != total):
+            return
+        self._last = now
+        self.emit('progress', done=done, total=total)
+
+
+def open_database(args):
+    from database import ConnectionManager, DatabaseHandler
+    # Тот же файл и та же блокировка, что у окон: запись через BEGIN IMMEDIATE
+    # с ожиданием занятой БД
+    manager = ConnectionManager.get(args.db, busy_timeout=args.busy_timeout)
+    return DatabaseHandler(args.db, manager)
+
+
+def file_types(args):
+    return [args.type] if args.type else [1, 2]
+
+
+def cmd_import(args, reporter):
+    import importer
+    db = open_database(args)
+    result = importer.import_workbook(db, args.type, args.file, progress=reporter.progress,
+                                      upsert=not args.no_upsert, force=args.force)
+    return EXIT_OK, result
+
+
+def cmd_batch_import(args, reporter):
+    import importer
+    db = open_database(args)
+    result = importer.batch_import(db, args.type, args.paths, workers=args.workers,
+                                   progress=reporter.progress, upsert=not args.no_upsert,
+                                   force=args.force)
+    result['errors'] = [{'file': path, 'error': error} for path, error in result['errors']]
+    return (EXIT_PARTIAL if result['errors'] else EXIT_OK), result
+
+
+def cmd_export(args, reporter):
+    import exporter
+    db = open_database(args)
+    count = exporter.write_excel(db, args.type, args.file, include_editor=args.editor,
+                                 progress=reporter.progress)
+    return EXIT_OK, {'rows': count, 'file': args.file}
+
+
+def cmd_xml(args, reporter):
+    import exporter
+    db = open_database(args)
+    count = exporter.write_xml_report(db, args.type, args.file, compress=args.gzip or None,
+                                      date_column=args.date_column, start=args.start, end=args.end,
+                                      overdue_only=args.overdue_only, progress=reporter.progress)
+    return EXIT_OK, {'rows': count, 'file': args.file}
+
+
+def cmd_backup(args, reporter):
+    from backup import BackupService
+    # Копия снимается из самой БД; миграции для этого не нужны
+    service = BackupService(args.db, args.backup_dir)
+    name = service.run_once(force=args.force)
+    return EXIT_OK, {'file': name, 'skipped': name is None}
+
+
+def cmd_recalc(args, reporter):
+    db = open_database(args)
+    result = {}
+    for file_type in file_types(args):
+        result[file_type] = db.recalculate(file_type)
+        reporter.progress(len(result), len(file_types(args)))
+    return EXIT_OK, result
+
+
+def cmd_migrate(args, reporter):
+    # Миграции выполняются при открытии БД
+    db = open_database(args)
+    return EXIT_OK, {'schema_version': db.schema_version, 'messages': db.migration_log}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Реестры: операции без интерфейса")
+    parser.add_argument('--db', default='registers.db')
+    parser.add_argument('--busy-timeout', type=int, default=30000,
+                        help="мс ожидания, если БД занята другим клиентом")
+    parser.add_argument('--quiet', action='store_true', help="без событий progress")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def register_type(command, required=True):
+        command.add_argument('--type', type=int, choices=[1, 2], required=required,
+                             help="1 - договоры, 2 - соглашения")
+
+    command = commands.add_parser('import', help="загрузить книгу Excel")
+    register_type(command)
+    command.add_argument('file')
+    command.add_argument('--force', action='store_true', help="не пропускать уже загруженные листы")
+    command.add_argument('--no-upsert', action='store_true', help="только добавлять строки")
+    command.set_defaults(func=cmd_import)
+
+    command = commands.add_parser('batch-import', help="загрузить несколько книг и папок")
+    register_type(command)
+    command.add_argument('paths', nargs='+')
+    command.add_argument('--workers', type=int)
+    command.add_argument('--force', action='store_true')
+    command.add_argument('--no-upsert', action='store_true')
+    command.set_defaults(func=cmd_batch_import)
+
+    command = commands.add_parser('export', help="выгрузить реестр в Excel")
+    register_type(command)
+    command.add_argument('file')
+    command.add_argument('--editor', action='store_true', help="с колонкой редактора")
+    command.set_defaults(func=cmd_export)
+
+    command = commands.add_parser('xml', help="отчет XML")
+    register_type(command)
+    command.add_argument('file')
+    command.add_argument('--date-column')
+    command.add_argument('--start', help="ДД.ММ.ГГГГ или ГГГГ-ММ-ДД")
+    command.add_argument('--end')
+    command.add_argument('--overdue-only', action='store_true')
+    command.add_argument('--gzip', action='store_true', help="сжать (по умолчанию - по расширению .gz)")
+    command.set_defaults(func=cmd_xml)
+
+    command = commands.add_parser('backup', help="резервная копия БД")
+    command.add_argument('--backup-dir', default='backups')
+    command.add_argument('--force', action='store_true', help="даже если БД не изменилась")
+    command.set_defaults(func=cmd_backup)
+
+    command = commands.add_parser('recalc', help="дозаполнить сроки оплаты и перестроить индексы")
+    register_type(command, required=False)
+    command.set_defaults(func=cmd_recalc)
+
+    command = commands.add_parser('migrate', help="обновить схему БД")
+    command.set_defaults(func=cmd_migrate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reporter = Reporter(args.command, args.quiet)
+    started = time.monotonic()
+    try:
+        # Сообщения миграций и прочие print уходят в stderr: stdout - только JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            code, result = args.func(args, reporter)
+    except KeyboardInterrupt:
+        reporter.emit('error', message="Прервано")
+        return EXIT_INTERRUPTED
+    except sqlite3.OperationalError as e:
+        reporter.emit('error', message=str(e), error=type(e).__name__)
+        from database import ConnectionManager
+        return EXIT_BUSY if ConnectionManager.is_busy_error(e) else EXIT_ERROR
+    except Exception as e:
+        reporter.emit('error', message=str(e), error=type(e).__name__)
+        return EXIT_ERROR
+    reporter.emit('done', result=result, seconds=round(time.monotonic() - started, 3), exit_code=code)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
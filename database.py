@@ -0,0 +1,1060 @@
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import instrumentation
+from migrations import business_key_condition, migrate
+
+DB_NAME = 'registers.db'
+# Адрес сервера реестров (server.py); если задан, клиент работает через него
+SERVER_ENV = 'REGISTERS_SERVER'
+MAX_LOGIN_ATTEMPTS = 5
+
+# Дата заключения и срок оплаты (+7 дней) для каждого типа реестра
+DUE_DATE_COLUMNS = {
+    1: ('Дата заключения договора', 'Срок оплаты по договору'),
+    2: ('Дата заключения', 'Срок оплаты')
+}
+
+
+# Ключ, по которому повторный импорт находит уже загруженную строку;
+# ему соответствует частичный уникальный индекс (миграция 6)
+BUSINESS_KEYS = {
+    1: ('Номер договора', 'Дата заключения договора'),
+    2: ('№ соглашения', 'Дата заключения')
+}
+
+
+# Колонки реестров в порядке отображения (без скрытого id)
+REGISTER_COLUMNS = {
+    1: [
+    'Номер договора',
+    'Дата заключения договора',
+    'Покупатель, ИНН',
+    'Кадастровый номер ЗУ, адрес ЗУ',
+    'Площадь ЗУ, кв. м',
+    'Разрешенное использование ЗУ',
+    'Основание предоставления',
+    'Цена ЗУ по договору, руб.',
+    'Срок оплаты по договору',
+    'Фактическая дата оплаты',
+    '№ выписки учета поступлений, № ПП',
+    'Оплачено',
+    'примечание',
+    'начисленные ПЕНИ',
+    'оплачено пеней',
+    'Дата выписки учета поступлений, № ПП',
+    'Возврат имеющейся переплаты',
+    # Расчетные колонки в конце
+    'Контроль по дате ("-" - просрочка)',
+    'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+    'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)',
+    'Редактор'
+    ],
+    2: [
+        '№ соглашения',
+        'Дата заключения',
+        'Собственник, ИНН',
+        'Кадастровый номер образуемого ЗУ, адрес ЗУ',
+        'Площадь образуемого ЗУ, кв. м',
+        'реквизиты приказа ГК ПО по им. Отнош.',
+        'Размер платы за увеличение площади ЗУ, руб.',
+        'Срок оплаты',
+        'Фактическая дата оплаты',
+        'Контроль по дате ("-" - просрочка)',
+        '№ выписки учета поступлений, № ПП',
+        'Оплачено',
+        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+        'примечание',
+        'начисленные ПЕНИ',
+        'оплачено пеней',
+        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)',
+        'Возврат имеющейся переплаты',
+        'Редактор'
+    ]
+}
+
+# Числовые колонки (включая вычисляемые)
+NUMERIC_COLUMNS = {
+    1: [
+        'Площадь ЗУ, кв. м',
+        'Цена ЗУ по договору, руб.',
+        'Оплачено',
+        'начисленные ПЕНИ',
+        'оплачено пеней',
+        'Контроль по дате ("-" - просрочка)',
+        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
+    ],
+    2: [
+        'Площадь образуемого ЗУ, кв. м',
+        'Размер платы за увеличение площади ЗУ, руб.',
+        'Оплачено',
+        'начисленные ПЕНИ',
+        'оплачено пеней',
+        'Контроль по дате ("-" - просрочка)',
+        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
+    ]
+}
+
+OVERDUE_COLUMN = 'Контроль по дате ("-" - просрочка)'
+
+# Колонки, которые считает сама БД; вручную не редактируются
+CALCULATED_COLUMNS = {
+    1: [
+        'Контроль по дате ("-" - просрочка)',
+        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
+    ],
+    2: [
+        'Контроль по дате ("-" - просрочка)',
+        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
+    ]
+}
+
+# Сколько последних записей журнала изменений хранится; окно, отставшее
+# сильнее, перечитывает реестр целиком
+CHANGE_LOG_KEEP = 100000
+# Больше изменений за раз дешевле перечитать полной загрузкой
+CHANGE_FEED_LIMIT = 5000
+
+# Колонки с датами, которые хранятся в формате ISO
+DATE_COLUMNS = {
+    1: [
+        'Дата заключения договора',
+        'Срок оплаты по договору',
+        'Фактическая дата оплаты',
+        'Дата выписки учета поступлений, № ПП'
+    ],
+    2: [
+        'Дата заключения',
+        'Срок оплаты',
+        'Фактическая дата оплаты'
+    ]
+}
+
+
+def quote_column(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def due_date_sql(date_sql):
+    return f"date({date_sql}, '+7 days')"
+
+
+def to_iso_date(value):
+    # ДД.ММ.ГГГГ (или datetime) -> ГГГГ-ММ-ДД для хранения в БД
+    if value is None or value == '':
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    value = str(value).strip()
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        # Уже ГГГГ-ММ-ДД (импорт из файла) - только проверка без strptime
+        try:
+            date.fromisoformat(value)
+            return value
+        except ValueError:
+            pass
+    for fmt in ('%d.%m.%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата: {value}")
+
+
+def to_display_date(value):
+    # ГГГГ-ММ-ДД -> ДД.ММ.ГГГГ для интерфейса и экспорта
+    if not value:
+        return ''
+    value = str(value)
+    if len(value) >= 10 and value[4] == '-' and value[7] == '-':
+        return f'{value[8:10]}.{value[5:7]}.{value[0:4]}'
+    return value
+
+
+def positional(sql):
+    # ?N -> ? и порядок значений строки для них: параметры ?N с последовательностью
+    # значений модуль sqlite3 считает устаревшими (ошибка с Python 3.14)
+    order = [int(number) - 1 for number in re.findall(r'\?(\d+)', sql)]
+    return re.sub(r'\?\d+', '?', sql), order
+
+
+def fts_query(text):
+    # Каждое слово запроса - фраза из его токенов с поиском по префиксу:
+    # "63:01:0101" -> "63 01 0101"*, слова объединяются через AND
+    phrases = []
+    text = text.replace('ё', 'е').replace('Ё', 'Е')
+    for word in text.split():
+        tokens = re.findall(r'\w+', word)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' '.join(phrases)
+
+
+def month_range(year, month):
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def quarter_range(year, quarter):
+    start, _ = month_range(year, quarter * 3 - 2)
+    _, end = month_range(year, quarter * 3)
+    return start, end
+
+
+class ConflictError(Exception):
+    # Строку изменили или удалили после того, как ее прочитал пользователь;
+    # record - ее текущее состояние (None, если строка удалена)
+    def __init__(self, record_id, record=None):
+        self.record_id = record_id
+        self.record = record
+        message = 'удалена' if record is None else 'изменена другим пользователем'
+        super().__init__(f"Запись {record_id} {message}")
+
+
+class Cursor(sqlite3.Cursor):
+    # С включенным журналом медленных запросов время execute и fetch*
+    # передается трассировке соединения; работа Python между вызовами
+    # (разбор следующего листа и т.п.) в длительность запроса не входит
+    def execute(self, sql, parameters=()):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            tracer.executed(self, sql, time.perf_counter() - started, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # Параметры уже прочитаны (часто это генератор) - план строится
+            # с NULL вместо значений
+            tracer.executed(self, sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        tracer.fetched(self, time.perf_counter() - started, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        tracer = self.connection.tracer
+        size = self.arraysize if size is None else size
+        if tracer is None:
+            return super().fetchmany(size)
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        tracer.fetched(self, time.perf_counter() - started, len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        tracer = self.connection.tracer
+        if tracer is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        tracer.fetched(self, time.perf_counter() - started, True)
+        return rows
+
+
+class Connection(sqlite3.Connection):
+    # Соединение помнит, с какой трассировкой запросов его выдали из пула:
+    # журнал медленных запросов включается и выключается на ходу.
+    # Connection.execute создает курсор в обход cursor(), поэтому
+    # execute и executemany переопределены
+    trace_generation = None
+    tracer = None
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionManager:
+    # Один менеджер на файл БД в пределах процесса
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, db_name=DB_NAME, cache_size=-32000, mmap_size=256 * 1024 * 1024,
+                 busy_timeout=5000, pool_size=4, retries=5, backoff=0.05, max_backoff=2.0,
+                 journal_mode='WAL'):
+        self.db_name = db_name
+        self.cache_size = cache_size  # отрицательное значение - в КиБ
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout  # мс
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # WAL не работает на сетевых ресурсах без общей памяти - режим можно переопределить
+        self.journal_mode = journal_mode
+
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._depth = 0
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def get(cls, db_name=DB_NAME, **options):
+        with cls._instances_lock:
+            manager = cls._instances.get(db_name)
+            if manager is None or manager._closed:
+                manager = cls(db_name, **options)
+                cls._instances[db_name] = manager
+                atexit.register(manager.close)
+            return manager
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.db_name,
+                               timeout=self.busy_timeout / 1000,
+                               check_same_thread=False,
+                               factory=Connection)
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        if readonly:
+            conn.execute('PRAGMA query_only = 1')
+        else:
+            self.with_retry(lambda: conn.execute(f'PRAGMA journal_mode = {self.journal_mode}'))
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    @staticmethod
+    def is_busy_error(error):
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+
+    def with_retry(self, func):
+        # Повтор с экспоненциальной задержкой, если БД занята другим клиентом
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except sqlite3.OperationalError as e:
+                if not self.is_busy_error(e) or attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    @property
+    def writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            return self._writer
+
+    @contextmanager
+    def transaction(self):
+        # Запись идет через единственное соединение; BEGIN IMMEDIATE сразу берет
+        # блокировку на запись, поэтому конфликт виден до выполнения изменений
+        with self._writer_lock:
+            conn = self.writer
+            if self._depth:
+                # Вложенная транзакция (групповая запись на сервере) - точка
+                # сохранения: ошибка отменяет только свою часть изменений
+                self._depth += 1
+                conn.execute('SAVEPOINT nested')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute('ROLLBACK TO nested')
+                    conn.execute('RELEASE nested')
+                    raise
+                else:
+                    conn.execute('RELEASE nested')
+                finally:
+                    self._depth -= 1
+                return
+            instrumentation.trace(conn, self.db_name)
+            self.with_retry(lambda: conn.execute('BEGIN IMMEDIATE'))
+            self._depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                self.with_retry(conn.commit)
+            finally:
+                self._depth = 0
+                instrumentation.finish(conn)
+
+    @contextmanager
+    def read(self):
+        with self._readers_lock:
+            conn = self._readers.pop() if self._readers else None
+        if conn is None:
+            conn = self._connect(readonly=True)
+        instrumentation.trace(conn, self.db_name)
+        try:
+            yield conn
+        finally:
+            instrumentation.finish(conn)
+            if conn.in_transaction:
+                conn.rollback()
+            with self._readers_lock:
+                if not self._closed and len(self._readers) < self.pool_size:
+                    self._readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def data_version(self):
+        # PRAGMA data_version на отдельном соединении меняется после каждой
+        # фиксации изменений любым другим соединением (своим писателем тоже);
+        # проверка не читает страниц БД, ее можно часто вызывать из интерфейса
+        with self._watcher_lock:
+            if self._watcher is None:
+                self._watcher = self._connect(readonly=True)
+            return self._watcher.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self._readers_lock:
+            self._closed = True
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        with self._watcher_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class UserNameCache:
+    # Ограниченный LRU-кэш ФИО пользователей; сбрасывается при изменении users
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            fio, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return fio
+
+    def put(self, user_id, fio):
+        with self._lock:
+            self._items[user_id] = (fio, time.monotonic())
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class DatabaseHandler:
+    def __init__(self, db_name=DB_NAME, manager=None):
+        self.manager = manager or ConnectionManager.get(db_name)
+        self.calculated_columns = CALCULATED_COLUMNS
+        self.user_names = UserNameCache()
+        # Сообщения миграций при открытии БД (копия, примененные шаги)
+        self.migration_log = []
+        self.schema_version = migrate(self.manager, log=self.migration_log.append)
+
+    @property
+    def conn(self):
+        # Общее соединение для записи
+        return self.manager.writer
+
+    def get_user_fio(self, user_id):
+        fio = self.user_names.get(user_id)
+        if fio is not None:
+            return fio
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT fio FROM users WHERE id = ?", (user_id,))
+            result = cursor.fetchone()
+        if not result:
+            return "Неизвестный"
+        self.user_names.put(user_id, result[0])
+        return result[0]
+
+    def find_user(self, login):
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, fio, login, password, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked "
+                "FROM users WHERE login = ?",
+                (login,)
+            )
+            return cursor.fetchone()
+
+    def login_exists(self, login):
+        with self.manager.read() as conn:
+            return conn.execute("SELECT 1 FROM users WHERE login = ?", (login,)).fetchone() is not None
+
+    @instrumentation.timed('db.authenticate')
+    def authenticate(self, login, password_hash, max_attempts=MAX_LOGIN_ATTEMPTS):
+        # Проверка пароля со счетчиком неудачных попыток. status: 'ok' (user -
+        # данные пользователя), 'unknown', 'locked' или 'wrong' (remaining -
+        # сколько попыток осталось, 0 - учетная запись только что заблокирована)
+        result = self.find_user(login)
+        if not result:
+            return {'status': 'unknown'}
+        user_id, fio, login, stored_hash, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked = result
+        if is_locked:
+            return {'status': 'locked'}
+        if stored_hash != password_hash:
+            attempts = login_attempts + 1
+            self.set_login_attempts(user_id, attempts, attempts >= max_attempts)
+            return {'status': 'wrong', 'remaining': max(max_attempts - attempts, 0)}
+        # Сброс попыток при успешном входе
+        if login_attempts:
+            self.set_login_attempts(user_id, 0, False)
+        return {'status': 'ok', 'user': {
+            'id': user_id,
+            'fio': fio,
+            'is_admin': bool(is_admin),
+            'can_edit_1': bool(can_edit_1),
+            'can_edit_2': bool(can_edit_2)
+        }}
+
+    def get_users(self, is_locked=None):
+        query = "SELECT id, fio, login, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked FROM users"
+        params = ()
+        if is_locked is not None:
+            query += " WHERE is_locked = ?"
+            params = (int(is_locked),)
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def _update_users(self, query, params_seq):
+        with self.manager.transaction() as conn:
+            conn.executemany(query, params_seq)
+        # Любое изменение users сбрасывает кэш ФИО
+        self.user_names.clear()
+
+    def create_user(self, fio, login, password_hash):
+        self._update_users(
+            "INSERT INTO users (fio, login, password) VALUES (?, ?, ?)",
+            [(fio, login, password_hash)]
+        )
+
+    def set_login_attempts(self, user_id, attempts, is_locked=False):
+        self._update_users(
+            "UPDATE users SET login_attempts = ?, is_locked = ? WHERE id = ?",
+            [(attempts, is_locked, user_id)]
+        )
+
+    def unlock_user(self, user_id):
+        self._update_users("UPDATE users SET is_locked=0 WHERE id=?", [(user_id,)])
+
+    def reset_login_attempts(self, user_id):
+        self._update_users("UPDATE users SET login_attempts=0 WHERE id=?", [(user_id,)])
+
+    def update_user_rights(self, rights):
+        # rights - список (user_id, is_admin, can_edit_1, can_edit_2)
+        self._update_users(
+            '''UPDATE users SET
+                is_admin = ?,
+                can_edit_1 = ?,
+                can_edit_2 = ?
+                WHERE id = ?''',
+            [(is_admin, can_edit_1, can_edit_2, user_id)
+             for user_id, is_admin, can_edit_1, can_edit_2 in rights]
+        )
+
+    def get_table_name(self, file_type):
+        return {
+            1: 'contracts',
+            2: 'agreements'
+        }[file_type]
+
+    def _records_select(self, file_type, columns=None, with_version=False):
+        # id, колонки реестра и ФИО редактора вместо его id - одним запросом;
+        # для окон реестра в конце добавляется версия строки
+        table = self.get_table_name(file_type)
+        if columns is None:
+            columns = [col for col in REGISTER_COLUMNS[file_type] if col != 'Редактор']
+        select = ['r.id'] + [f'r.{quote_column(col)}' for col in columns if col != 'Редактор']
+        select.append('''CASE WHEN r."Редактор" IS NULL THEN NULL
+                    ELSE COALESCE(u.fio, 'Неизвестный') END AS "Редактор"''')
+        if with_version:
+            select.append('r.row_version')
+        return f'''SELECT {', '.join(select)}
+                FROM {table} AS r
+                LEFT JOIN users AS u ON u.id = r."Редактор"'''
+
+    @instrumentation.timed('db.get_all_records')
+    def get_all_records(self, file_type, columns=None):
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._records_select(file_type, columns, with_version=True) + ' ORDER BY r.id')
+            return cursor.fetchall()
+
+    def iter_records(self, file_type, columns=None, date_column=None, start=None, end=None,
+                     overdue_only=False, batch_size=1000):
+        # Построчная выборка для экспорта: в памяти не больше batch_size строк.
+        # Фильтры: диапазон дат (ISO или ДД.ММ.ГГГГ) по date_column и просрочка
+        conditions, params = [], []
+        if start or end:
+            if date_column not in DATE_COLUMNS[file_type]:
+                raise ValueError(f"Колонка {date_column} не содержит дат")
+            quoted = 'r.' + quote_column(date_column)
+            if start:
+                conditions.append(f'{quoted} >= ?')
+                params.append(to_iso_date(start))
+            if end:
+                conditions.append(f'{quoted} <= ?')
+                params.append(to_iso_date(end))
+        if overdue_only:
+            conditions.append(f'r.{quote_column(OVERDUE_COLUMN)} < 0')
+        sql = self._records_select(file_type, columns)
+        if conditions:
+            sql += f' WHERE {" AND ".join(conditions)}'
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql + ' ORDER BY r.id', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    @instrumentation.timed('db.get_records_page')
+    def get_records_page(self, file_type, after_id=0, limit=5000):
+        # Страница записей по возрастанию id после after_id: границы страниц
+        # не сдвигаются от вставок в конец, поэтому их удобно кэшировать
+        with self.manager.read() as conn:
+            return conn.execute(
+                self._records_select(file_type, with_version=True) + ' WHERE r.id > ? ORDER BY r.id LIMIT ?',
+                (after_id, limit)
+            ).fetchall()
+
+    def data_version(self):
+        return self.manager.data_version()
+
+    @instrumentation.timed('db.get_records_by_ids')
+    def get_records_by_ids(self, file_type, ids, batch_size=500):
+        ids = list(ids)
+        records = []
+        with self.manager.read() as conn:
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                placeholders = ', '.join('?' * len(batch))
+                records.extend(conn.execute(
+                    self._records_select(file_type, with_version=True) + f' WHERE r.id IN ({placeholders})',
+                    batch
+                ).fetchall())
+        return records
+
+    def last_change(self):
+        with self.manager.read() as conn:
+            return conn.execute('SELECT coalesce(max(seq), 0) FROM change_log').fetchone()[0]
+
+    @instrumentation.timed('db.get_changes')
+    def get_changes(self, file_type, since, limit=CHANGE_FEED_LIMIT):
+        # Изменения реестра после seq = since: (новый seq, измененные записи,
+        # id удаленных). None - журнал уже обрезан или изменений слишком много,
+        # реестр нужно перечитать целиком
+        with self.manager.read() as conn:
+            # Верхняя граница фиксируется заранее: изменения, пришедшие во
+            # время чтения, попадут в следующий запрос
+            last, first = conn.execute('SELECT coalesce(max(seq), 0), min(seq) FROM change_log').fetchone()
+            if last <= since:
+                return since, [], []
+            if first is not None and first > since + 1:
+                return None
+            rows = conn.execute(
+                'SELECT record_id, op FROM change_log WHERE seq > ? AND seq <= ? AND file_type = ? '
+                'ORDER BY seq LIMIT ?',
+                (since, last, file_type, limit + 1)
+            ).fetchall()
+        if len(rows) > limit:
+            return None
+        # Для каждой записи важна только последняя операция
+        ops = dict(rows)
+        deleted = [record_id for record_id, op in ops.items() if op == 'D']
+        changed = [record_id for record_id, op in ops.items() if op != 'D']
+        return last, self.get_records_by_ids(file_type, changed), deleted
+
+    @instrumentation.timed('db.get_record')
+    def get_record(self, file_type, record_id):
+        # Одна строка в том же виде, что и в get_all_records (с вычисляемыми колонками)
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._records_select(file_type, with_version=True) + ' WHERE r.id = ?',
+                           (record_id,))
+            return cursor.fetchone()
+
+    @instrumentation.timed('db.update_record')
+    def update_record(self, file_type, record_id, column, value, editor=None, expected_version=None):
+        # Значение, редактор и версия меняются одним UPDATE. С expected_version
+        # это сравнение с обменом: если строку уже изменил кто-то другой,
+        # ничего не записывается и возникает ConflictError. Возвращает новую версию
+        table = self.get_table_name(file_type)
+        assignments = [f'{quote_column(column)} = :value']
+        date_column, due_column = DUE_DATE_COLUMNS[file_type]
+        if column == date_column:
+            # Срок оплаты пересчитывается тем же UPDATE, без повторной записи строки
+            assignments.append(f'{quote_column(due_column)} = {due_date_sql(":value")}')
+        if editor is not None:
+            assignments.append('"Редактор" = :editor')
+        assignments.append('row_version = row_version + 1')
+        condition = 'id = :id'
+        if expected_version is not None:
+            condition += ' AND row_version = :version'
+        if column in DATE_COLUMNS[file_type]:
+            value = to_iso_date(value)
+        params = {'value': value, 'editor': editor, 'id': record_id, 'version': expected_version}
+        with self.manager.transaction() as conn:
+            rows = conn.execute(f'''
+                UPDATE {table}
+                SET {', '.join(assignments)}
+                WHERE {condition}
+                RETURNING row_version
+            ''', params).fetchall()
+        if not rows:
+            # Текущее состояние читается уже после снятия блокировки записи
+            raise ConflictError(record_id, self.get_record(file_type, record_id))
+        return rows[0][0]
+
+    def _insert_values(self, file_type, names):
+        names = list(names)
+        values = [f'?{i}' for i in range(1, len(names) + 1)]
+        # Пустой срок оплаты вычисляется из даты заключения прямо в INSERT
+        date_column, due_column = DUE_DATE_COLUMNS[file_type]
+        if date_column in names:
+            date_param = values[names.index(date_column)]
+            if due_column in names:
+                i = names.index(due_column)
+                values[i] = f"COALESCE(NULLIF({values[i]}, ''), {due_date_sql(date_param)})"
+            else:
+                names.append(due_column)
+                values.append(due_date_sql(date_param))
+        return [quote_column(col) for col in names], values
+
+    def _insert_sql(self, file_type, names):
+        columns, values = self._insert_values(file_type, names)
+        return f'''INSERT INTO {self.get_table_name(file_type)} ({', '.join(columns)})
+                   VALUES ({', '.join(values)})'''
+
+    def _upsert_sql(self, file_type, names):
+        # Строка с тем же ключом обновляется, только если изменился хэш содержимого.
+        # Строки без ключа ("б/н", без даты) под частичный индекс не попадают и
+        # всегда добавляются; повторы из того же листа отсеивает import_rows
+        table = self.get_table_name(file_type)
+        names = list(names)
+        columns, values = self._insert_values(file_type, names)
+        number, date_column = [quote_column(col) for col in BUSINESS_KEYS[file_type]]
+        assignments = [
+            f'{quote_column(col)} = excluded.{quote_column(col)}'
+            for col in names + [DUE_DATE_COLUMNS[file_type][1]] if col != 'content_hash'
+        ]
+        assignments.append('content_hash = excluded.content_hash')
+        assignments.append(f'row_version = {table}.row_version + 1')
+        return f'''INSERT INTO {table} ({', '.join(columns)})
+                   VALUES ({', '.join(values)})
+                   ON CONFLICT ({number}, {date_column})
+                   WHERE {business_key_condition(number, date_column)}
+                   DO UPDATE SET {', '.join(dict.fromkeys(assignments))}
+                   WHERE {table}.content_hash IS NOT excluded.content_hash'''
+
+    @staticmethod
+    def content_hash(row):
+        return hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def has_business_key(number, day):
+        # То же условие, что business_key_condition в частичном индексе
+        return number is not None and number not in ('', 'б/н') and day is not None
+
+    def _ledger_keyless(self, cursor, file_type, path, sheet):
+        # Хэши строк без ключа, которые журнал импорта связал с этим листом
+        # этого файла: {хэш: сколько таких строк}
+        table = self.get_table_name(file_type)
+        number, date_column = [f't.{quote_column(col)}' for col in BUSINESS_KEYS[file_type]]
+        return Counter(dict(cursor.execute(f'''
+            SELECT t.content_hash, count(*)
+            FROM import_ledger l
+            JOIN import_ledger_rows r ON r.ledger_id = l.id
+            JOIN {table} t ON t.id = r.record_id
+            WHERE l.file_type = ? AND l.path = ? AND r.sheet = ?
+              AND NOT ({business_key_condition(number, date_column)})
+            GROUP BY t.content_hash
+        ''', (file_type, path, sheet)).fetchall()))
+
+    def _seen_keyless(self, row, key_positions, known):
+        # Одинаковых строк в листе может быть несколько: каждая из уже
+        # загруженных засчитывает только одну строку файла
+        number, day = [row[i] if i is not None else None for i in key_positions]
+        if self.has_business_key(number, day) or not known[row[-1]]:
+            return False
+        known[row[-1]] -= 1
+        return True
+
+    @instrumentation.timed('db.import_rows')
+    def import_rows(self, file_type, columns, chunks, progress=None, total=None, upsert=True,
+                    row_hashes=None, source=None):
+        # Пачки строк пишутся в одной транзакции; progress(загружено, всего)
+        # вызывается после каждой пачки. В режиме upsert строки сопоставляются
+        # по ключу BUSINESS_KEYS и перезаписываются только при изменении.
+        # Строка без ключа пропускается, только если такая же строка уже
+        # загружена из того же листа: source = (путь, лист) по журналу импорта;
+        # без source такие строки всегда добавляются.
+        # В row_hashes (список) собираются хэши строк для журнала импорта.
+        # Даты приводятся к ГГГГ-ММ-ДД до хэширования, нераспознанная дата -
+        # ValueError и откат всего импорта
+        names = list(columns) + ['content_hash']
+        dates = [i for i, col in enumerate(columns) if col in DATE_COLUMNS[file_type]]
+        key_positions = [names.index(col) if col in names else None for col in BUSINESS_KEYS[file_type]]
+        sql, order = positional(self._upsert_sql(file_type, names) if upsert
+                                else self._insert_sql(file_type, names))
+        table = self.get_table_name(file_type)
+        count = changed = 0
+        with self.manager.transaction() as conn:
+            cursor = conn.cursor()
+            last_id = cursor.execute(f'SELECT coalesce(max(id), 0) FROM {table}').fetchone()[0]
+            known = self._ledger_keyless(cursor, file_type, *source) if upsert and source else Counter()
+            for chunk in chunks:
+                rows = []
+                for row in chunk:
+                    row = list(row)
+                    for i in dates:
+                        row[i] = to_iso_date(row[i])
+                    row.append(self.content_hash(row))
+                    rows.append(row)
+                if row_hashes is not None:
+                    row_hashes.extend(row[-1] for row in rows)
+                if known:
+                    rows = [row for row in rows if not self._seen_keyless(row, key_positions, known)]
+                cursor.executemany(sql, ([row[i] for i in order] for row in rows))
+                count += len(chunk)
+                changed += max(cursor.rowcount, 0)
+                if progress:
+                    progress(count, total)
+            # id растут монотонно (AUTOINCREMENT): новые строки - это id больше прежнего максимума
+            inserted = cursor.execute(f'SELECT count(*) FROM {table} WHERE id > ?', (last_id,)).fetchone()[0]
+            # Журнал изменений растет в основном от импорта - здесь же и обрезается
+            cursor.execute('DELETE FROM change_log WHERE seq <= (SELECT max(seq) FROM change_log) - ?',
+                           (CHANGE_LOG_KEEP,))
+        updated = max(changed - inserted, 0)
+        return {'inserted': inserted, 'updated': updated, 'unchanged': count - inserted - updated}
+
+    def find_import(self, file_type, path):
+        with self.manager.read() as conn:
+            row = conn.execute(
+                'SELECT id, size, mtime_ns, file_hash FROM import_ledger WHERE file_type = ? AND path = ?',
+                (file_type, path)
+            ).fetchone()
+            return self._ledger_entry(conn, row)
+
+    def find_import_by_hash(self, file_type, file_hash):
+        with self.manager.read() as conn:
+            row = conn.execute(
+                'SELECT id, size, mtime_ns, file_hash FROM import_ledger '
+                'WHERE file_type = ? AND file_hash = ? ORDER BY id DESC LIMIT 1',
+                (file_type, file_hash)
+            ).fetchone()
+            return self._ledger_entry(conn, row)
+
+    @staticmethod
+    def _ledger_entry(conn, row):
+        if row is None:
+            return None
+        sheets = dict(conn.execute(
+            'SELECT sheet, sheet_hash FROM import_ledger_sheets WHERE ledger_id = ?', (row[0],)
+        ).fetchall())
+        return {'id': row[0], 'size': row[1], 'mtime_ns': row[2], 'file_hash': row[3], 'sheets': sheets}
+
+    def record_import(self, file_type, path, size, mtime_ns, file_hash, sheets):
+        # sheets: лист -> (отпечаток, хэши строк); None вместо хэшей - лист не
+        # перечитывался, его строки в журнале остаются прежними
+        table = self.get_table_name(file_type)
+        with self.manager.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO import_ledger (file_type, path, size, mtime_ns, file_hash, imported_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_type, path) DO UPDATE SET
+                    size = excluded.size, mtime_ns = excluded.mtime_ns,
+                    file_hash = excluded.file_hash, imported_at = excluded.imported_at
+            ''', (file_type, path, size, mtime_ns, file_hash, datetime.now().isoformat(timespec='seconds')))
+            ledger_id = cursor.execute(
+                'SELECT id FROM import_ledger WHERE file_type = ? AND path = ?', (file_type, path)
+            ).fetchone()[0]
+            stale = [
+                sheet for (sheet,) in cursor.execute(
+                    'SELECT sheet FROM import_ledger_sheets WHERE ledger_id = ?', (ledger_id,)
+                ).fetchall()
+                if sheet not in sheets
+            ]
+            for sheet in stale:
+                cursor.execute('DELETE FROM import_ledger_sheets WHERE ledger_id = ? AND sheet = ?',
+                               (ledger_id, sheet))
+                cursor.execute('DELETE FROM import_ledger_rows WHERE ledger_id = ? AND sheet = ?',
+                               (ledger_id, sheet))
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS import_hashes (hash TEXT PRIMARY KEY)')
+            for sheet, (sheet_hash, hashes) in sheets.items():
+                cursor.execute('''
+                    INSERT INTO import_ledger_sheets (ledger_id, sheet, sheet_hash) VALUES (?, ?, ?)
+                    ON CONFLICT (ledger_id, sheet) DO UPDATE SET sheet_hash = excluded.sheet_hash
+                ''', (ledger_id, sheet, sheet_hash))
+                if hashes is None:
+                    continue
+                cursor.execute('DELETE FROM import_ledger_rows WHERE ledger_id = ? AND sheet = ?',
+                               (ledger_id, sheet))
+                cursor.execute('DELETE FROM temp.import_hashes')
+                cursor.executemany('INSERT OR IGNORE INTO temp.import_hashes VALUES (?)',
+                                   ((h,) for h in hashes))
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO import_ledger_rows (ledger_id, sheet, record_id)
+                    SELECT ?, ?, id FROM {table}
+                    WHERE content_hash IN (SELECT hash FROM temp.import_hashes)
+                ''', (ledger_id, sheet))
+            cursor.execute('DELETE FROM temp.import_hashes')
+        return ledger_id
+
+    @instrumentation.timed('db.import_from_dataframe')
+    def import_from_dataframe(self, file_type, df, chunk_size=1000, upsert=True):
+        import pandas as pd
+        # Вычисляемые колонки заполняет сама БД
+        calculated = self.calculated_columns[file_type]
+        df = df.drop(columns=[c for c in calculated if c in df.columns])
+        # Даты datetime64 переводятся здесь целой колонкой, текстовые -
+        # в import_rows
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime('%Y-%m-%d')
+        df = df.astype(object).where(pd.notnull(df), None)
+        chunks = (
+            df.iloc[start:start + chunk_size].values.tolist()
+            for start in range(0, len(df), chunk_size)
+        )
+        return self.import_rows(file_type, df.columns.tolist(), chunks, total=len(df), upsert=upsert)
+
+    @instrumentation.timed('db.recalculate')
+    def recalculate(self, file_type):
+        # Контрольные колонки вычисляет сама БД; здесь дозаполняются пустые
+        # сроки оплаты и перестраивается полнотекстовый индекс реестра
+        table = self.get_table_name(file_type)
+        date_column, due_column = [quote_column(col) for col in DUE_DATE_COLUMNS[file_type]]
+        fts = f'{table}_fts'
+        with self.manager.transaction() as conn:
+            due_dates = conn.execute(f'''
+                UPDATE {table}
+                SET {due_column} = {due_date_sql(date_column)}, row_version = row_version + 1
+                WHERE ({due_column} IS NULL OR {due_column} = '')
+                  AND {due_date_sql(date_column)} IS NOT NULL
+            ''').rowcount
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            # Статистика для планировщика - в той же транзакции, под блокировкой
+            # записи: писатель не используется одновременно из двух потоков
+            conn.execute('PRAGMA optimize')
+        return {'due_dates': due_dates}
+
+    @instrumentation.timed('db.get_records_between')
+    def get_records_between(self, file_type, column, start=None, end=None):
+        # Границы - даты ISO включительно; запрос идет по индексу колонки
+        if column not in DATE_COLUMNS[file_type]:
+            raise ValueError(f"Колонка {column} не содержит дат")
+        quoted = 'r.' + quote_column(column)
+        conditions, params = [], []
+        if start:
+            conditions.append(f'{quoted} >= ?')
+            params.append(to_iso_date(start))
+        if end:
+            conditions.append(f'{quoted} <= ?')
+            params.append(to_iso_date(end))
+        if not conditions:
+            conditions.append(f'{quoted} IS NOT NULL')
+        with self.manager.read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._records_select(file_type)
+                + f' WHERE {" AND ".join(conditions)} ORDER BY {quoted}',
+                params
+            )
+            return cursor.fetchall()
+
+    @instrumentation.timed('db.search_records')
+    def search_records(self, file_type, text, limit=None):
+        # Полнотекстовый поиск по индексу FTS5; id записей по убыванию релевантности
+        query = fts_query(text)
+        if not query:
+            return []
+        fts = f'{self.get_table_name(file_type)}_fts'
+        sql = f'SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY bm25({fts})'
+        params = [query]
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self.manager.read() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+
+    def get_due_in_month(self, file_type, year, month):
+        return self.get_records_between(file_type, DUE_DATE_COLUMNS[file_type][1],
+                                        *month_range(year, month))
+
+    def get_paid_in_quarter(self, file_type, year, quarter):
+        return self.get_records_between(file_type, 'Фактическая дата оплаты',
+                                        *quarter_range(year, quarter))
+
+
+_shared_handlers = {}
+_shared_lock = threading.Lock()
+
+
+def get_database(db_name=DB_NAME):
+    # Все окна работают через один обработчик и общий пул соединений. Если
+    # задан адрес сервера (SERVER_ENV), вместо файла БД используется сервер
+    server = os.environ.get(SERVER_ENV)
+    key = server or db_name
+    with _shared_lock:
+        handler = _shared_handlers.get(key)
+        if handler is None:
+            if server:
+                from remote import RemoteDatabaseHandler
+                handler = RemoteDatabaseHandler(server)
+            else:
+                handler = DatabaseHandler(db_name)
+            _shared_handlers[key] = handler
+        return handler
@@ -0,0 +1,161 @@
+import gzip
+import io
+import re
+from datetime import date, datetime
+from xml.sax.saxutils import escape, quoteattr
+
+import instrumentation
+from database import DATE_COLUMNS, REGISTER_COLUMNS, to_display_date
+
+XML_SKIP_COLUMNS = ('Редактор', 'id')
+
+# Форматы Excel вместо строк: разделители разрядов и запятую подставляет
+# сам Excel по региональным настройкам, значения остаются числами и датами
+MONEY_FORMAT = '#,##0.00'
+DAYS_FORMAT = '0'
+DATE_FORMAT = 'DD.MM.YYYY'
+
+MONEY_COLUMNS = {
+    'Цена ЗУ по договору, руб.',
+    'Размер платы за увеличение площади ЗУ, руб.',
+    'Оплачено',
+    'начисленные ПЕНИ',
+    'оплачено пеней',
+    'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+    'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
+}
+DAYS_COLUMNS = {'Контроль по дате ("-" - просрочка)'}
+
+
+def xml_tag(column):
+    # Валидное имя тега из названия колонки: "Площадь ЗУ, кв. м" -> Площадь_ЗУ_кв_м
+    tag = re.sub(r'[^a-zA-Zа-яА-Я0-9_]', '_', column)
+    return re.sub(r'_+', '_', tag).strip('_')
+
+
+def xml_value(value, is_date):
+    if value is None:
+        return ''
+    if is_date:
+        return to_display_date(value)
+    return str(value)
+
+
+def open_output(path, compress=None):
+    # compress=None - сжатие по расширению .gz
+    if compress is None:
+        compress = path.lower().endswith('.gz')
+    if compress:
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+@instrumentation.timed('export.xml')
+def write_xml_report(db, file_type, path, compress=None, date_column=None, start=None, end=None,
+                     overdue_only=False, progress=None, progress_every=1000):
+    # Строки идут из курсора прямо в файл: дерево в памяти не строится.
+    # Открывающие и закрывающие теги готовятся один раз на набор колонок,
+    # запись собирается в одну строку и экранируются только значения
+    columns = [col for col in REGISTER_COLUMNS[file_type] if col not in XML_SKIP_COLUMNS]
+    dates = set(DATE_COLUMNS[file_type])
+    # В записи из БД позиция 0 - id, далее колонки в том же порядке
+    fields = []
+    for i, col in enumerate(columns, start=1):
+        tag = xml_tag(col)
+        fields.append((i, f'<{tag}>', f'</{tag}>', f'<{tag} />', col in dates))
+    rows = db.iter_records(file_type, columns, date_column=date_column, start=start, end=end,
+                           overdue_only=overdue_only)
+    count = 0
+    with open_output(path, compress) as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='\n') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f"<Реестр ВерсияФормата={quoteattr('1.0')} "
+                f"ДатаФормирования={quoteattr(datetime.now().strftime('%Y-%m-%d'))}>")
+        for row in rows:
+            parts = ['<Запись>']
+            for i, open_tag, close_tag, empty_tag, is_date in fields:
+                value = xml_value(row[i], is_date)
+                if value:
+                    parts += (open_tag, escape(value), close_tag)
+                else:
+                    parts.append(empty_tag)
+            parts.append('</Запись>')
+            f.write(''.join(parts))
+            count += 1
+            if progress and count % progress_every == 0:
+                progress(count)
+        f.write('</Реестр>')
+    return count
+
+
+def excel_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        # Нераспознанные при импорте значения выгружаются как есть
+        return value
+
+
+@instrumentation.timed('export.excel')
+def write_excel(db, file_type, path, include_editor=False, progress=None, progress_every=1000):
+    # Книга в режиме write_only: строки сразу уходят в XML листа, память не
+    # растет с числом строк. Контрольные колонки уже посчитаны в БД
+    # (вычисляемые колонки), числа и даты пишутся с форматами Excel
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    columns = [col for col in REGISTER_COLUMNS[file_type] if include_editor or col != 'Редактор']
+    dates = set(DATE_COLUMNS[file_type])
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+
+    # Формат числа - на колонку; ячейкам он задается через number_format
+    fields = []
+    for i, col in enumerate(columns, start=1):
+        if col in dates:
+            fields.append((i, DATE_FORMAT, excel_date))
+        elif col in MONEY_COLUMNS:
+            fields.append((i, MONEY_FORMAT, None))
+        elif col in DAYS_COLUMNS:
+            fields.append((i, DAYS_FORMAT, None))
+        else:
+            fields.append((i, None, None))
+        worksheet.column_dimensions[get_column_letter(i)].width = min(max(len(col), 12), 50)
+    worksheet.freeze_panes = 'A2'
+
+    bold = Font(bold=True)
+    header = []
+    for col in columns:
+        cell = WriteOnlyCell(worksheet, value=col)
+        cell.font = bold
+        header.append(cell)
+    worksheet.append(header)
+
+    # Ячейка с форматом создается только для непустых значений
+    count = 0
+    for row in db.iter_records(file_type, columns):
+        values = []
+        for i, number_format, convert in fields:
+            value = row[i]
+            if value is None or value == '':
+                values.append(None)
+                continue
+            if convert is not None:
+                value = convert(value)
+            if number_format is not None and not isinstance(value, str):
+                cell = WriteOnlyCell(worksheet, value=value)
+                cell.number_format = number_format
+                values.append(cell)
+            else:
+                values.append(value)
+        worksheet.append(values)
+        count += 1
+        if progress and count % progress_every == 0:
+            progress(count)
+    # Сжатие книги в zip - заметная часть времени выгрузки
+    with instrumentation.span('export.excel.save', rows=count):
+        workbook.save(path)
+    return count
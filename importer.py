@@ -0,0 +1,492 @@
+import hashlib
+import os
+import posixpath
+import re
+import unicodedata
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import date, datetime, time
+
+import instrumentation
+from database import DATE_COLUMNS, NUMERIC_COLUMNS, REGISTER_COLUMNS
+
+CHUNK_SIZE = 1000
+
+# Заголовки из старых выгрузок, которые не совпадают с названиями колонок
+COLUMN_MAPPING = {
+    'кадастровый номер зу адрес зу': 'Кадастровый номер ЗУ, адрес ЗУ',
+    'площадь зу кв м': 'Площадь ЗУ, кв. м',
+    'пп6 п2 ст 393 ст 3917 ст 3920 зк рф': 'Основание предоставления',
+    'контроль по дате - просрочка': 'Контроль по дате ("-" - просрочка)',
+    'оплачено руб': 'Оплачено',
+    'начисленные пени': 'начисленные ПЕНИ',
+    'оплачено пеней': 'оплачено пеней'
+}
+
+# Вычисляемые колонки и редактора заполняет база
+SKIP_COLUMNS = {
+    'Контроль по дате ("-" - просрочка)',
+    'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
+    'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)',
+    'Редактор'
+}
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+SHARED_STRING_RE = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+ZIP_MAGIC = b'PK\x03\x04'
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+EXCEL_EXTENSIONS = ('.xls', '.xlsx', '.xlsm')
+
+DATE_FORMATS = ('%d.%m.%Y', '%d.%m.%y', '%Y-%m-%d', '%d/%m/%Y')
+
+
+class NoRegisterColumns(ValueError):
+    pass
+
+
+def header_key(name):
+    # Ключ сравнения заголовков: без регистра, кавычек и знаков препинания
+    name = unicodedata.normalize('NFKC', str(name)).lower()
+    name = re.sub(r'[^\w\s-]', ' ', name)
+    return ' '.join(name.split())
+
+
+def import_columns(file_type):
+    return [col for col in REGISTER_COLUMNS[file_type] if col not in SKIP_COLUMNS]
+
+
+def parse_number(value):
+    if value is None or isinstance(value, bool):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = re.sub(r'\s+', '', str(value)).replace(',', '.')
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def parse_date(value):
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, time):
+        return None
+    value = str(value).strip().split(' ')[0]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def parse_text(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # Номера документов Excel отдает как 123.0
+        return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%d.%m.%Y')
+    value = str(value).strip()
+    return value or None
+
+
+class RowNormalizer:
+    # Приводит строки листа к колонкам реестра по строке заголовков
+    def __init__(self, file_type, header):
+        self.columns = import_columns(file_type)
+        lookup = {header_key(col): col for col in REGISTER_COLUMNS[file_type]}
+        lookup.update({header_key(key): col for key, col in COLUMN_MAPPING.items()})
+        positions = {}
+        for i, name in enumerate(header):
+            if name is None:
+                continue
+            col = lookup.get(header_key(name))
+            if col in self.columns and col not in positions:
+                positions[col] = i
+        if not positions:
+            raise NoRegisterColumns("В файле не найдено ни одной колонки реестра")
+        numeric = set(NUMERIC_COLUMNS[file_type])
+        dates = set(DATE_COLUMNS[file_type])
+        self.converters = []
+        for col in self.columns:
+            if col in numeric:
+                convert = parse_number
+            elif col in dates:
+                convert = parse_date
+            else:
+                convert = parse_text
+            self.converters.append((positions.get(col), convert))
+        self.missing = [col for col in self.columns if col not in positions]
+
+    def __call__(self, row):
+        values = []
+        for position, convert in self.converters:
+            value = row[position] if position is not None and position < len(row) else None
+            if isinstance(value, str) and not value.strip():
+                value = None
+            values.append(convert(value))
+        return values
+
+
+def is_empty_row(row):
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in row)
+
+
+def iter_xlsx_rows(path, sheet=None):
+    # read_only: строки читаются из XML листа по одной, книга в память не грузится
+    import openpyxl
+    # Файловый объект вместо пути: openpyxl проверяет расширение, а формат
+    # уже определен по сигнатуре
+    with open(path, 'rb') as f:
+        workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+            yield worksheet.max_row
+            for row in worksheet.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+
+
+def iter_xls_rows(path, sheet=None):
+    # on_demand: загружается только нужный лист
+    import xlrd
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        worksheet = book.sheet_by_name(sheet) if sheet is not None else book.sheet_by_index(0)
+        yield worksheet.nrows
+        for r in range(worksheet.nrows):
+            row = []
+            for cell in worksheet.row(r):
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    row.append(xlrd.xldate_as_datetime(cell.value, book.datemode))
+                elif cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                    row.append(None)
+                else:
+                    row.append(cell.value)
+            yield row
+    finally:
+        book.release_resources()
+
+
+def file_hash(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _xlsx_shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, element in ET.iterparse(f):
+            if element.tag == SHEET_NS + 'si':
+                strings.append(''.join(t.text or '' for t in element.iter(SHEET_NS + 't')))
+                element.clear()
+    return strings
+
+
+def xlsx_sheet_fingerprints(path):
+    # Отпечаток листа без разбора ячеек: CRC XML листа и стилей (форматы дат)
+    # плюс значения общих строк, на которые лист ссылается. Правка одного
+    # листа не меняет отпечатки остальных, хотя sharedStrings общий для книги
+    with zipfile.ZipFile(path) as archive:
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {}
+        for rel in rels.iter(PACKAGE_REL_NS + 'Relationship'):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[rel.get('Id')] = target
+        styles_crc = archive.getinfo('xl/styles.xml').CRC if 'xl/styles.xml' in archive.namelist() else 0
+        strings = None
+        fingerprints = {}
+        for sheet in workbook.iter(SHEET_NS + 'sheet'):
+            member = targets[sheet.get(REL_NS + 'id')]
+            digest = hashlib.sha256(f'{archive.getinfo(member).CRC}:{styles_crc}'.encode())
+            data = archive.read(member)
+            indexes = sorted({int(i) for i in SHARED_STRING_RE.findall(data)})
+            if indexes:
+                if strings is None:
+                    strings = _xlsx_shared_strings(archive)
+                for i in indexes:
+                    digest.update(f'{i}\x1f{strings[i]}\x1e'.encode('utf-8'))
+            fingerprints[sheet.get('name')] = digest.hexdigest()
+        return fingerprints
+
+
+def xls_sheet_fingerprints(path):
+    # В .xls нет отдельных частей листа - хэшируются значения ячеек
+    import xlrd
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        fingerprints = {}
+        for name in book.sheet_names():
+            worksheet = book.sheet_by_name(name)
+            digest = hashlib.sha256()
+            for r in range(worksheet.nrows):
+                digest.update(repr(worksheet.row_values(r)).encode('utf-8'))
+            fingerprints[name] = digest.hexdigest()
+            book.unload_sheet(name)
+        return fingerprints
+    finally:
+        book.release_resources()
+
+
+def detect_engine(path):
+    # Формат определяется по сигнатуре, а не по расширению: .xls нередко
+    # оказывается переименованным .xlsx и наоборот
+    with open(path, 'rb') as f:
+        magic = f.read(8)
+    if magic.startswith(ZIP_MAGIC):
+        return 'openpyxl'
+    if magic == OLE2_MAGIC:
+        return 'xlrd'
+    raise ValueError(f"Файл {os.path.basename(path)} не является книгой Excel")
+
+
+def sheet_fingerprints(path):
+    if detect_engine(path) == 'xlrd':
+        return xls_sheet_fingerprints(path)
+    return xlsx_sheet_fingerprints(path)
+
+
+def iter_rows(path, sheet=None):
+    if detect_engine(path) == 'xlrd':
+        return iter_xls_rows(path, sheet)
+    return iter_xlsx_rows(path, sheet)
+
+
+def iter_chunks(file_type, path, sheet=None, chunk_size=CHUNK_SIZE):
+    # Первое значение - оценка числа строк, далее нормализованные пачки строк
+    rows = iter_rows(path, sheet)
+    total = next(rows)
+    normalizer = None
+    chunk = []
+    for row in rows:
+        if is_empty_row(row):
+            continue
+        if normalizer is None:
+            normalizer = RowNormalizer(file_type, row)
+            yield normalizer.columns, total
+            continue
+        chunk.append(normalizer(row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if normalizer is None:
+        raise NoRegisterColumns("Файл не содержит строки заголовков")
+    if chunk:
+        yield chunk
+
+
+def import_file(db, file_type, path, sheet=None, progress=None, chunk_size=CHUNK_SIZE, upsert=True,
+                row_hashes=None, source=None):
+    # Файл читается и пишется пачками в одной транзакции: память не зависит
+    # от размера файла, при ошибке база остается без изменений.
+    # Возвращает счетчики добавленных, обновленных и неизмененных строк
+    chunks = iter_chunks(file_type, path, sheet, chunk_size)
+    columns, total = next(chunks)
+    return db.import_rows(file_type, columns, chunks, progress=progress, total=total, upsert=upsert,
+                          row_hashes=row_hashes, source=source)
+
+
+def _new_result():
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': False,
+            'sheets': 0, 'sheets_skipped': 0}
+
+
+def _add_counts(result, counts):
+    for key, value in counts.items():
+        result[key] += value
+
+
+@instrumentation.timed('import.plan')
+def plan_workbook(db, file_type, path, force=False):
+    # Сверка с журналом импорта. None - файл уже загружен целиком; иначе
+    # план: листы с отпечатками и признаком, нужно ли их разбирать
+    stat = os.stat(path)
+    entry = db.find_import(file_type, path)
+    if not force and entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return None
+
+    digest = file_hash(path)
+    if not force:
+        same = entry if entry and entry['file_hash'] == digest else db.find_import_by_hash(file_type, digest)
+        if same:
+            sheets = {sheet: (fingerprint, None) for sheet, fingerprint in same['sheets'].items()}
+            db.record_import(file_type, path, stat.st_size, stat.st_mtime_ns, digest, sheets)
+            return None
+
+    known = {} if force or entry is None else entry['sheets']
+    return {
+        'path': path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'file_hash': digest,
+        'sheets': {
+            sheet: (fingerprint, known.get(sheet) != fingerprint)
+            for sheet, fingerprint in sheet_fingerprints(path).items()
+        }
+    }
+
+
+@instrumentation.timed('import.workbook')
+def import_workbook(db, file_type, path, progress=None, upsert=True, force=False):
+    # Импорт всех листов книги с учетом журнала импорта: тот же файл (по
+    # размеру и времени изменения, затем по SHA-256) пропускается целиком,
+    # а в измененной книге заново разбираются только измененные листы
+    path = os.path.abspath(path)
+    result = _new_result()
+    plan = plan_workbook(db, file_type, path, force)
+    if plan is None:
+        result['skipped'] = True
+        return result
+
+    sheets = {}
+    for sheet, (fingerprint, changed) in plan['sheets'].items():
+        result['sheets'] += 1
+        if not changed:
+            result['sheets_skipped'] += 1
+            sheets[sheet] = (fingerprint, None)
+            continue
+        hashes = []
+        try:
+            with instrumentation.span('import.sheet', sheet=sheet):
+                counts = import_file(db, file_type, path, sheet, progress=progress, upsert=upsert,
+                                     row_hashes=hashes, source=(path, sheet))
+        except NoRegisterColumns:
+            # Сводные и служебные листы без колонок реестра
+            counts = {}
+        _add_counts(result, counts)
+        sheets[sheet] = (fingerprint, hashes)
+    db.record_import(file_type, plan['path'], plan['size'], plan['mtime_ns'], plan['file_hash'], sheets)
+    return result
+
+
+def collect_files(paths):
+    # Файлы и папки (рекурсивно) -> список книг Excel без временных файлов ~$
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith('~$'):
+                        files.append(os.path.join(folder, name))
+        else:
+            files.append(path)
+    return [os.path.abspath(path) for path in files]
+
+
+def parse_sheet(file_type, path, sheet):
+    # Выполняется в отдельном процессе: разбор и нормализация листа целиком
+    try:
+        chunks = iter_chunks(file_type, path, sheet)
+        columns, _ = next(chunks)
+    except NoRegisterColumns:
+        return None, []
+    rows = []
+    for chunk in chunks:
+        rows.extend(chunk)
+    return columns, rows
+
+
+@instrumentation.timed('import.batch')
+def batch_import(db, file_type, paths, workers=None, progress=None, upsert=True, force=False):
+    # Несколько книг и папок: листы разбираются параллельно в пуле процессов,
+    # запись идет через единственного писателя - одна транзакция на лист.
+    # progress(обработано листов, всего листов); ошибки копятся по файлам
+    result = _new_result()
+    result.update(files=0, files_skipped=0, errors=[])
+    plans = []
+    for path in collect_files(paths):
+        result['files'] += 1
+        try:
+            plan = plan_workbook(db, file_type, path, force)
+        except Exception as e:
+            result['errors'].append((path, str(e)))
+            continue
+        if plan is None:
+            result['files_skipped'] += 1
+        else:
+            plans.append(plan)
+
+    tasks = [(plan, sheet) for plan in plans for sheet, (_, changed) in plan['sheets'].items() if changed]
+    for plan in plans:
+        result['sheets'] += len(plan['sheets'])
+        result['sheets_skipped'] += sum(1 for _, changed in plan['sheets'].values() if not changed)
+        plan['hashes'] = {}
+        plan['pending'] = sum(1 for _, changed in plan['sheets'].values() if changed)
+    total = len(tasks)
+    done = 0
+
+    def finish(plan, sheet, future):
+        nonlocal done
+        done += 1
+        try:
+            columns, rows = future.result()
+            hashes = []
+            if rows:
+                counts = db.import_rows(file_type, columns, [rows], total=len(rows), upsert=upsert,
+                                        row_hashes=hashes, source=(plan['path'], sheet))
+                _add_counts(result, counts)
+            plan['hashes'][sheet] = hashes
+        except Exception as e:
+            plan['failed'] = True
+            result['errors'].append((f"{plan['path']} [{sheet}]", str(e)))
+        plan['pending'] -= 1
+        if plan['pending'] == 0 and not plan.get('failed'):
+            # Книга попадает в журнал, только когда записаны все ее листы
+            sheets = {
+                name: (fingerprint, plan['hashes'].get(name) if changed else None)
+                for name, (fingerprint, changed) in plan['sheets'].items()
+            }
+            db.record_import(file_type, plan['path'], plan['size'], plan['mtime_ns'],
+                             plan['file_hash'], sheets)
+        if progress:
+            progress(done, total)
+
+    for plan in plans:
+        if plan['pending'] == 0:
+            db.record_import(file_type, plan['path'], plan['size'], plan['mtime_ns'], plan['file_hash'],
+                             {name: (fingerprint, None) for name, (fingerprint, _) in plan['sheets'].items()})
+
+    workers = min(workers or os.cpu_count() or 1, total)
+    if workers <= 1:
+        # Один лист или одно ядро - пул процессов не нужен
+        for plan, sheet in tasks:
+            future = Future()
+            try:
+                future.set_result(parse_sheet(file_type, plan['path'], sheet))
+            except Exception as e:
+                future.set_exception(e)
+            finish(plan, sheet, future)
+        return result
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            pool.submit(parse_sheet, file_type, plan['path'], sheet): (plan, sheet)
+            for plan, sheet in tasks
+        }
+        for future in as_completed(futures):
+            finish(*futures[future], future)
+    finally:
+        # При отмене (исключение из progress) ждать оставшиеся листы не нужно
+        pool.shutdown(cancel_futures=True)
+    return result
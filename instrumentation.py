@@ -0,0 +1,320 @@
+# Замеры горячих путей: интервалы вокруг запросов к БД, перестройки
+# таблицы, этапов импорта и экспорта и обработчиков Tk; журнал медленных
+# запросов с планом выполнения; файл метрик с p50/p95 по операциям.
+# По умолчанию выключено: span() возвращает общий пустой контекст, timed()
+# проверяет один флаг. Включается переменной REGISTERS_METRICS=1, ключом
+# main.py --metrics, флажком в главном окне или enable()
+#
+#   with instrumentation.span('export.excel', rows=count):
+#       ...
+#   @instrumentation.timed('db.get_all_records')
+#   def get_all_records(...):
+import atexit
+import functools
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+METRICS_ENV = 'REGISTERS_METRICS'
+LOG_DIR = 'logs'
+METRICS_FILE = 'metrics.jsonl'
+SLOW_LOG_FILE = 'slow.jsonl'
+MAX_FILE_SIZE = 1024 * 1024
+BACKUP_COUNT = 3
+FLUSH_INTERVAL = 60  # с; сводка p50/p95 пишется раз в интервал и при выключении
+SLOW_QUERY_MS = 100
+SLOW_SPAN_MS = 250  # дольше этого окно заметно "висит"
+MAX_SAMPLES = 4096  # на операцию за интервал
+MAX_SQL_LENGTH = 2000
+EXPLAIN_PREFIXES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+# Параметр запроса вне строк и имен в кавычках: ?, ?NNN, :имя, @имя, $имя
+PARAMETER_RE = re.compile(r"'[^']*'|\"[^\"]*\"|(\?\d*|[:@$][^\W\d]\w*)")
+
+_enabled = False
+# Меняется при каждом включении и выключении: соединения БД сверяют с ним
+# свою трассировку при выдаче из пула
+_generation = 0
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_samples = {}
+_last_flush = time.monotonic()
+_settings = {'directory': LOG_DIR, 'slow_query_ms': SLOW_QUERY_MS, 'slow_span_ms': SLOW_SPAN_MS}
+_explain = {}
+_explain_lock = threading.Lock()
+
+
+class _NullSpan:
+    # Выключенный режим: ничего не измеряет и не создается заново
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('name', 'fields', 'started')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        record(self.name, time.perf_counter() - self.started, self.fields)
+        return False
+
+    def set(self, **fields):
+        # Поля, известные только к концу интервала (число строк и т.п.)
+        self.fields.update(fields)
+
+
+def enabled():
+    return _enabled
+
+
+def span(name, **fields):
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+def timed(name):
+    # Декоратор: вызов функции - интервал с именем name
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(directory=None, slow_query_ms=None, slow_span_ms=None):
+    global _enabled, _generation
+    with _lock:
+        if directory is not None:
+            _settings['directory'] = directory
+        if slow_query_ms is not None:
+            _settings['slow_query_ms'] = slow_query_ms
+        if slow_span_ms is not None:
+            _settings['slow_span_ms'] = slow_span_ms
+        if not _enabled:
+            _enabled = True
+            _generation += 1
+
+
+def disable():
+    global _enabled, _generation
+    with _lock:
+        if not _enabled:
+            return
+        _enabled = False
+        _generation += 1
+    flush()
+    _close_explain()
+
+
+def record(name, seconds, fields=None):
+    # Длительность операции; медленные пишутся в журнал сразу, остальные
+    # копятся до сводки
+    due = False
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = []
+        if len(samples) < MAX_SAMPLES:
+            samples.append(seconds)
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if seconds * 1000 >= _settings['slow_span_ms']:
+        _write(SLOW_LOG_FILE, {'kind': 'span', 'name': name, 'ms': round(seconds * 1000, 1),
+                               'thread': threading.current_thread().name, **(fields or {})})
+    if due:
+        flush()
+
+
+def percentile(values, fraction):
+    # Ближайший ранг по отсортированным значениям
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summary():
+    # Сводка по операциям за текущий интервал без сброса: {имя: {...}}
+    with _lock:
+        samples = {name: sorted(values) for name, values in _samples.items() if values}
+    return {name: _describe(values) for name, values in samples.items()}
+
+
+def _describe(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+        'total_ms': round(sum(values) * 1000, 1),
+    }
+
+
+def flush():
+    global _samples, _last_flush
+    with _lock:
+        samples, _samples = _samples, {}
+        _last_flush = time.monotonic()
+    stamp = datetime.now().isoformat(timespec='seconds')
+    for name, values in sorted(samples.items()):
+        if values:
+            _write(METRICS_FILE, {'time': stamp, 'op': name, **_describe(sorted(values))})
+
+
+def _rotate(path):
+    # metrics.jsonl -> metrics.jsonl.1 -> ... -> .BACKUP_COUNT (удаляется)
+    for number in range(BACKUP_COUNT - 1, 0, -1):
+        older = f'{path}.{number}'
+        if os.path.exists(older):
+            os.replace(older, f'{path}.{number + 1}')
+    os.replace(path, f'{path}.1')
+
+
+def _write(file_name, entry):
+    # Ошибка записи журнала не должна мешать работе программы
+    line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+    path = os.path.join(_settings['directory'], file_name)
+    with _write_lock:
+        try:
+            os.makedirs(_settings['directory'], exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > MAX_FILE_SIZE:
+                _rotate(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            print("Ошибка записи метрик:", e)
+
+
+# --- журнал медленных запросов ---
+
+class QueryTracer:
+    # Трассировка одного соединения. Курсор (database.Cursor) сообщает время
+    # execute/executemany и каждого fetch*; длительность запроса - их сумма.
+    # Запрос проверяется, когда курсор начинает следующий, выборка
+    # закончилась или соединение возвращается (finish)
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.open = {}  # курсор -> [sql, секунды, параметры]
+
+    def executed(self, cursor, sql, seconds, parameters=None):
+        self.done(cursor)
+        self.open[cursor] = [sql, seconds, parameters]
+
+    def fetched(self, cursor, seconds, exhausted):
+        entry = self.open.get(cursor)
+        if entry is None:
+            return
+        entry[1] += seconds
+        if exhausted:
+            self.done(cursor)
+
+    def done(self, cursor):
+        entry = self.open.pop(cursor, None)
+        if entry is not None:
+            self._check(*entry)
+
+    def finish(self):
+        entries = list(self.open.values())
+        self.open.clear()
+        for entry in entries:
+            self._check(*entry)
+
+    def _check(self, sql, seconds, parameters=None):
+        if seconds * 1000 < _settings['slow_query_ms']:
+            return
+        _write(SLOW_LOG_FILE, {
+            'kind': 'query',
+            'ms': round(seconds * 1000, 1),
+            'thread': threading.current_thread().name,
+            'sql': sql[:MAX_SQL_LENGTH],
+            'plan': explain(self.db_name, sql, parameters),
+        })
+
+
+def trace(conn, db_name):
+    # Ставит или снимает трассировку соединения, если режим менялся с
+    # прошлой выдачи соединения из пула
+    if conn.trace_generation == _generation:
+        return
+    conn.trace_generation = _generation
+    conn.tracer = QueryTracer(db_name) if _enabled else None
+
+
+def finish(conn):
+    tracer = conn.tracer
+    if tracer is not None:
+        tracer.finish()
+
+
+def null_parameters(sql):
+    # NULL на место каждого параметра: для плана значения не нужны
+    found = [match.group(1) for match in PARAMETER_RE.finditer(sql) if match.group(1)]
+    named = {name[1:]: None for name in found if name[0] != '?'}
+    if named:
+        return named
+    numbered = [int(name[1:]) for name in found if len(name) > 1]
+    return [None] * max(numbered + [len(found)])
+
+
+def explain(db_name, sql, parameters=None):
+    # План выполнения - на отдельном соединении только для чтения, чтобы не
+    # вмешиваться в транзакцию соединения, выполнившего запрос. Без
+    # параметров (executemany) подставляются NULL
+    if not sql.lstrip().upper().startswith(EXPLAIN_PREFIXES):
+        return None
+    if not parameters:
+        parameters = null_parameters(sql)
+    try:
+        with _explain_lock:
+            conn = _explain.get(db_name)
+            if conn is None:
+                from pathlib import Path
+                uri = Path(db_name).resolve().as_uri() + '?mode=ro'
+                conn = _explain[db_name] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        return [row[-1] for row in rows]
+    except sqlite3.Error as e:
+        return [f'не удалось получить план: {e}']
+
+
+def _close_explain():
+    with _explain_lock:
+        connections = list(_explain.values())
+        _explain.clear()
+    for conn in connections:
+        conn.close()
+
+
+def _at_exit():
+    if _enabled:
+        flush()
+
+
+atexit.register(_at_exit)
+
+if os.environ.get(METRICS_ENV, '').strip() not in ('', '0'):
+    enable()
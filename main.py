@@ -1,21 +1,19 @@
 import tkinter as tk
-import traceback
 import sys
-import math
 import os
 import sqlite3
 import hashlib
-import shutil
 from tkinter import ttk, filedialog, messagebox
-from datetime import datetime
-from dateutil.parser import parse
 import re
-import pandas as pd
-from tkcalendar import Calendar
 from datetime import timedelta  
-import xml.etree.ElementTree as ET
-from xml.sax.saxutils import escape
 from datetime import datetime
+from database import DATE_COLUMNS, REGISTER_COLUMNS, SERVER_ENV, ConflictError, get_database, to_iso_date
+from backup import BackupService
+import instrumentation
+from tasks import TaskRunner
+# Тяжелые модули загружаются при первом использовании, а не при запуске:
+# pandas - при создании записи, tkcalendar - в окне выбора даты, importer и
+# exporter - при загрузке и выгрузке, numpy (search) - в окне реестра
 
 class CustomMessageBox(tk.Toplevel):
     def __init__(self, parent, title, message, icon_path='icon.ico'):
@@ -33,235 +31,85 @@ class CustomMessageBox(tk.Toplevel):
         ttk.Button(self, text="OK", command=self.destroy).pack(pady=5)
         self.grab_set()
 
-class DatabaseHandler:
-    def __init__(self, db_name='registers.db'):
-        self.conn = sqlite3.connect(db_name)
-        self.calculated_columns = {
-        1: [
-            'Контроль по дате ("-" - просрочка)',
-            'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
-            'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'
-        ]
-        }
-        self.create_tables()
-    
-    def get_user_fio(self, user_id):
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT fio FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else "Неизвестный"
-
-    def create_tables(self):
-        tables = {
-                'users': [
-                    'id INTEGER PRIMARY KEY AUTOINCREMENT',
-                    'fio TEXT NOT NULL',
-                    'login TEXT UNIQUE NOT NULL',
-                    'password TEXT NOT NULL',
-                    'is_admin BOOLEAN NOT NULL DEFAULT 0',
-                    'can_edit_1 BOOLEAN NOT NULL DEFAULT 0',
-                    'can_edit_2 BOOLEAN NOT NULL DEFAULT 0',
-                    'login_attempts INTEGER NOT NULL DEFAULT 0',  
-                    'is_locked BOOLEAN NOT NULL DEFAULT 0'
-                ],
-                'contracts': [
-                'id INTEGER PRIMARY KEY AUTOINCREMENT',
-                '"Номер договора" INTEGER',
-                '"Дата заключения договора" TEXT',
-                '"Покупатель, ИНН" TEXT',
-                '"Кадастровый номер ЗУ, адрес ЗУ" TEXT',
-                '"Площадь ЗУ, кв. м" REAL',
-                '"Разрешенное использование ЗУ" TEXT',
-                '"Основание предоставления" TEXT',
-                '"Цена ЗУ по договору, руб." REAL',
-                '"Срок оплаты по договору" TEXT',
-                '"Фактическая дата оплаты" TEXT',
-                '"№ выписки учета поступлений, № ПП" TEXT',
-                '"Оплачено" REAL',
-                '"примечание" TEXT',
-                '"начисленные ПЕНИ" REAL',
-                '"оплачено пеней" REAL',
-                '"Дата выписки учета поступлений, № ПП" TEXT',
-                '"Возврат имеющейся переплаты" TEXT',
-                '"Контроль по дате (""-"" - просрочка)" REAL',
-                '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL',
-                '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL',
-                '"Редактор" INTEGER REFERENCES users(id)'
-            ],
-            'agreements': [
-                'id INTEGER PRIMARY KEY AUTOINCREMENT',
-                '"№ соглашения" TEXT',
-                '"Дата заключения" TEXT',
-                '"Собственник, ИНН" TEXT',
-                '"Кадастровый номер образуемого ЗУ, адрес ЗУ" TEXT',
-                '"Площадь образуемого ЗУ, кв. м" REAL',
-                '"реквизиты приказа ГК ПО по им. Отнош." TEXT',
-                '"Размер платы за увеличение площади ЗУ, руб." REAL',
-                '"Срок оплаты" TEXT',
-                '"Фактическая дата оплаты" TEXT',
-                '"Контроль по дате (""-"" - просрочка)" REAL',
-                '"№ выписки учета поступлений, № ПП" TEXT',  # Один экземпляр
-                '"Оплачено" REAL',
-                '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL',
-                '"примечание" TEXT',
-                '"начисленные ПЕНИ" REAL',
-                '"оплачено пеней" REAL',
-                '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL',
-                '"Возврат имеющейся переплаты" TEXT',
-                '"Редактор" INTEGER REFERENCES users(id)'
-            ]
-        }
-        triggers = [
-            '''CREATE TRIGGER IF NOT EXISTS update_due_date AFTER UPDATE OF "Дата заключения договора" ON contracts
-            BEGIN
-                UPDATE contracts SET
-                    "Срок оплаты по договору" = 
-                        strftime('%d.%m.%Y', 
-                            date(
-                                substr(NEW."Дата заключения договора", 7, 4) || '-' ||
-                                substr(NEW."Дата заключения договора", 4, 2) || '-' ||
-                                substr(NEW."Дата заключения договора", 1, 2),
-                                '+7 days'
-                            )
-                        )
-                WHERE id = NEW.id;
-            END;''',
-            
-            '''CREATE TRIGGER IF NOT EXISTS update_control_date AFTER UPDATE ON contracts
-            BEGIN
-                UPDATE contracts SET 
-                    "Контроль по дате (""-"" - просрочка)" = 
-                        julianday(
-                            substr(NEW."Срок оплаты по договору", 7, 4) || '-' ||
-                            substr(NEW."Срок оплаты по договору", 4, 2) || '-' ||
-                            substr(NEW."Срок оплаты по договору", 1, 2)
-                        ) - julianday(
-                            substr(NEW."Фактическая дата оплаты", 7, 4) || '-' ||
-                            substr(NEW."Фактическая дата оплаты", 4, 2) || '-' ||
-                            substr(NEW."Фактическая дата оплаты", 1, 2)
-                        ),
-                    "Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" = 
-                        NEW."Цена ЗУ по договору, руб." - NEW."Оплачено",
-                    "неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" = 
-                        NEW."начисленные ПЕНИ" - NEW."оплачено пеней"
-                WHERE id = NEW.id;
-            END;''',
-            
-            '''CREATE TRIGGER IF NOT EXISTS update_agreement_due_date AFTER UPDATE OF "Дата заключения" ON agreements
-            BEGIN
-                UPDATE agreements SET
-                    "Срок оплаты" = 
-                        strftime('%d.%m.%Y', 
-                            date(
-                                substr(NEW."Дата заключения", 7, 4) || '-' ||
-                                substr(NEW."Дата заключения", 4, 2) || '-' ||
-                                substr(NEW."Дата заключения", 1, 2),
-                                '+7 days'
-                            )
-                        )
-                WHERE id = NEW.id;
-            END;''',
-
-            '''CREATE TRIGGER IF NOT EXISTS update_agreement_control AFTER UPDATE ON agreements
-            BEGIN
-                UPDATE agreements SET 
-                    "Контроль по дате (""-"" - просрочка)" = 
-                        julianday(
-                            substr(NEW."Срок оплаты", 7, 4) || '-' ||
-                            substr(NEW."Срок оплаты", 4, 2) || '-' ||
-                            substr(NEW."Срок оплаты", 1, 2)
-                        ) - julianday(
-                            substr(NEW."Фактическая дата оплаты", 7, 4) || '-' ||
-                            substr(NEW."Фактическая дата оплаты", 4, 2) || '-' ||
-                            substr(NEW."Фактическая дата оплаты", 1, 2)
-                        ),
-                    "Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" = 
-                        NEW."Размер платы за увеличение площади ЗУ, руб." - NEW."Оплачено",
-                    "неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" = 
-                        NEW."начисленные ПЕНИ" - NEW."оплачено пеней"
-                WHERE id = NEW.id;
-            END;''',
-
-            '''CREATE TRIGGER IF NOT EXISTS update_editor AFTER UPDATE ON contracts
-            BEGIN
-                UPDATE contracts SET "Редактор" = NEW."Редактор" WHERE id = NEW.id;
-            END;'''
-        ]
-        
-        with self.conn:
-            cursor = self.conn.cursor()
-            for table_name, columns in tables.items():
-                columns_str = ', '.join(columns)
-                cursor.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({columns_str})')
-            for trigger in triggers:
-                cursor.execute(trigger)
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            if 'login_attempts' not in columns:
-                cursor.execute("ALTER TABLE users ADD COLUMN login_attempts INTEGER NOT NULL DEFAULT 0")
-            if 'is_locked' not in columns:
-                cursor.execute("ALTER TABLE users ADD COLUMN is_locked BOOLEAN NOT NULL DEFAULT 0")
-
-    def get_table_name(self, file_type):
-        return {
-            1: 'contracts',
-            2: 'agreements'
-        }[file_type]
-    
-    def get_all_records(self, file_type, columns=None):
-        table = self.get_table_name(file_type)
-        # Добавляем столбец "Редактор" в выборку
-        if columns is None:
-            columns_str = '*'
+class ProgressDialog(tk.Toplevel):
+    # Ход фоновой задачи; "Отмена" останавливает ее в ближайшей точке проверки
+    def __init__(self, parent, title, cancellable=True):
+        super().__init__(parent)
+        self.title(title)
+        self.resizable(False, False)
+        self.task = None
+        try:
+            self.iconbitmap('icon.ico')  
+        except Exception as e:
+            print("Ошибка загрузки иконки:", e)
+
+        frame = ttk.Frame(self)
+        frame.pack(padx=15, pady=15, fill='both', expand=True)
+        self.label = ttk.Label(frame, text="Выполняется...", width=45)
+        self.label.pack(anchor='w')
+        self.bar = ttk.Progressbar(frame, length=320, mode='indeterminate')
+        self.bar.pack(pady=10, fill='x')
+        self.bar.start(15)
+        self.cancel_button = ttk.Button(frame, text="Отмена", command=self.cancel,
+                                        state='normal' if cancellable else 'disabled')
+        self.cancel_button.pack()
+
+        self.protocol("WM_DELETE_WINDOW", self.cancel if cancellable else lambda: None)
+        self.transient(parent)
+        self.grab_set()
+
+    def update_progress(self, done, total=None, message=None):
+        if total:
+            if self.bar['mode'] != 'determinate':
+                self.bar.stop()
+                self.bar.configure(mode='determinate')
+            self.bar.configure(maximum=total, value=min(done, total))
+            text = f"Обработано: {done} из {total}"
         else:
-            columns_str = ', '.join([f'"{col}"' for col in columns]) + ', "Редактор"'
-        
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute(f'SELECT {columns_str} FROM {table}')
-            return cursor.fetchall()
-    
-    def update_record(self, file_type, record_id, column, value):
-        table = self.get_table_name(file_type)
-        # Экранируем двойные кавычки в названии колонки
-        column_escaped = column.replace('"', '""')
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute(f'''
-                UPDATE {table}
-                SET "{column_escaped}" = ?
-                WHERE id = ?
-            ''', (value, record_id))
-    
-    def import_from_dataframe(self, file_type, df):
-        table = self.get_table_name(file_type)
-        if file_type == 1:
-            calculated = self.calculated_columns[file_type]
-            df = df.drop(columns=[c for c in calculated if c in df.columns])
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.strftime('%d.%m.%Y')
-        # Экранируем двойные кавычки внутри названий колонок
-        columns = [f'"{col.replace("\"", "\"\"")}"' for col in df.columns.tolist()]
-        placeholders = ', '.join(['?'] * len(columns))
-        df = df.where(pd.notnull(df), None) 
-        with self.conn:
-            cursor = self.conn.cursor()
-            try:
-                cursor.executemany(
-                    f'''INSERT INTO {table} ({', '.join(columns)})
-                        VALUES ({placeholders})''',
-                    df.values.tolist()
-                )
-            except sqlite3.Error as e:
-                print("SQL error:", e)
-                raise
-    
-    def export_to_dataframe(self, file_type):
-        table = self.get_table_name(file_type)
-        with self.conn:
-            return pd.read_sql(f'SELECT * FROM {table}', self.conn)
+            text = f"Обработано: {done}"
+        self.label.configure(text=message or text)
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.label.configure(text="Отмена...")
+        self.cancel_button.configure(state='disabled')
+
+    def close(self):
+        self.grab_release()
+        self.destroy()
+
+
+def run_in_background(parent, title, func, *args, on_done=None, on_error=None, write=False,
+                      cancellable=True, **kwargs):
+    # Задача выполняется в фоне через TaskRunner главного окна, пока открыт
+    # диалог с индикатором; обработчики вызываются в потоке Tk
+    runner = parent
+    while not hasattr(runner, 'tasks'):
+        runner = runner.master
+    dialog = ProgressDialog(parent, title, cancellable)
+
+    def done(result):
+        dialog.close()
+        if on_done:
+            on_done(result)
+
+    def error(e, trace):
+        dialog.close()
+        if on_error:
+            on_error(e, trace)
+        else:
+            messagebox.showerror("Ошибка", f"{title}: {e}", parent=parent)
+
+    def cancelled():
+        dialog.close()
+        messagebox.showinfo(title, "Операция отменена", parent=parent)
+
+    dialog.task = runner.tasks.submit(func, *args, on_done=done, on_error=error,
+                                      on_progress=dialog.update_progress, on_cancel=cancelled,
+                                      write=write, **kwargs)
+    return dialog.task
+
 
 class AuthWindow(tk.Toplevel):
     def __init__(self, parent):
@@ -350,26 +198,18 @@ class RegisterDialog(tk.Toplevel):
             CustomMessageBox(self,"Ошибка", "Пароль должен содержать буквы и цифры").wait_window()
             return
 
-        db = DatabaseHandler()
-        cursor = db.conn.cursor()
+        db = get_database()
         try:
-            cursor.execute("SELECT login FROM users WHERE login = ?", (login,))
-            if cursor.fetchone():
+            if db.login_exists(login):
                 CustomMessageBox(self, "Ошибка", "Логин уже занят").wait_window()
                 return
 
             hashed_password = hashlib.sha256(f"salt{password}".encode()).hexdigest()
-            cursor.execute(
-                "INSERT INTO users (fio, login, password) VALUES (?, ?, ?)",
-                (fio, login, hashed_password)
-            )
-            db.conn.commit()
+            db.create_user(fio, login, hashed_password)
             messagebox.showinfo("Успех", "Регистрация прошла успешно")
             self.destroy()
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка БД", str(e))
-        finally:
-            cursor.close()
 
 class LoginDialog(tk.Toplevel):
     def __init__(self, parent):
@@ -410,62 +250,42 @@ class LoginDialog(tk.Toplevel):
             CustomMessageBox(self, "Ошибка", "Введите логин и пароль").wait_window()
             return
 
-        db = DatabaseHandler()
-        cursor = db.conn.cursor()
+        db = get_database()
         try:
-            cursor.execute(
-                "SELECT id, fio, login, password, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked "
-                "FROM users WHERE login = ?",
-                (login,)
-            )
-            result = cursor.fetchone()
-            if not result:
+            # Пароль и счетчик попыток проверяет обработчик БД (при работе
+            # через сервер - сам сервер)
+            hashed_password = hashlib.sha256(f"salt{password}".encode()).hexdigest()
+            result = db.authenticate(login, hashed_password)
+            if result['status'] == 'unknown':
                 messagebox.showerror("Ошибка", "Неверный логин или пароль")
                 return
-            user_id, fio, login, stored_hash, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked = result
             
-            if is_locked:
+            if result['status'] == 'locked':
                 CustomMessageBox(self, "Ошибка", "Учетная запись заблокирована").wait_window()
                 return
 
-            hashed_password = hashlib.sha256(f"salt{password}".encode()).hexdigest()
-            if stored_hash != hashed_password:
-                new_attempts = login_attempts + 1
-                is_locked_new = new_attempts >= 5
-                cursor.execute(
-                    "UPDATE users SET login_attempts = ?, is_locked = ? WHERE id = ?",
-                    (new_attempts, is_locked_new, user_id)
-                )
-                db.conn.commit()
-                remaining = 5 - new_attempts
-                if is_locked_new:
+            if result['status'] == 'wrong':
+                remaining = result['remaining']
+                if not remaining:
                     messagebox.showerror("Ошибка", "Учетная запись заблокирована после 5 неудачных попыток.")
                 else:
                     messagebox.showerror("Ошибка", f"Неверный пароль. Осталось попыток: {remaining}")
                 return
 
-            # Сброс попыток при успешном входе
-            cursor.execute(
-                "UPDATE users SET login_attempts = 0, is_locked = 0 WHERE id = ?",
-                (user_id,)
-            )
-            db.conn.commit()
-
             messagebox.showinfo("Успех", "Вход выполнен")
             self.parent.destroy()
             self.destroy()
+            user = result['user']
             app = MainApp({
-                'id': user_id,
-                'is_admin': bool(is_admin),
-                'can_edit_1': bool(can_edit_1),
-                'can_edit_2': bool(can_edit_2)
+                'id': user['id'],
+                'is_admin': user['is_admin'],
+                'can_edit_1': user['can_edit_1'],
+                'can_edit_2': user['can_edit_2']
             })
             app.mainloop()
 
         except sqlite3.Error as e:
             messagebox.showerror("Ошибка БД", str(e))
-        finally:
-            cursor.close()
 
 class MainApp(tk.Tk):
     def __init__(self, user_info):  # Убираем параметр parent
@@ -476,7 +296,8 @@ class MainApp(tk.Tk):
             self.iconbitmap('icon.ico')  
         except Exception as e:
             print("Ошибка загрузки иконки:", e)
-        self.db = DatabaseHandler()
+        self.db = get_database()
+        self.tasks = TaskRunner(self)
         self.user_info = user_info
         
         self.style = ttk.Style()
@@ -496,7 +317,14 @@ class MainApp(tk.Tk):
     def open_admin_panel(self):
         AdminWindow(self)
 
+    def toggle_metrics(self):
+        if self.metrics_var.get():
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
     def on_close(self):
+        self.tasks.shutdown()
         self.destroy()
         sys.exit()
 
@@ -527,6 +355,13 @@ class MainApp(tk.Tk):
                      text="Управление пользователями", 
                      command=self.open_admin_panel
                      ).pack(pady=20)
+            # Замеры и журнал медленных запросов (папка logs) включаются на ходу
+            self.metrics_var = tk.BooleanVar(value=instrumentation.enabled())
+            ttk.Checkbutton(frame,
+                            text="Журнал производительности",
+                            variable=self.metrics_var,
+                            command=self.toggle_metrics
+                            ).pack()
             
         ttk.Button(frame, 
                  text="Выход", 
@@ -550,7 +385,7 @@ class AdminWindow(tk.Toplevel):
             self.iconbitmap('icon.ico')  
         except Exception as e:
             print("Ошибка загрузки иконки:", e)
-        self.db = DatabaseHandler()
+        self.db = get_database()
         self.filter_status = tk.StringVar(value='Все')
         self.search_var = tk.StringVar()
         self.column_var = tk.StringVar()
@@ -681,22 +516,19 @@ class AdminWindow(tk.Toplevel):
 
     def load_users(self):
         status = self.filter_status.get()
-        self.tree.delete(*self.tree.get_children())
-        cursor = self.db.conn.cursor()
-        
-        query = "SELECT id, fio, login, is_admin, can_edit_1, can_edit_2, login_attempts, is_locked FROM users"
-        conditions = []
         
+        is_locked = None
         if status == 'Активные':
-            conditions.append("is_locked = 0")
+            is_locked = False
         elif status == 'Заблокированные':
-            conditions.append("is_locked = 1")
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+            is_locked = True
         
-        cursor.execute(query)
-        for row in cursor.fetchall():
+        self.parent.tasks.submit(lambda context: self.db.get_users(is_locked),
+                                 on_done=self.show_users, on_error=self.show_task_error)
+
+    def show_users(self, users):
+        self.tree.delete(*self.tree.get_children())
+        for row in users:
             self.tree.insert('', 'end', 
                 values=(
                     row[1],  # fio
@@ -711,6 +543,17 @@ class AdminWindow(tk.Toplevel):
             )
         self.update_row_colors()
 
+    def show_task_error(self, error, trace):
+        messagebox.showerror("Ошибка БД", str(error), parent=self)
+
+    def run_write(self, func, message):
+        # Изменения пользователей идут через очередь записи, затем список перечитывается
+        def done(result):
+            self.load_users()
+            CustomMessageBox(self, "Успех", message).wait_window()
+        self.parent.tasks.submit(lambda context: func(), on_done=done,
+                                 on_error=self.show_task_error, write=True)
+
     def unlock_user(self):
         selected = self.tree.selection()
         if not selected:
@@ -718,10 +561,7 @@ class AdminWindow(tk.Toplevel):
             return
         
         user_id = self.tree.item(selected[0], 'tags')[0]
-        with self.db.conn:
-            self.db.conn.execute("UPDATE users SET is_locked=0 WHERE id=?", (user_id,))
-        self.load_users()
-        CustomMessageBox(self, "Успех", "Пользователь разблокирован").wait_window()
+        self.run_write(lambda: self.db.unlock_user(user_id), "Пользователь разблокирован")
 
     def reset_attempts(self):
         selected = self.tree.selection()
@@ -730,10 +570,7 @@ class AdminWindow(tk.Toplevel):
             return
         
         user_id = self.tree.item(selected[0], 'tags')[0]
-        with self.db.conn:
-            self.db.conn.execute("UPDATE users SET login_attempts=0 WHERE id=?", (user_id,))
-        self.load_users()
-        CustomMessageBox(self, "Успех", "Счетчик попыток сброшен").wait_window()
+        self.run_write(lambda: self.db.reset_login_attempts(user_id), "Счетчик попыток сброшен")
     
     def on_edit(self, event):
         selected = self.tree.selection()
@@ -749,88 +586,234 @@ class AdminWindow(tk.Toplevel):
             self.tree.set(item, column, new_value)
     
     def save_changes(self):
-        cursor = self.db.conn.cursor()
+        rights = []
         for item in self.tree.get_children():
             user_id = self.tree.item(item, 'tags')[0]
             values = self.tree.item(item, 'values')
             
-            updates = {
-                'is_admin': 1 if values[2] == '✓' else 0,
-                'can_edit_1': 1 if values[3] == '✓' else 0,
-                'can_edit_2': 1 if values[4] == '✓' else 0
-            }
-            
-            cursor.execute('''UPDATE users SET
-                is_admin = ?,
-                can_edit_1 = ?,
-                can_edit_2 = ?
-                WHERE id = ?''',
-                (updates['is_admin'], updates['can_edit_1'], updates['can_edit_2'], user_id))
-        
-        self.db.conn.commit()
-        messagebox.showinfo("Сохранено", "Изменения успешно сохранены!")
+            rights.append((
+                user_id,
+                1 if values[2] == '✓' else 0,  # is_admin
+                1 if values[3] == '✓' else 0,  # can_edit_1
+                1 if values[4] == '✓' else 0   # can_edit_2
+            ))
+        
+        self.run_write(lambda: self.db.update_user_rights(rights), "Изменения успешно сохранены!")
+
+class VirtualGrid:
+    # Виртуальная прокрутка: в Treeview живет только набор строк под видимую
+    # область (плюс небольшой запас), при прокрутке они заполняются заново
+    BUFFER = 2
+    SCROLL_UNITS = 3
+
+    def __init__(self, tree, vsb, model):
+        self.tree = tree
+        self.vsb = vsb
+        self.model = model
+        self.offset = 0
+        self.page_size = 1
+        self.items = []
+        self.selected_id = None
+
+        self.vsb.configure(command=self.yview)
+        self.tree.bind('<Configure>', self.on_configure)
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Button-4>', self.on_mousewheel)
+        self.tree.bind('<Button-5>', self.on_mousewheel)
+        for key in ('<Up>', '<Down>', '<Prior>', '<Next>', '<Home>', '<End>'):
+            self.tree.bind(key, self.on_key)
+        self.tree.bind('<<TreeviewSelect>>', self.on_select)
+
+    def row_height(self):
+        try:
+            return int(ttk.Style(self.tree).lookup('Treeview', 'rowheight')) or 20
+        except (tk.TclError, ValueError):
+            return 20
+
+    def visible_rows(self):
+        row_height = self.row_height()
+        # Первая "строка" занята заголовками
+        return max(1, self.tree.winfo_height() // row_height - 1)
+
+    def on_configure(self, event=None):
+        page_size = self.visible_rows()
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.scroll_to(self.offset, force=True)
+
+    def scroll_to(self, offset, force=False):
+        offset = max(0, min(offset, len(self.model) - self.page_size))
+        if offset != self.offset or force:
+            self.offset = offset
+            self.refresh()
+        else:
+            self.update_scrollbar()
+
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * len(self.model)))
+        elif args[0] == 'scroll':
+            step = self.page_size if args[2] == 'pages' else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+
+    def on_mousewheel(self, event):
+        if event.num == 4:
+            direction = -1
+        elif event.num == 5:
+            direction = 1
+        else:
+            direction = -1 if event.delta > 0 else 1
+        self.scroll_to(self.offset + direction * self.SCROLL_UNITS)
+        return 'break'
+
+    def selected_position(self):
+        selection = self.tree.selection()
+        if selection and selection[0] in self.items:
+            return self.offset + self.items.index(selection[0])
+        return None
+
+    def on_key(self, event):
+        total = len(self.model)
+        if not total:
+            return 'break'
+        current = self.selected_position()
+        if current is None:
+            current = self.offset
+        steps = {'Up': -1, 'Down': 1, 'Prior': -self.page_size, 'Next': self.page_size,
+                 'Home': -total, 'End': total}
+        target = max(0, min(total - 1, current + steps[event.keysym]))
+        self.selected_id = str(self.model.record_at(target)[0])
+        offset = self.offset
+        if target < offset:
+            offset = target
+        elif target >= offset + self.page_size:
+            offset = target - self.page_size + 1
+        # Окно перерисовывается один раз: scroll_to с force обновляет и
+        # выделение, даже если прокручивать не пришлось
+        self.scroll_to(offset, force=True)
+        return 'break'
+
+    def on_select(self, event=None):
+        selection = self.tree.selection()
+        if selection:
+            self.selected_id = str(self.tree.item(selection[0], 'values')[0])
+
+    @instrumentation.timed('ui.grid.refresh')
+    def refresh(self):
+        count = max(0, min(self.page_size + self.BUFFER, len(self.model) - self.offset))
+        while len(self.items) < count:
+            self.items.append(self.tree.insert('', 'end'))
+        while len(self.items) > count:
+            self.tree.delete(self.items.pop())
+
+        selection = []
+        for i, item in enumerate(self.items):
+            values, tags = self.model.row(self.offset + i)
+            self.tree.item(item, values=values, tags=tags)
+            if values[0] == self.selected_id:
+                selection.append(item)
+        if tuple(selection) != self.tree.selection():
+            self.tree.selection_set(selection)
+        self.tree.yview_moveto(0)
+        self.update_scrollbar()
+
+    def refresh_record(self, record_id):
+        # Перерисовка одной строки, если она сейчас на экране
+        for i, item in enumerate(self.items):
+            if str(self.tree.item(item, 'values')[0]) == str(record_id):
+                values, tags = self.model.row(self.offset + i)
+                self.tree.item(item, values=values, tags=tags)
+
+    def refresh_matches(self, previous):
+        # Меняются только теги строк, у которых изменился признак совпадения
+        matches = self.model.matches
+        for i, item in enumerate(self.items):
+            index = self.model.order[self.offset + i]
+            was = None if previous is None else bool(previous[index])
+            now = None if matches is None else bool(matches[index])
+            if was != now:
+                self.tree.item(item, tags=self.model.row(self.offset + i)[1])
+
+    def update_scrollbar(self):
+        total = len(self.model)
+        if total:
+            self.vsb.set(self.offset / total, min(1.0, (self.offset + self.page_size) / total))
+        else:
+            self.vsb.set(0, 1)
+
+
+class XmlExportDialog(tk.Toplevel):
+    # Параметры XML-отчета: период по выбранной дате, только просрочка, сжатие
+    def __init__(self, parent, file_type):
+        super().__init__(parent)
+        self.parent = parent
+        self.file_type = file_type
+        self.result = None
+        self.title("Экспорт в XML")
+        self.resizable(False, False)
+        try:
+            self.iconbitmap('icon.ico')  
+        except Exception as e:
+            print("Ошибка загрузки иконки:", e)
+        self.create_widgets()
+        self.grab_set()
+
+    def create_widgets(self):
+        frame = ttk.Frame(self)
+        frame.pack(padx=10, pady=10, fill='both', expand=True)
+
+        ttk.Label(frame, text="Период по дате:").grid(row=0, column=0, sticky='w', pady=2)
+        self.date_column = tk.StringVar()
+        date_combo = ttk.Combobox(frame, textvariable=self.date_column,
+                                  values=DATE_COLUMNS[self.file_type], state='readonly', width=35)
+        date_combo.grid(row=0, column=1, pady=2)
+        date_combo.current(0)
+
+        ttk.Label(frame, text="С (ДД.ММ.ГГГГ):").grid(row=1, column=0, sticky='w', pady=2)
+        self.start_entry = ttk.Entry(frame)
+        self.start_entry.grid(row=1, column=1, sticky='w', pady=2)
+
+        ttk.Label(frame, text="По (ДД.ММ.ГГГГ):").grid(row=2, column=0, sticky='w', pady=2)
+        self.end_entry = ttk.Entry(frame)
+        self.end_entry.grid(row=2, column=1, sticky='w', pady=2)
+
+        self.overdue_only = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Только просроченные",
+                        variable=self.overdue_only).grid(row=3, columnspan=2, sticky='w', pady=2)
+
+        self.compress = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Сжать (gzip)",
+                        variable=self.compress).grid(row=4, columnspan=2, sticky='w', pady=2)
+
+        btn_frame = ttk.Frame(frame)
+        btn_frame.grid(row=5, columnspan=2, pady=10)
+        ttk.Button(btn_frame, text="Сформировать", command=self.confirm).pack(side='left', padx=5)
+        ttk.Button(btn_frame, text="Отмена", command=self.destroy).pack(side='left', padx=5)
+
+    def confirm(self):
+        start = self.start_entry.get().strip()
+        end = self.end_entry.get().strip()
+        try:
+            start = to_iso_date(start)
+            end = to_iso_date(end)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e), parent=self)
+            return
+        self.result = {
+            'date_column': self.date_column.get(),
+            'start': start,
+            'end': end,
+            'overdue_only': self.overdue_only.get(),
+            'compress': self.compress.get()
+        }
+        self.destroy()
+
 
 class FileWindow(tk.Toplevel):
-    expected_columns = {
-        1: [
-        'Номер договора', 
-        'Дата заключения договора',
-        'Покупатель, ИНН',
-        'Кадастровый номер ЗУ, адрес ЗУ',
-        'Площадь ЗУ, кв. м',
-        'Разрешенное использование ЗУ',
-        'Основание предоставления',
-        'Цена ЗУ по договору, руб.',
-        'Срок оплаты по договору',
-        'Фактическая дата оплаты',
-        '№ выписки учета поступлений, № ПП',
-        'Оплачено',
-        'примечание',
-        'начисленные ПЕНИ',
-        'оплачено пеней',
-        'Дата выписки учета поступлений, № ПП',
-        'Возврат имеющейся переплаты',
-        # Расчетные колонки в конце
-        'Контроль по дате ("-" - просрочка)',
-        'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
-        'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)',
-        'Редактор'
-        ],
-        2: [
-            '№ соглашения',
-            'Дата заключения',
-            'Собственник, ИНН',
-            'Кадастровый номер образуемого ЗУ, адрес ЗУ',
-            'Площадь образуемого ЗУ, кв. м',
-            'реквизиты приказа ГК ПО по им. Отнош.',
-            'Размер платы за увеличение площади ЗУ, руб.',
-            'Срок оплаты',
-            'Фактическая дата оплаты',
-            'Контроль по дате ("-" - просрочка)',
-            '№ выписки учета поступлений, № ПП',
-            'Оплачено',
-            'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
-            'примечание',
-            'начисленные ПЕНИ',
-            'оплачено пеней',
-            'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)',
-            'Возврат имеющейся переплаты',
-            'Редактор'
-        ]
-    }  
-    date_columns = {
-        1: [
-            'Дата заключения договора',
-            'Срок оплаты по договору',
-            'Фактическая дата оплаты',
-            'Дата выписки учета поступлений, № ПП'
-        ],
-        2: [
-            'Дата заключения',
-            'Срок оплаты',
-            'Фактическая дата оплаты'
-        ]
-    }
+    expected_columns = REGISTER_COLUMNS
+    date_columns = DATE_COLUMNS
+    FILTER_DELAY = 150
+    CHANGE_POLL_INTERVAL = 1000  # мс, проверка изменений других пользователей
     
     def show_tooltip(self, event):
         region = self.tree.identify_region(event.x, event.y)
@@ -910,10 +893,25 @@ class FileWindow(tk.Toplevel):
             self.iconbitmap('icon.ico')  
         except Exception as e:
             print("Ошибка загрузки иконки:", e)
+        from register_model import RegisterModel
+        from search import SearchIndex
+        self.model = RegisterModel(file_type)
+        self.search_index = SearchIndex(self.model)
+        self.filter_job = None
+        self.fulltext_job = None
+        # Номер последнего запроса FTS и последний результат (текст, id)
+        self.fulltext_generation = 0
+        self.fulltext_ids = None
+        self.load_generation = 0
+        # Последний примененный номер журнала изменений и data_version БД
+        self.change_seq = None
+        self.data_version = None
+        self.change_job = None
         self.create_widgets() 
         self.create_toolbar()
         self.setup_tags()
         self.update_treeview()
+        self.schedule_change_poll()
 
         self.state('zoomed')
         self.tooltip = None
@@ -924,32 +922,6 @@ class FileWindow(tk.Toplevel):
                (self.file_type == 1 and self.user_info['can_edit_1']) or 
                (self.file_type == 2 and self.user_info['can_edit_2']))
 
-    def calculate_days_diff(self, row):
-        try:
-            due_date = datetime.strptime(row['Срок оплаты по договору'], "%d.%m.%Y")
-            actual_date = datetime.strptime(row['Фактическая дата оплаты'], "%d.%m.%Y")
-            return (due_date - actual_date).days  # Правильный порядок вычитания
-        except Exception as e:
-            print(f"Ошибка расчета дней: {str(e)}")
-            return 0
-
-    # В методах расчета:
-    def calculate_payment_diff(self, row):
-        try:
-            price = float(row.get('Цена ЗУ по договору, руб.') or 0)
-            paid = float(row.get('Оплачено') or 0)
-            return price - paid
-        except:
-            return 0
-
-    def calculate_peni_diff(self, row):
-        try:
-            accrued = float(row.get('начисленные ПЕНИ') or 0)
-            paid_pen = float(row.get('оплачено пеней') or 0)
-            return accrued - paid_pen
-        except:
-            return 0
-
     def configure_ui(self):
         titles = {
         1: "Реестр договоров купли-продажи земельных участков, гос. собств-ть на кот. не разграничена",
@@ -988,36 +960,18 @@ class FileWindow(tk.Toplevel):
         self.tree.tag_configure('warning', background=warning_bg)
         self.tree.tag_configure('evenrow', background=evenrow_bg)
         self.tree.tag_configure('oddrow', background=oddrow_bg)
+        self.tree.tag_configure('match', background='#90EE90')
+        self.tree.tag_configure('nomatch', background='gray90')
 
+    @instrumentation.timed('ui.sort')
     def sort_treeview(self, col, reverse):
-        data = [(self.tree.set(child, col), child) 
-              for child in self.tree.get_children('')]
-        
-        # Пытаемся преобразовать к числам для правильной сортировки
-        try:
-            data.sort(key=lambda t: float(t[0].replace(',', '.')), reverse=reverse)
-        except:
-            data.sort(reverse=reverse)
-        
-        for index, (val, child) in enumerate(data):
-            self.tree.move(child, '', index)
+        self.model.sort(col, reverse)
         
         self.tree.heading(col, 
                         command=lambda: self.sort_treeview(col, not reverse))
         
-        # Обновляем цвета строк после сортировки
-        self.update_row_colors()
-       
-        #self.filter_data()
-
-    def update_row_colors(self):
-        for i, child in enumerate(self.tree.get_children('')):
-            tags = list(self.tree.item(child, 'tags'))
-            # Удаляем старые теги строк
-            tags = [t for t in tags if t not in ('evenrow', 'oddrow')]
-            # Добавляем новые теги
-            tags.append('evenrow' if i % 2 == 0 else 'oddrow')
-            self.tree.item(child, tags=tags)
+        # Чередование строк пересчитывается при отрисовке видимых строк
+        self.virtual_grid.refresh()
 
     def show_tooltip(self, event):
         region = self.tree.identify_region(event.x, event.y)
@@ -1056,9 +1010,8 @@ class FileWindow(tk.Toplevel):
         container.pack(fill='both', expand=True)
         
         self.tree = ttk.Treeview(container, show='headings')
-        vsb = ttk.Scrollbar(container, orient="vertical", command=self.tree.yview)
-        hsb = ttk.Scrollbar(container, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        # Вертикальной прокруткой управляет VirtualGrid, а не сам Treeview
+        vsb = ttk.Scrollbar(container, orient="vertical")
         
         # Добавляем скрытый столбец ID
         self.tree["columns"] = ['id'] + self.expected_columns[self.file_type]
@@ -1096,6 +1049,7 @@ class FileWindow(tk.Toplevel):
         container.grid_columnconfigure(0, weight=1)
         
         self.tree.bind('<Double-1>', self.on_double_click)
+        self.virtual_grid = VirtualGrid(self.tree, vsb, self.model)
 
     def validate_date(self, date_str):
         try:
@@ -1105,67 +1059,74 @@ class FileWindow(tk.Toplevel):
             return False
 
     def filter_data(self, event=None):
-        query = self.search_var.get().lower().strip()
+        # Нажатия клавиш объединяются: поиск запускается после паузы во вводе
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(self.FILTER_DELAY, self.apply_filter)
+
+    @instrumentation.timed('ui.filter')
+    def apply_filter(self):
+        self.filter_job = None
         col = self.column_var.get()
-        
-        if col not in self.tree["columns"]:
+        if col not in self.expected_columns[self.file_type]:
             return
-    
-        col_index = self.tree["columns"].index(col)
-
-        # Определяем числовые колонки для текущего типа файла
-        numeric_columns = {
-            1: ['Цена ЗУ по договору, руб.', 'Оплачено', 
-                'начисленные ПЕНИ', 'оплачено пеней',
-                'Площадь ЗУ, кв. м', 'Контроль по дате ("-" - просрочка)',
-                'Контроль по оплате цены ("-" - переплата; "+" - недоплата)',
-                'неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'],
-            2: [],
-            3: []
-        }.get(self.file_type, [])
-        
-        is_numeric_col = col in numeric_columns
 
-        for item in self.tree.get_children(''):
-            values = self.tree.item(item, 'values')
+        previous = self.model.matches
+        self.model.matches = self.search_index.search(col, self.search_var.get())
+        # Перекрашиваются только видимые строки, у которых изменилось совпадение
+        self.virtual_grid.refresh_matches(previous)
+
+    def fulltext_search(self, event=None):
+        if self.fulltext_job is not None:
+            self.after_cancel(self.fulltext_job)
+        self.fulltext_job = self.after(self.FILTER_DELAY, self.apply_fulltext)
+
+    @instrumentation.timed('ui.fulltext')
+    def apply_fulltext(self):
+        # Поиск по индексу FTS5 в базе: в таблице остаются только найденные
+        # записи, наиболее релевантные - сверху
+        self.fulltext_job = None
+        self.filter_fulltext(0)
+
+    def filter_fulltext(self, offset=None):
+        # Запрос к индексу выполняется в фоне (с сервером это запрос HTTP).
+        # Пока ответа нет, для того же текста действует прошлый результат;
+        # ответ устаревшего запроса отбрасывается. offset - куда прокрутить
+        # после применения, None - оставить текущую позицию
+        text = self.fulltext_var.get().strip()
+        self.fulltext_generation += 1
+        generation = self.fulltext_generation
+        if not text:
+            self.fulltext_ids = None
+            self.show_fulltext(None, offset)
+            return
+        if self.fulltext_ids is not None and self.fulltext_ids[0] == text:
+            self.show_fulltext(self.fulltext_ids[1], offset)
+        self.parent.tasks.submit(
+            lambda context: self.parent.db.search_records(self.file_type, text),
+            on_done=lambda ids: self.fulltext_found(text, ids, generation, offset),
+            on_error=lambda e, trace: self.fulltext_failed(e, generation)
+        )
 
-            if col not in self.tree["columns"]:
-                return 
-            col_index = self.tree["columns"].index(col)
-            raw_value = str(values[col_index])
+    def fulltext_found(self, text, ids, generation, offset):
+        if generation != self.fulltext_generation or not self.winfo_exists():
+            return
+        self.fulltext_ids = (text, ids)
+        self.show_fulltext(ids, offset)
+
+    def fulltext_failed(self, error, generation):
+        if generation != self.fulltext_generation or not self.winfo_exists():
+            return
+        messagebox.showerror("Ошибка", f"Ошибка полнотекстового поиска: {error}", parent=self)
+
+    def show_fulltext(self, ids, offset):
+        if ids is None:
+            self.model.show_only(None)
+        else:
+            index_by_id = self.model.index_by_id
+            self.model.show_only(index_by_id[i] for i in ids if i in index_by_id)
+        self.virtual_grid.scroll_to(self.virtual_grid.offset if offset is None else offset, force=True)
 
-            match = False
-            
-            try:
-                if is_numeric_col and query:
-                    # Нормализуем числовые значения
-                    cell_num = float(raw_value.replace(',', '.').replace(' ', ''))
-                    query_num = float(query.replace(',', '.'))
-                    match = math.isclose(cell_num, query_num, rel_tol=1e-9)
-                else:
-                    # Текстовый поиск
-                    cell_value = raw_value.lower()
-                    match = query in cell_value
-            except:
-                # В случае ошибки преобразования - используем текстовый поиск
-                cell_value = raw_value.lower()
-                match = query in cell_value
-            
-            # Обновляем теги
-            current_tags = list(self.tree.item(item, 'tags'))
-            current_tags = [t for t in current_tags if t not in ('match', 'nomatch')]
-            
-            if match:
-                current_tags.append('match')
-            else:
-                current_tags.append('nomatch')
-            
-            self.tree.item(item, tags=current_tags)
-        
-        # Настройка внешнего вида тегов
-        self.tree.tag_configure('match', background='#90EE90')
-        self.tree.tag_configure('nomatch', background='gray90')
-    
     def create_toolbar(self):
         toolbar = ttk.Frame(self)
         toolbar.pack(fill='x', padx=5, pady=5)
@@ -1175,6 +1136,11 @@ class FileWindow(tk.Toplevel):
                             state='normal' if self.has_permission() else 'disabled')
         btn_load.pack(side='left', padx=2)
         
+        btn_folder = ttk.Button(toolbar, text="Загрузить папку", 
+                              command=self.load_folder,
+                              state='normal' if self.has_permission() else 'disabled')
+        btn_folder.pack(side='left', padx=2)
+        
         btn_new = ttk.Button(toolbar, text="Создать новый", 
                            command=self.create_new,
                            state='normal' if self.has_permission() else 'disabled')
@@ -1193,6 +1159,12 @@ class FileWindow(tk.Toplevel):
         search_frame = ttk.Frame(toolbar)
         search_frame.pack(side='right', padx=10)
         
+        ttk.Label(search_frame, text="Найти в реестре:").pack(side='left')
+        self.fulltext_var = tk.StringVar()
+        fulltext_entry = ttk.Entry(search_frame, textvariable=self.fulltext_var, width=25)
+        fulltext_entry.pack(side='left', padx=(2, 10))
+        fulltext_entry.bind('<KeyRelease>', self.fulltext_search)
+
         self.search_var = tk.StringVar()
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=20)
         search_entry.pack(side='left')
@@ -1204,187 +1176,108 @@ class FileWindow(tk.Toplevel):
                                    values=columns, state='readonly')
         search_combo.pack(side='left')
         search_combo.current(0) 
+        search_combo.bind('<<ComboboxSelected>>', self.filter_data)
 
     def generate_xml_report(self):
-        try:
-            # Получаем данные из БД
-            df = self.parent.db.export_to_dataframe(self.file_type)
-            
-            # Создаем XML структуру
-            root = ET.Element('Реестр')
-            root.set('ВерсияФормата', '1.0')
-            root.set('ДатаФормирования', datetime.now().strftime('%Y-%m-%d'))  # Исправленный формат даты
+        dialog = XmlExportDialog(self, self.file_type)
+        self.wait_window(dialog)
+        options = dialog.result
+        if options is None:
+            return
 
-            for _, row in df.iterrows():
-                record = ET.SubElement(root, 'Запись')
-                
-                for col in self.expected_columns[self.file_type]:
-                    if col in ['Редактор', 'id']:
-                        continue
-                    
-                    # Генерируем валидное имя тега
-                    tag_name = re.sub(r'[^a-zA-Zа-яА-Я0-9_]', '_', col)
-                    tag_name = tag_name.strip('_').rstrip('_')
-                    
-                    # Заменяем множественные подчеркивания на одно
-                    tag_name = re.sub(r'_+', '_', tag_name)
-                    
-                    field = ET.SubElement(record, tag_name)
-                    
-                    # Обработка значений
-                    value = str(row[col]) if not pd.isna(row[col]) else ''
-                    field.text = escape(value)
-
-            # Сохраняем файл с правильной кодировкой
-            file_path = filedialog.asksaveasfilename(
-                defaultextension=".xml",
-                filetypes=[("XML files", "*.xml")]
-            )
-            
-            if file_path:
-                # Создаем дерево с правильным объявлением кодировки
-                tree = ET.ElementTree(root)
-                
-                # Принудительно записываем XML декларацию с кодировкой
-                with open(file_path, 'wb') as f:
-                    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'.encode('utf-8'))
-                    tree.write(f, 
-                            encoding='utf-8',
-                            xml_declaration=False,  # Уже записали декларацию вручную
-                            method='xml')
-                
-                messagebox.showinfo("Успех", "XML-отчет успешно сформирован!")
+        compress = options.pop('compress')
+        extension = ".xml.gz" if compress else ".xml"
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=extension,
+            filetypes=[("XML files", "*" + extension)]
+        )
+        if not file_path:
+            return
 
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка генерации XML: {str(e)}")
+        # Записи пишутся в файл по мере чтения из БД
+        import exporter
+        run_in_background(
+            self, "Экспорт в XML",
+            lambda context: exporter.write_xml_report(self.parent.db, self.file_type, file_path,
+                                                      compress=compress, progress=context.progress,
+                                                      **options),
+            on_done=lambda count: messagebox.showinfo(
+                "Успех", f"XML-отчет успешно сформирован! Записей: {count}", parent=self),
+            on_error=lambda e, trace: messagebox.showerror(
+                "Ошибка", f"Ошибка генерации XML: {str(e)}", parent=self)
+        )
 
     def load_file(self):
-        file_path = filedialog.askopenfilename(
+        file_paths = filedialog.askopenfilenames(
             parent=self,
-            title="Выберите файл",
+            title="Выберите файлы",
             filetypes=[
                 ("Excel files", "*.xls;*.xlsx;*.xlsm"),  
                 ("All files", "*.*")
             ]
         )
-        if not file_path:
+        if not file_paths:
+            return
+        if len(file_paths) > 1:
+            self.batch_import(file_paths)
             return
-        
-        elif self.file_type == 2:
-            numeric_columns = [
-                'Площадь образуемого ЗУ, кв. м',
-                'Размер платы за увеличение площади ЗУ, руб.',
-                'Оплачено',
-                'начисленные ПЕНИ',
-                'оплачено пеней'
-            ]
-            date_columns = [
-                'Дата заключения',
-                'Срок оплаты',
-                'Фактическая дата оплаты'
-            ]
-        try:
-            # Указываем явные типы для текстовых колонок
-            dtype_spec = {
-                '№ выписки учета поступлений, № ПП': str,
-                'примечание': str,
-                'Кадастровый номер ЗУ, адрес ЗУ': str,
-                'Покупатель, ИНН': str,
-                'Основание предоставления': str,
-                'Разрешенное использование ЗУ': str,
-                'Номер договора': str
-            }
-
-            # Чтение с указанием формата дат и типов
-            if file_path.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(
-                    file_path, 
-                    engine='openpyxl',
-                    dtype=dtype_spec,
-                    date_parser=lambda x: pd.to_datetime(x, dayfirst=True, errors='coerce')
-                )
-            else:
-                df = pd.read_excel(
-                    file_path, 
-                    engine='xlrd',
-                    dtype=dtype_spec,
-                    date_parser=lambda x: pd.to_datetime(x, dayfirst=True, errors='coerce')
-                )
-
-            # Нормализация названий колонок
-            df.columns = (
-                df.columns.str.strip()
-                .str.normalize('NFKC')
-                .str.replace(r'\s+', ' ', regex=True)
-                .str.replace(r'["\']', '', regex=True)  # Удаляем кавычки
-            )
-
-            # Точное сопоставление колонок
-            column_mapping = {
-                'кадастровый номер зу адрес зу': 'Кадастровый номер ЗУ, адрес ЗУ',
-                'площадь зу кв м': 'Площадь ЗУ, кв. м',
-                'пп6 п2 ст 393 ст 3917 ст 3920 зк рф': 'Основание предоставления',
-                'контроль по дате - просрочка': 'Контроль по дате ("-" - просрочка)',
-                'оплачено руб': 'Оплачено',
-                'начисленные пени': 'начисленные ПЕНИ',
-                'оплачено пеней': 'оплачено пеней'
-            }
-            df.rename(columns=column_mapping, inplace=True)
-
-            # Добавляем недостающие колонки
-            for col in self.expected_columns[self.file_type]:
-                if col not in df.columns:
-                    df[col] = None
-
-            # Упорядочиваем колонки
-            df = df[self.expected_columns[self.file_type]]
-
-            # Обработка числовых колонок
-            num_cols = ['Площадь ЗУ, кв. м', 'Цена ЗУ по договору, руб.', 
-                    'Оплачено', 'начисленные ПЕНИ', 'оплачено пеней']
-            for col in num_cols:
-                if col in df.columns:
-                    df[col] = df[col].astype(str).str.replace(r'\s+', '', regex=True)
-                    df[col] = df[col].str.replace(',', '.', regex=False)
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
 
-            # Обработка дат
-            date_cols = ['Дата заключения договора', 'Срок оплаты по договору',
-                        'Фактическая дата оплаты', 'Дата выписки учета поступлений, № ПП']
-            for col in date_cols:
-                if col in df.columns:
-                    # Конвертируем уже распарсенные даты в строковый формат
-                    df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce').dt.strftime('%d.%m.%Y')
+        def done(result):
+            if result['skipped']:
+                messagebox.showinfo("Загрузка", "Этот файл уже загружен, изменений нет", parent=self)
+                return
+            self.update_treeview()
+            self.show_import_result(result)
+
+        # Файл читается и записывается пачками, без загрузки книги в память
+        import importer
+        run_in_background(
+            self, "Загрузка файла",
+            lambda context: importer.import_workbook(self.parent.db, self.file_type, file_paths[0],
+                                                   progress=context.progress),
+            on_done=done, on_error=self.show_load_error, write=True
+        )
 
-            # Текстовые колонки - очистка и преобразование
-            text_cols = ['примечание', '№ выписки учета поступлений, № ПП']
-            for col in text_cols:
-                if col in df.columns:
-                    # Преобразуем числа в строки без .0
-                    df[col] = df[col].astype(str).str.replace(r'\.0$', '', regex=True)
-                    df[col] = df[col].replace('nan', '')
+    def show_load_error(self, e, trace):
+        messagebox.showerror("Ошибка", f"Ошибка загрузки файла: {str(e)}\n\nТрассировка:\n{trace}",
+                             parent=self)
 
-            for col in numeric_columns:
-                if col in df.columns:
-                    df[col] = df[col].astype(str).str.replace(r'\s+', '', regex=True)
-                    df[col] = df[col].str.replace(',', '.', regex=False)
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
-            
-            # Обработка дат
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce').dt.strftime('%d.%m.%Y')
-            # Замена NaN на None
-            df = df.where(pd.notnull(df), None)
+    def load_folder(self):
+        folder = filedialog.askdirectory(parent=self, title="Выберите папку с реестрами")
+        if folder:
+            self.batch_import([folder])
 
-            # Импорт в базу
-            self.parent.db.import_from_dataframe(self.file_type, df)
+    def batch_import(self, paths):
+        # Листы всех книг разбираются параллельно в отдельных процессах
+        def done(result):
             self.update_treeview()
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка загрузки файла: {str(e)}\n\nТрассировка:\n{traceback.format_exc()}")
+            self.show_import_result(result)
+
+        import importer
+        run_in_background(
+            self, "Загрузка файлов",
+            lambda context: importer.batch_import(self.parent.db, self.file_type, paths,
+                                                progress=context.progress),
+            on_done=done, on_error=self.show_load_error, write=True
+        )
+
+    def show_import_result(self, result):
+        message = (
+            f"Добавлено: {result['inserted']}\n"
+            f"Обновлено: {result['updated']}\n"
+            f"Без изменений: {result['unchanged']}\n"
+            f"Листов без изменений (пропущено): {result['sheets_skipped']} из {result['sheets']}"
+        )
+        if 'files' in result:
+            message += f"\nФайлов уже загружено (пропущено): {result['files_skipped']} из {result['files']}"
+        if result.get('errors'):
+            message += "\n\nОшибки:\n" + "\n".join(f"{path}: {error}" for path, error in result['errors'])
+            messagebox.showwarning("Загрузка завершена", message, parent=self)
+        else:
+            messagebox.showinfo("Загрузка завершена", message, parent=self)
     
     def create_new(self):
+        import pandas as pd
         try:
             expected = self.expected_columns[self.file_type]
             default_data = {}
@@ -1449,70 +1342,172 @@ class FileWindow(tk.Toplevel):
                     df[col] = df[col].astype(str).str.replace(r'[^\d,.]', '', regex=True)
                     df[col] = df[col].str.replace(',', '.').astype(float)
             
-            # Обработка дат
-            date_columns = {
-                1: ['Дата заключения договора', 'Срок оплаты по договору', 
-                    'Фактическая дата оплаты', 'Дата выписки учета поступлений, № ПП'],
-                2: []
-            }.get(self.file_type, [])
-            
-            for col in date_columns:
+            # Обработка дат: в БД даты хранятся в формате ISO
+            for col in self.date_columns.get(self.file_type, []):
                 if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce').dt.strftime('%d.%m.%Y')
+                    df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce').dt.strftime('%Y-%m-%d')
             
-            # Добавляем через существующий импортный метод
-            self.parent.db.import_from_dataframe(self.file_type, df)
-            self.update_treeview()
+            # Добавляем через существующий импортный метод в очереди записи.
+            # Обычная вставка: новая строка без номера совпадает с созданной
+            # в тот же день, но это отдельная запись
+            self.parent.tasks.submit(
+                lambda context: self.parent.db.import_from_dataframe(self.file_type, df, upsert=False),
+                on_done=lambda result: self.update_treeview(),
+                on_error=lambda e, trace: messagebox.showerror(
+                    "Ошибка", f"Ошибка при создании новой записи: {str(e)}", parent=self),
+                write=True
+            )
             
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при создании новой записи: {str(e)}")
     
     def update_treeview(self):
-        self.tree.delete(*self.tree.get_children())
-        records = self.parent.db.get_all_records(self.file_type)
-        
-        for record in records:
-            record_id = record[0]
-            # Преобразуем запись в список для модификации
-            record_list = list(record)
-            
-            # Заменяем ID редактора на ФИО
-            editor_id = record_list[-1]  # Последний элемент - ID редактора
-            editor_name = self.parent.db.get_user_fio(editor_id) if editor_id else ""
-            record_list[-1] = editor_name  # Заменяем ID на ФИО
-            
-            tags = []
-            try:
-                # Рассчитываем условия подсветки
-                days_diff = float(record_list[self.expected_columns[self.file_type].index('Контроль по дате ("-" - просрочка)') + 1])
-                payment_diff = float(record_list[self.expected_columns[self.file_type].index('Контроль по оплате цены ("-" - переплата; "+" - недоплата)') + 1])
-                
-                if days_diff < 0:
-                    tags.append('overdue')
-                if payment_diff > 0:
-                    tags.append('warning')
-            except Exception as e:
-                print(f"Ошибка расчетов: {e}")
-
-            # Формируем значения для вставки (пропускаем скрытый ID записи)
-            values = [str(x) if x is not None else "" for x in record_list[1:]]
-            
-            # Вставляем одну запись
-            self.tree.insert('', 'end', values=[record_id] + values, tags=tags)
-            
-        # Обновляем ширину колонок
-        for col in self.tree["columns"][1:]:  # Пропускаем 'id'
-            max_len = max(
-                [len(str(self.tree.set(child, col))) 
-                for child in self.tree.get_children('')] + [len(col)]
-            )
-            self.tree.column(col, width=int(max_len * 8.5))
+        # Записи читаются в фоне, таблица обновляется по готовности; ответ
+        # устаревшего запроса (если успели запросить новый) отбрасывается
+        self.load_generation += 1
+        generation = self.load_generation
+        # Номер журнала читается до записей: изменения, успевшие попасть в
+        # выборку, просто применятся повторно
+        self.change_seq = None
+        self.configure(cursor='watch')
+        self.parent.tasks.submit(
+            lambda context: (self.parent.db.last_change(), self.parent.db.get_all_records(self.file_type)),
+            on_done=lambda result: self.show_records(result[1], generation, result[0]),
+            on_error=lambda e, trace: self.show_load_failure(e, generation)
+        )
 
-        # Обновляем цвета строк
-        self.update_row_colors()
+    def show_load_failure(self, error, generation):
+        if generation != self.load_generation or not self.winfo_exists():
+            return
+        self.configure(cursor='')
+        messagebox.showerror("Ошибка", f"Ошибка чтения реестра: {error}", parent=self)
+
+    @instrumentation.timed('ui.show_records')
+    def show_records(self, records, generation, change_seq=None):
+        if generation != self.load_generation or not self.winfo_exists():
+            return
+        self.configure(cursor='')
+        self.change_seq = change_seq
+        # ФИО редактора уже подставлено запросом (LEFT JOIN users)
+        self.model.load(records)
+        self.reapply_filters()
+        
+        # Обновляем ширину колонок по выборке строк
+        for col, width in self.model.column_widths().items():
+            if col == 'Редактор' and not self.show_editor:
+                continue
+            self.tree.column(col, width=width)
     
 
+    def reapply_filters(self):
+        # После смены состава записей: поиск и фильтр FTS считаются заново
+        self.search_index.reset()
+        if self.search_index.active is not None:
+            self.model.matches = self.search_index.search(self.column_var.get(), self.search_var.get())
+        # Сохраняем позицию прокрутки, если строк по-прежнему достаточно
+        if self.fulltext_var.get().strip():
+            self.filter_fulltext()
+        else:
+            self.virtual_grid.scroll_to(self.virtual_grid.offset, force=True)
+
+    def schedule_change_poll(self):
+        self.change_job = self.after(self.CHANGE_POLL_INTERVAL, self.poll_changes)
+
+    @instrumentation.timed('ui.poll_changes')
+    def poll_changes(self):
+        # Дешевая проверка data_version; журнал читается, только если БД
+        # кто-то изменил, и только пока не идет полная загрузка. Оба запроса
+        # выполняются в фоне (с сервером это запросы HTTP), следующая
+        # проверка планируется по завершении
+        self.change_job = None
+        if self.change_seq is None:
+            self.schedule_change_poll()
+            return
+        generation = self.load_generation
+        since = self.change_seq
+        known = self.data_version
+        db = self.parent.db
+
+        def check(context):
+            version = db.data_version()
+            if version == known:
+                return version, False, None
+            return version, True, db.get_changes(self.file_type, since)
+
+        self.parent.tasks.submit(
+            check,
+            on_done=lambda result: self.changes_checked(result, generation),
+            on_error=lambda e, trace: self.change_poll_failed(e)
+        )
+
+    def changes_checked(self, result, generation):
+        version, changed, changes = result
+        if not changed:
+            if self.winfo_exists():
+                self.schedule_change_poll()
+            return
+        self.apply_changes(changes, generation, version)
+
+    def change_poll_failed(self, error):
+        print("Ошибка проверки изменений:", error)
+        if self.winfo_exists():
+            self.schedule_change_poll()
+
+    @instrumentation.timed('ui.apply_changes')
+    def apply_changes(self, changes, generation, version):
+        if not self.winfo_exists():
+            return
+        if generation == self.load_generation and self.change_seq is not None:
+            self.data_version = version
+            if changes is None:
+                # Журнал обрезан или изменений слишком много
+                self.update_treeview()
+            else:
+                self.change_seq, records, deleted = changes
+                indices = self.model.patch(records, deleted)
+                if indices is None:
+                    self.reapply_filters()
+                else:
+                    for index, record in zip(indices, records):
+                        self.search_index.update(index, record)
+                        if self.model.matches is not None:
+                            self.model.matches[index] = self.search_index.match_one(index)
+                        self.virtual_grid.refresh_record(record[0])
+        self.schedule_change_poll()
+
+    def destroy(self):
+        if self.change_job is not None:
+            self.after_cancel(self.change_job)
+            self.change_job = None
+        super().destroy()
+
+    def refresh_record(self, record_id):
+        # Перечитываем в фоне только измененную строку вместе с вычисляемыми
+        # колонками; прокрутка, выделение, сортировка и поиск остаются как были
+        self.parent.tasks.submit(
+            lambda context: self.parent.db.get_record(self.file_type, record_id),
+            on_done=lambda record: self.show_record(record_id, record),
+            on_error=lambda e, trace: print("Ошибка чтения записи:", e)
+        )
+
+    def show_record(self, record_id, record):
+        if not self.winfo_exists():
+            return
+        if record is None or record[0] not in self.model.index_by_id:
+            self.update_treeview()
+            return
+        current = self.model.version_of(record_id)
+        if current is not None and record[self.model.version_position] < current:
+            # Журнал изменений уже принес более новую версию строки
+            return
+        index = self.model.replace_record(record)
+        self.search_index.update(index, record)
+        if self.model.matches is not None:
+            self.model.matches[index] = self.search_index.match_one(index)
+        self.virtual_grid.refresh_record(record_id)
+
     def create_calendar(self, parent, entry, col_name):
+        from tkcalendar import Calendar
         cal_win = tk.Toplevel(parent)
         cal_win.title("Выбор даты")
         
@@ -1537,7 +1532,7 @@ class FileWindow(tk.Toplevel):
                 ).pack(pady=5)
 
 
-    def save_edit(self, new_value, record_id, col_name, edit_win):
+    def save_edit(self, new_value, record_id, col_name, edit_win, expected_version=None):
         try:
             if not self.has_permission():
                 messagebox.showwarning("Доступ запрещен")
@@ -1553,37 +1548,61 @@ class FileWindow(tk.Toplevel):
             elif col_name in self.date_columns.get(self.file_type, []):
                 if not self.validate_date(new_value):
                     raise ValueError("Некорректный формат даты (требуется ДД.ММ.ГГГГ)")
-                processed_value = new_value
+                processed_value = to_iso_date(new_value)
             
             # Обработка текстовых полей
             else:
                 processed_value = new_value.strip()
 
-            # Обновление записи
-            self.parent.db.update_record(
-            self.file_type, 
-            record_id, 
-            col_name, 
-            processed_value
+            # Значение и редактор записываются одним UPDATE в очереди записи,
+            # если строка не изменилась с момента открытия окна редактирования
+            editor = self.parent.user_info['id']
+            self.parent.tasks.submit(
+                lambda context: self.parent.db.update_record(
+                    self.file_type, record_id, col_name, processed_value,
+                    editor=editor, expected_version=expected_version),
+                on_done=lambda version: self.edit_saved(record_id, edit_win),
+                on_error=lambda e, trace: self.edit_failed(e, record_id, edit_win),
+                write=True
             )
 
-            cursor = self.parent.db.conn.cursor()
-            cursor.execute(
-                f"UPDATE {self.parent.db.get_table_name(self.file_type)} "
-                "SET \"Редактор\" = ? WHERE id = ?",
-                (self.parent.user_info['id'], record_id)
-            )
-            self.parent.db.conn.commit()
-            # Обновление интерфейса
-            self.update_treeview()
-            edit_win.destroy()
-            messagebox.showinfo("Успех", "Изменения успешно сохранены!")
-
         except ValueError as ve:
             messagebox.showerror("Ошибка", f"Некорректный ввод: {str(ve)}")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка сохранения: {str(e)}")
 
+    def edit_saved(self, record_id, edit_win):
+        if edit_win.winfo_exists():
+            edit_win.destroy()
+        if not self.winfo_exists():
+            return
+        # Обновление только измененной строки
+        self.refresh_record(record_id)
+        messagebox.showinfo("Успех", "Изменения успешно сохранены!", parent=self)
+
+    def edit_failed(self, error, record_id, edit_win):
+        if isinstance(error, ConflictError):
+            # Показываем актуальное состояние строки; правку нужно повторить
+            if edit_win.winfo_exists():
+                edit_win.destroy()
+            if not self.winfo_exists():
+                return
+            self.refresh_record(record_id)
+            if error.record is None:
+                messagebox.showwarning("Конфликт", "Запись удалена другим пользователем.", parent=self)
+            else:
+                editor = error.record[len(self.expected_columns[self.file_type])] or "другим пользователем"
+                messagebox.showwarning(
+                    "Конфликт",
+                    f"Запись уже изменена ({editor}). Изменения не сохранены - "
+                    "проверьте новые значения и повторите правку.",
+                    parent=self
+                )
+        elif isinstance(error, ValueError):
+            messagebox.showerror("Ошибка", f"Некорректный ввод: {str(error)}")
+        else:
+            messagebox.showerror("Ошибка", f"Ошибка сохранения: {str(error)}")
+
     # def update_calculations(self, record_id, edited_col, new_value):
     #     cursor = self.parent.db.conn.cursor()
     #     cursor.execute('SELECT * FROM contracts WHERE id = ?', (record_id,))
@@ -1687,6 +1706,9 @@ class FileWindow(tk.Toplevel):
         edit_win.geometry("400x200")  # Увеличим высоту для календаря
         
         record_id = int(self.tree.item(item, 'values')[0])
+        # Версия строки на момент открытия окна: при сохранении проверяется,
+        # что ее никто не изменил
+        version = self.model.version_of(record_id)
         entry = ttk.Entry(edit_win, font=('Arial', 12), width=30)
         entry.pack(padx=20, pady=20, fill='x', expand=True)
         entry.insert(0, current_value)
@@ -1710,7 +1732,7 @@ class FileWindow(tk.Toplevel):
 
         ttk.Button(btn_frame, 
                 text="Сохранить", 
-                command=lambda: self.save_edit(entry.get(), record_id, col_name, edit_win)
+                command=lambda: self.save_edit(entry.get(), record_id, col_name, edit_win, version)
                 ).pack(side='right')
                 
         ttk.Button(btn_frame, 
@@ -1758,9 +1780,6 @@ class FileWindow(tk.Toplevel):
     
     def save_file(self):
         try:
-            df = self.parent.db.export_to_dataframe(self.file_type)
-            df = df.drop(columns=['id'])
-
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".xlsx",
                 filetypes=[("Excel files", "*.xlsx")]
@@ -1773,78 +1792,31 @@ class FileWindow(tk.Toplevel):
                 backup_name = f"{file_path}_backup_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
                 os.rename(file_path, backup_name)
 
-            if self.file_type == 1:
-                # Форматирование числовых колонок
-                num_cols = ['Цена ЗУ по договору, руб.', 'Оплачено', 
-                        'начисленные ПЕНИ', 'оплачено пеней']
-                for col in num_cols:
-                    df[col] = df[col].apply(lambda x: f"{x:,.2f}".replace(',', ' ').replace('.', ',') if pd.notnull(x) else '')
-                
-                # Форматирование дат
-                date_cols = ['Дата заключения договора', 'Срок оплаты по договору',
-                            'Фактическая дата оплаты', 'Дата выписки учета поступлений, № ПП']
-                for col in date_cols:
-                    df[col] = pd.to_datetime(df[col]).dt.strftime('%d.%m.%Y')    
-                # Применяем расчеты
-                df['Контроль по дате ("-" - просрочка)'] = df.apply(self.calculate_days_diff, axis=1)
-                df['Контроль по оплате цены ("-" - переплата; "+" - недоплата)'] = df.apply(self.calculate_payment_diff, axis=1)
-                df['неоплаченные ПЕНИ ("+" - недоплата; "-" - переплата)'] = df.apply(self.calculate_peni_diff, axis=1)
-            elif self.file_type == 2:
-                # Форматирование числовых колонок
-                num_cols = [
-                    'Размер платы за увеличение площади ЗУ, руб.',
-                    'Оплачено',
-                    'начисленные ПЕНИ',
-                    'оплачено пеней'
-                ]
-                for col in num_cols:
-                    df[col] = df[col].apply(lambda x: f"{x:,.2f}".replace(',', ' ').replace('.', ',') if pd.notnull(x) else '')
-                
-                # Форматирование дат
-                date_cols = [
-                    'Дата заключения',
-                    'Срок оплаты',
-                    'Фактическая дата оплаты'
-                ]
-                for col in date_cols:
-                    df[col] = pd.to_datetime(df[col]).dt.strftime('%d.%m.%Y')
-
-            if not self.parent.user_info['is_admin'] and 'Редактор' in df.columns:
-                df = df.drop(columns=['Редактор'])
-            
-            df.to_excel(file_path, index=False, engine='openpyxl')
-            messagebox.showinfo("Успех", "Файл успешно сохранен!")
+            # Строки пишутся в книгу по мере чтения из БД, суммы и даты
+            # остаются числами с форматом Excel
+            import exporter
+            run_in_background(
+                self, "Сохранение в Excel",
+                lambda context: exporter.write_excel(self.parent.db, self.file_type, file_path,
+                                                     include_editor=self.parent.user_info['is_admin'],
+                                                     progress=context.progress),
+                on_done=lambda count: messagebox.showinfo("Успех", "Файл успешно сохранен!", parent=self),
+                on_error=lambda e, trace: messagebox.showerror("Ошибка", str(e), parent=self)
+            )
             
         except Exception as e:
             messagebox.showerror("Ошибка", str(e))
         
-def backup_database():
-    DB_NAME = 'registers.db'
-    BACKUP_DIR = 'backups'
-    
-    try:
-        # Создаем директорию для бэкапов
-        if not os.path.exists(BACKUP_DIR):
-            os.makedirs(BACKUP_DIR)
-        
-        # Генерируем имя файла с timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"{BACKUP_DIR}/registers_{timestamp}.bak"
-        
-        # Создаем соединение с базой для гарантии целостности
-        conn = sqlite3.connect(DB_NAME)
-        conn.backup(sqlite3.connect(backup_name))
-        conn.close()
-        
-        print(f"Backup created: {backup_name}")
-        return True
-    
-    except Exception as e:
-        print(f"Backup error: {str(e)}")
-        return False
-
 if __name__ == "__main__":
-    backup_database()
+    # main.py --server http://host:8765 - работа через сервер реестров
+    if '--server' in sys.argv[1:-1]:
+        os.environ[SERVER_ENV] = sys.argv[sys.argv.index('--server') + 1]
+    # main.py --metrics - замеры с запуска (файлы в папке logs)
+    if '--metrics' in sys.argv[1:]:
+        instrumentation.enable()
+    if not os.environ.get(SERVER_ENV):
+        # Копия снимается в фоне и только если база изменилась с прошлого раза
+        BackupService().start()
     root = tk.Tk()
     root.withdraw()
     auth_window = AuthWindow(root)
@@ -0,0 +1,636 @@
+import os
+import sqlite3
+from datetime import datetime
+
+BACKUP_DIR = 'backups'
+
+
+def _column_names(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [column[1] for column in cursor.fetchall()]
+
+
+def _create_base_schema(cursor):
+    tables = {
+        'users': [
+            'id INTEGER PRIMARY KEY AUTOINCREMENT',
+            'fio TEXT NOT NULL',
+            'login TEXT UNIQUE NOT NULL',
+            'password TEXT NOT NULL',
+            'is_admin BOOLEAN NOT NULL DEFAULT 0',
+            'can_edit_1 BOOLEAN NOT NULL DEFAULT 0',
+            'can_edit_2 BOOLEAN NOT NULL DEFAULT 0'
+        ],
+        'contracts': [
+            'id INTEGER PRIMARY KEY AUTOINCREMENT',
+            '"Номер договора" INTEGER',
+            '"Дата заключения договора" TEXT',
+            '"Покупатель, ИНН" TEXT',
+            '"Кадастровый номер ЗУ, адрес ЗУ" TEXT',
+            '"Площадь ЗУ, кв. м" REAL',
+            '"Разрешенное использование ЗУ" TEXT',
+            '"Основание предоставления" TEXT',
+            '"Цена ЗУ по договору, руб." REAL',
+            '"Срок оплаты по договору" TEXT',
+            '"Фактическая дата оплаты" TEXT',
+            '"№ выписки учета поступлений, № ПП" TEXT',
+            '"Оплачено" REAL',
+            '"примечание" TEXT',
+            '"начисленные ПЕНИ" REAL',
+            '"оплачено пеней" REAL',
+            '"Дата выписки учета поступлений, № ПП" TEXT',
+            '"Возврат имеющейся переплаты" TEXT',
+            '"Контроль по дате (""-"" - просрочка)" REAL',
+            '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL',
+            '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL',
+            '"Редактор" INTEGER REFERENCES users(id)'
+        ],
+        'agreements': [
+            'id INTEGER PRIMARY KEY AUTOINCREMENT',
+            '"№ соглашения" TEXT',
+            '"Дата заключения" TEXT',
+            '"Собственник, ИНН" TEXT',
+            '"Кадастровый номер образуемого ЗУ, адрес ЗУ" TEXT',
+            '"Площадь образуемого ЗУ, кв. м" REAL',
+            '"реквизиты приказа ГК ПО по им. Отнош." TEXT',
+            '"Размер платы за увеличение площади ЗУ, руб." REAL',
+            '"Срок оплаты" TEXT',
+            '"Фактическая дата оплаты" TEXT',
+            '"Контроль по дате (""-"" - просрочка)" REAL',
+            '"№ выписки учета поступлений, № ПП" TEXT',  # Один экземпляр
+            '"Оплачено" REAL',
+            '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL',
+            '"примечание" TEXT',
+            '"начисленные ПЕНИ" REAL',
+            '"оплачено пеней" REAL',
+            '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL',
+            '"Возврат имеющейся переплаты" TEXT',
+            '"Редактор" INTEGER REFERENCES users(id)'
+        ]
+    }
+    triggers = [
+        '''CREATE TRIGGER IF NOT EXISTS update_due_date AFTER UPDATE OF "Дата заключения договора" ON contracts
+        BEGIN
+            UPDATE contracts SET
+                "Срок оплаты по договору" =
+                    strftime('%d.%m.%Y',
+                        date(
+                            substr(NEW."Дата заключения договора", 7, 4) || '-' ||
+                            substr(NEW."Дата заключения договора", 4, 2) || '-' ||
+                            substr(NEW."Дата заключения договора", 1, 2),
+                            '+7 days'
+                        )
+                    )
+            WHERE id = NEW.id;
+        END;''',
+
+        '''CREATE TRIGGER IF NOT EXISTS update_control_date AFTER UPDATE ON contracts
+        BEGIN
+            UPDATE contracts SET
+                "Контроль по дате (""-"" - просрочка)" =
+                    julianday(
+                        substr(NEW."Срок оплаты по договору", 7, 4) || '-' ||
+                        substr(NEW."Срок оплаты по договору", 4, 2) || '-' ||
+                        substr(NEW."Срок оплаты по договору", 1, 2)
+                    ) - julianday(
+                        substr(NEW."Фактическая дата оплаты", 7, 4) || '-' ||
+                        substr(NEW."Фактическая дата оплаты", 4, 2) || '-' ||
+                        substr(NEW."Фактическая дата оплаты", 1, 2)
+                    ),
+                "Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" =
+                    NEW."Цена ЗУ по договору, руб." - NEW."Оплачено",
+                "неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" =
+                    NEW."начисленные ПЕНИ" - NEW."оплачено пеней"
+            WHERE id = NEW.id;
+        END;''',
+
+        '''CREATE TRIGGER IF NOT EXISTS update_agreement_due_date AFTER UPDATE OF "Дата заключения" ON agreements
+        BEGIN
+            UPDATE agreements SET
+                "Срок оплаты" =
+                    strftime('%d.%m.%Y',
+                        date(
+                            substr(NEW."Дата заключения", 7, 4) || '-' ||
+                            substr(NEW."Дата заключения", 4, 2) || '-' ||
+                            substr(NEW."Дата заключения", 1, 2),
+                            '+7 days'
+                        )
+                    )
+            WHERE id = NEW.id;
+        END;''',
+
+        '''CREATE TRIGGER IF NOT EXISTS update_agreement_control AFTER UPDATE ON agreements
+        BEGIN
+            UPDATE agreements SET
+                "Контроль по дате (""-"" - просрочка)" =
+                    julianday(
+                        substr(NEW."Срок оплаты", 7, 4) || '-' ||
+                        substr(NEW."Срок оплаты", 4, 2) || '-' ||
+                        substr(NEW."Срок оплаты", 1, 2)
+                    ) - julianday(
+                        substr(NEW."Фактическая дата оплаты", 7, 4) || '-' ||
+                        substr(NEW."Фактическая дата оплаты", 4, 2) || '-' ||
+                        substr(NEW."Фактическая дата оплаты", 1, 2)
+                    ),
+                "Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" =
+                    NEW."Размер платы за увеличение площади ЗУ, руб." - NEW."Оплачено",
+                "неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" =
+                    NEW."начисленные ПЕНИ" - NEW."оплачено пеней"
+            WHERE id = NEW.id;
+        END;''',
+
+        '''CREATE TRIGGER IF NOT EXISTS update_editor AFTER UPDATE ON contracts
+        BEGIN
+            UPDATE contracts SET "Редактор" = NEW."Редактор" WHERE id = NEW.id;
+        END;'''
+    ]
+    for table_name, columns in tables.items():
+        columns_str = ', '.join(columns)
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({columns_str})')
+    for trigger in triggers:
+        cursor.execute(trigger)
+
+
+def _add_user_lock_columns(cursor):
+    columns = _column_names(cursor, 'users')
+    if 'login_attempts' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN login_attempts INTEGER NOT NULL DEFAULT 0")
+    if 'is_locked' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN is_locked BOOLEAN NOT NULL DEFAULT 0")
+
+
+def _ddmmyyyy_to_iso_sql(column):
+    return (f"substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || "
+            f"substr({column}, 1, 2)")
+
+
+def _rebuild_table(cursor, table, columns):
+    # SQLite не умеет превращать существующую колонку в вычисляемую,
+    # поэтому таблица пересоздается с копированием данных
+    old_columns = _column_names(cursor, table)
+    cursor.execute(f'CREATE TABLE {table}_new ({", ".join(columns)})')
+    cursor.execute(f'PRAGMA table_xinfo({table}_new)')
+    # hidden = 2/3 - вычисляемые колонки, в них нельзя вставлять значения
+    copy_columns = [
+        '"' + column[1].replace('"', '""') + '"'
+        for column in cursor.fetchall()
+        if column[6] == 0 and column[1] in old_columns
+    ]
+    columns_str = ', '.join(copy_columns)
+    cursor.execute(f'INSERT INTO {table}_new ({columns_str}) SELECT {columns_str} FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+def _generated_control_columns(cursor):
+    # Контрольные колонки становятся STORED-вычисляемыми: они верны сразу после
+    # INSERT и UPDATE, и триггеры с повторной записью той же строки больше не нужны
+    due = _ddmmyyyy_to_iso_sql('"Срок оплаты по договору"')
+    paid = _ddmmyyyy_to_iso_sql('"Фактическая дата оплаты"')
+    _rebuild_table(cursor, 'contracts', [
+        'id INTEGER PRIMARY KEY AUTOINCREMENT',
+        '"Номер договора" INTEGER',
+        '"Дата заключения договора" TEXT',
+        '"Покупатель, ИНН" TEXT',
+        '"Кадастровый номер ЗУ, адрес ЗУ" TEXT',
+        '"Площадь ЗУ, кв. м" REAL',
+        '"Разрешенное использование ЗУ" TEXT',
+        '"Основание предоставления" TEXT',
+        '"Цена ЗУ по договору, руб." REAL',
+        '"Срок оплаты по договору" TEXT',
+        '"Фактическая дата оплаты" TEXT',
+        '"№ выписки учета поступлений, № ПП" TEXT',
+        '"Оплачено" REAL',
+        '"примечание" TEXT',
+        '"начисленные ПЕНИ" REAL',
+        '"оплачено пеней" REAL',
+        '"Дата выписки учета поступлений, № ПП" TEXT',
+        '"Возврат имеющейся переплаты" TEXT',
+        f'"Контроль по дате (""-"" - просрочка)" REAL '
+        f'GENERATED ALWAYS AS (julianday({due}) - julianday({paid})) STORED',
+        '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL '
+        'GENERATED ALWAYS AS ("Цена ЗУ по договору, руб." - "Оплачено") STORED',
+        '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL '
+        'GENERATED ALWAYS AS ("начисленные ПЕНИ" - "оплачено пеней") STORED',
+        '"Редактор" INTEGER REFERENCES users(id)'
+    ])
+
+    due = _ddmmyyyy_to_iso_sql('"Срок оплаты"')
+    _rebuild_table(cursor, 'agreements', [
+        'id INTEGER PRIMARY KEY AUTOINCREMENT',
+        '"№ соглашения" TEXT',
+        '"Дата заключения" TEXT',
+        '"Собственник, ИНН" TEXT',
+        '"Кадастровый номер образуемого ЗУ, адрес ЗУ" TEXT',
+        '"Площадь образуемого ЗУ, кв. м" REAL',
+        '"реквизиты приказа ГК ПО по им. Отнош." TEXT',
+        '"Размер платы за увеличение площади ЗУ, руб." REAL',
+        '"Срок оплаты" TEXT',
+        '"Фактическая дата оплаты" TEXT',
+        f'"Контроль по дате (""-"" - просрочка)" REAL '
+        f'GENERATED ALWAYS AS (julianday({due}) - julianday({paid})) STORED',
+        '"№ выписки учета поступлений, № ПП" TEXT',
+        '"Оплачено" REAL',
+        '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL '
+        'GENERATED ALWAYS AS ("Размер платы за увеличение площади ЗУ, руб." - "Оплачено") STORED',
+        '"примечание" TEXT',
+        '"начисленные ПЕНИ" REAL',
+        '"оплачено пеней" REAL',
+        '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL '
+        'GENERATED ALWAYS AS ("начисленные ПЕНИ" - "оплачено пеней") STORED',
+        '"Возврат имеющейся переплаты" TEXT',
+        '"Редактор" INTEGER REFERENCES users(id)'
+    ])
+
+    # Срок оплаты (+7 дней) теперь заполняет слой БД при вставке и изменении
+    # даты заключения; старые строки без срока дозаполняются одним UPDATE
+    for table, date_column, due_column in (
+        ('contracts', '"Дата заключения договора"', '"Срок оплаты по договору"'),
+        ('agreements', '"Дата заключения"', '"Срок оплаты"'),
+    ):
+        cursor.execute(f"""
+            UPDATE {table}
+            SET {due_column} = strftime('%d.%m.%Y', date({_ddmmyyyy_to_iso_sql(date_column)}, '+7 days'))
+            WHERE ({due_column} IS NULL OR {due_column} = '')
+              AND date({_ddmmyyyy_to_iso_sql(date_column)}) IS NOT NULL
+        """)
+
+
+DATE_COLUMNS_V4 = {
+    'contracts': ['Дата заключения договора', 'Срок оплаты по договору',
+                  'Фактическая дата оплаты', 'Дата выписки учета поступлений, № ПП'],
+    'agreements': ['Дата заключения', 'Срок оплаты', 'Фактическая дата оплаты']
+}
+
+DATE_INDEXES_V4 = {
+    'contracts': {
+        'idx_contracts_due_date': 'Срок оплаты по договору',
+        'idx_contracts_paid_date': 'Фактическая дата оплаты',
+        'idx_contracts_contract_date': 'Дата заключения договора'
+    },
+    'agreements': {
+        'idx_agreements_due_date': 'Срок оплаты',
+        'idx_agreements_paid_date': 'Фактическая дата оплаты',
+        'idx_agreements_contract_date': 'Дата заключения'
+    }
+}
+
+
+def _iso_dates(cursor):
+    # Даты хранятся как ГГГГ-ММ-ДД: строки сортируются как даты, julianday()
+    # работает без substr(), а индексы дают поиск по диапазону
+    _rebuild_table(cursor, 'contracts', [
+        'id INTEGER PRIMARY KEY AUTOINCREMENT',
+        '"Номер договора" INTEGER',
+        '"Дата заключения договора" TEXT',
+        '"Покупатель, ИНН" TEXT',
+        '"Кадастровый номер ЗУ, адрес ЗУ" TEXT',
+        '"Площадь ЗУ, кв. м" REAL',
+        '"Разрешенное использование ЗУ" TEXT',
+        '"Основание предоставления" TEXT',
+        '"Цена ЗУ по договору, руб." REAL',
+        '"Срок оплаты по договору" TEXT',
+        '"Фактическая дата оплаты" TEXT',
+        '"№ выписки учета поступлений, № ПП" TEXT',
+        '"Оплачено" REAL',
+        '"примечание" TEXT',
+        '"начисленные ПЕНИ" REAL',
+        '"оплачено пеней" REAL',
+        '"Дата выписки учета поступлений, № ПП" TEXT',
+        '"Возврат имеющейся переплаты" TEXT',
+        '"Контроль по дате (""-"" - просрочка)" REAL '
+        'GENERATED ALWAYS AS (julianday("Срок оплаты по договору") - julianday("Фактическая дата оплаты")) STORED',
+        '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL '
+        'GENERATED ALWAYS AS ("Цена ЗУ по договору, руб." - "Оплачено") STORED',
+        '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL '
+        'GENERATED ALWAYS AS ("начисленные ПЕНИ" - "оплачено пеней") STORED',
+        '"Редактор" INTEGER REFERENCES users(id)'
+    ])
+    _rebuild_table(cursor, 'agreements', [
+        'id INTEGER PRIMARY KEY AUTOINCREMENT',
+        '"№ соглашения" TEXT',
+        '"Дата заключения" TEXT',
+        '"Собственник, ИНН" TEXT',
+        '"Кадастровый номер образуемого ЗУ, адрес ЗУ" TEXT',
+        '"Площадь образуемого ЗУ, кв. м" REAL',
+        '"реквизиты приказа ГК ПО по им. Отнош." TEXT',
+        '"Размер платы за увеличение площади ЗУ, руб." REAL',
+        '"Срок оплаты" TEXT',
+        '"Фактическая дата оплаты" TEXT',
+        '"Контроль по дате (""-"" - просрочка)" REAL '
+        'GENERATED ALWAYS AS (julianday("Срок оплаты") - julianday("Фактическая дата оплаты")) STORED',
+        '"№ выписки учета поступлений, № ПП" TEXT',
+        '"Оплачено" REAL',
+        '"Контроль по оплате цены (""-"" - переплата; ""+"" - недоплата)" REAL '
+        'GENERATED ALWAYS AS ("Размер платы за увеличение площади ЗУ, руб." - "Оплачено") STORED',
+        '"примечание" TEXT',
+        '"начисленные ПЕНИ" REAL',
+        '"оплачено пеней" REAL',
+        '"неоплаченные ПЕНИ (""+"" - недоплата; ""-"" - переплата)" REAL '
+        'GENERATED ALWAYS AS ("начисленные ПЕНИ" - "оплачено пеней") STORED',
+        '"Возврат имеющейся переплаты" TEXT',
+        '"Редактор" INTEGER REFERENCES users(id)'
+    ])
+    for table, columns in DATE_COLUMNS_V4.items():
+        for column in columns:
+            quoted = '"' + column.replace('"', '""') + '"'
+            cursor.execute(f"""
+                UPDATE {table}
+                SET {quoted} = {_ddmmyyyy_to_iso_sql(quoted)}
+                WHERE {quoted} GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'
+            """)
+            # Пустые строки не должны попадать в диапазоны. Нераспознанные
+            # значения остаются как есть, чтобы не потерять записанное
+            # пользователем: в реестре их видно и можно исправить вручную
+            cursor.execute(f"UPDATE {table} SET {quoted} = NULL WHERE {quoted} = ''")
+    for table, indexes in DATE_INDEXES_V4.items():
+        for index_name, column in indexes.items():
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} ("{column}")')
+
+
+FTS_COLUMNS_V5 = {
+    'contracts': ['Номер договора', 'Покупатель, ИНН', 'Кадастровый номер ЗУ, адрес ЗУ',
+                  '№ выписки учета поступлений, № ПП', 'примечание'],
+    'agreements': ['№ соглашения', 'Собственник, ИНН', 'Кадастровый номер образуемого ЗУ, адрес ЗУ',
+                   '№ выписки учета поступлений, № ПП', 'примечание']
+}
+
+
+def _fts_value(column):
+    # unicode61 не считает "ё" вариантом "е" - приводим при индексации
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _create_fts(cursor, table, columns):
+    # FTS5 с внешним содержимым: текст хранится только в самой таблице (через
+    # представление с нормализацией), индекс поддерживается триггерами
+    fts = f'{table}_fts'
+    quoted = ['"' + column.replace('"', '""') + '"' for column in columns]
+    columns_str = ', '.join(quoted)
+    source_values = ', '.join(f'{_fts_value(column)} AS {column}' for column in quoted)
+    new_values = ', '.join(_fts_value(f'new.{column}') for column in quoted)
+    old_values = ', '.join(_fts_value(f'old.{column}') for column in quoted)
+    cursor.execute(f'CREATE VIEW IF NOT EXISTS {fts}_source AS SELECT id, {source_values} FROM {table}')
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {columns_str},
+            content='{fts}_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {columns_str}) VALUES (new.id, {new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {columns_str}) VALUES ('delete', old.id, {old_values});
+        END
+    """)
+    # Правка сумм и дат индекс не трогает - только изменение текстовых колонок
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns_str} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {columns_str}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts}(rowid, {columns_str}) VALUES (new.id, {new_values});
+        END
+    """)
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _full_text_search(cursor):
+    for table, columns in FTS_COLUMNS_V5.items():
+        _create_fts(cursor, table, columns)
+
+
+BUSINESS_KEYS_V6 = {
+    'contracts': ('Номер договора', 'Дата заключения договора'),
+    'agreements': ('№ соглашения', 'Дата заключения')
+}
+
+
+def business_key_condition(number, date_column):
+    # Строки без номера ("б/н") и без даты ключа не имеют: при повторном
+    # импорте того же листа они сверяются по хэшу содержимого со строками,
+    # которые журнал импорта связал с этим листом
+    return (f"{number} IS NOT NULL AND {number} NOT IN ('', 'б/н') "
+            f"AND {date_column} IS NOT NULL")
+
+
+def _merge_duplicates(cursor, table, number, date_column, condition):
+    # Повторные загрузки одного реестра оставили несколько копий строки с
+    # одним ключом, и оплаты часто вносились в более раннюю копию. Остается
+    # последняя копия (ее хэш совпадает с последним загруженным файлом), ее
+    # пустые поля заполняются из более ранних копий, затем копии удаляются.
+    # Если непустые значения копий расходятся, остается значение последней -
+    # такие ключи перечисляются в замечаниях (вся база скопирована до миграции)
+    cursor.execute(f'PRAGMA table_xinfo({table})')
+    columns = [column[1] for column in cursor.fetchall()
+               if column[6] == 0 and column[1] not in ('id', 'content_hash')]
+    quoted = ['"' + column.replace('"', '""') + '"' for column in columns]
+    groups = cursor.execute(f"""
+        SELECT group_concat(id) FROM {table} WHERE {condition}
+        GROUP BY {number}, {date_column} HAVING count(*) > 1
+    """).fetchall()
+    removed = 0
+    conflicts = []
+    for (ids,) in groups:
+        ids = sorted((int(i) for i in ids.split(',')), reverse=True)
+        rows = {row[0]: row[1:] for row in cursor.execute(
+            f'SELECT id, {", ".join(quoted)} FROM {table} WHERE id IN ({", ".join("?" * len(ids))})', ids)}
+        copies = [rows[i] for i in ids]
+        merged = list(copies[0])
+        conflict = False
+        for position in range(len(columns)):
+            values = [row[position] for row in copies if row[position] not in (None, '')]
+            if merged[position] in (None, '') and values:
+                merged[position] = values[0]
+            if len(set(values)) > 1:
+                conflict = True
+        if conflict:
+            key = dict(zip(columns, copies[0]))
+            conflicts.append(' от '.join(str(key[column]) for column in BUSINESS_KEYS_V6[table]))
+        cursor.execute(f'UPDATE {table} SET {", ".join(f"{q} = ?" for q in quoted)} WHERE id = ?',
+                       merged + [ids[0]])
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join("?" * (len(ids) - 1))})', ids[1:])
+        removed += len(ids) - 1
+    notes = []
+    if removed:
+        notes.append(f'{table}: объединено копий строк с одинаковым ключом: {removed} (ключей: {len(groups)})')
+    if conflicts:
+        notes.append(f'{table}: у копий разные значения, оставлены значения последней копии: '
+                     + ', '.join(conflicts[:50]) + (' ...' if len(conflicts) > 50 else ''))
+    return notes
+
+
+def _business_keys(cursor):
+    notes = []
+    for table, key in BUSINESS_KEYS_V6.items():
+        if 'content_hash' not in _column_names(cursor, table):
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN content_hash TEXT')
+        number, date_column = ['"' + column.replace('"', '""') + '"' for column in key]
+        condition = business_key_condition(number, date_column)
+        notes += _merge_duplicates(cursor, table, number, date_column, condition)
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_business_key
+            ON {table} ({number}, {date_column}) WHERE {condition}
+        """)
+    return notes
+
+
+def _import_ledger(cursor):
+    # Журнал импорта: отпечатки файлов и листов и строки, полученные из них
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_type INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            file_hash TEXT NOT NULL,
+            imported_at TEXT NOT NULL,
+            UNIQUE (file_type, path)
+        )
+    """)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_import_ledger_hash ON import_ledger (file_type, file_hash)')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_ledger_sheets (
+            ledger_id INTEGER NOT NULL REFERENCES import_ledger(id),
+            sheet TEXT NOT NULL,
+            sheet_hash TEXT NOT NULL,
+            PRIMARY KEY (ledger_id, sheet)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_ledger_rows (
+            ledger_id INTEGER NOT NULL,
+            sheet TEXT NOT NULL,
+            record_id INTEGER NOT NULL,
+            PRIMARY KEY (ledger_id, sheet, record_id)
+        ) WITHOUT ROWID
+    """)
+
+
+CHANGE_LOG_TABLES_V8 = {'contracts': 1, 'agreements': 2}
+
+
+def _change_log(cursor):
+    # Журнал изменений реестров для обновления открытых окон: seq растет
+    # монотонно, по нему клиент запрашивает все, что изменилось после него
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_type INTEGER NOT NULL,
+            record_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    """)
+    for table, file_type in CHANGE_LOG_TABLES_V8.items():
+        for event, op, row in (('INSERT', 'I', 'new'), ('UPDATE', 'U', 'new'), ('DELETE', 'D', 'old')):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_change_{op.lower()} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (file_type, record_id, op) VALUES ({file_type}, {row}.id, '{op}');
+                END
+            """)
+
+
+def _row_versions(cursor):
+    # Номер версии строки для оптимистичной блокировки: правка проходит,
+    # только если строку не изменили после того, как ее показали пользователю
+    for table in ('contracts', 'agreements'):
+        if 'row_version' not in _column_names(cursor, table):
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0')
+
+
+def _keyless_rows(cursor):
+    # Строки без ключа ("б/н", без даты) повторный импорт узнает по хэшу
+    # содержимого (журнал импорта связывает строки с листами по хэшу); уже
+    # имеющиеся одинаковые строки не удаляются, а перечисляются
+    notes = []
+    for table, key in BUSINESS_KEYS_V6.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_content_hash ON {table} (content_hash)')
+        number, date_column = ['"' + column.replace('"', '""') + '"' for column in key]
+        duplicates = cursor.execute(f"""
+            SELECT count(*), coalesce(sum(copies - 1), 0) FROM (
+                SELECT count(*) AS copies FROM {table}
+                WHERE content_hash IS NOT NULL AND NOT ({business_key_condition(number, date_column)})
+                GROUP BY content_hash HAVING count(*) > 1
+            )
+        """).fetchone()
+        if duplicates[0]:
+            notes.append(f'{table}: лишних копий строк без номера или даты: {duplicates[1]} '
+                         f'(групп одинаковых строк: {duplicates[0]}) - не удалены, проверьте вручную')
+    return notes
+
+
+# Шаги применяются строго по порядку; каждый шаг должен быть идемпотентным,
+# т.к. базы, созданные до появления миграций, уже содержат часть схемы
+MIGRATIONS = [
+    (1, 'Базовая схема: пользователи, договоры, соглашения', _create_base_schema),
+    (2, 'Блокировка пользователей после неудачных входов', _add_user_lock_columns),
+    (3, 'Вычисляемые контрольные колонки вместо триггеров пересчета', _generated_control_columns),
+    (4, 'Даты в формате ISO-8601 и индексы по датам', _iso_dates),
+    (5, 'Полнотекстовый индекс FTS5 по текстовым колонкам', _full_text_search),
+    (6, 'Уникальный ключ договора/соглашения и хэш содержимого для повторного импорта', _business_keys),
+    (7, 'Журнал импорта файлов и листов', _import_ledger),
+    (8, 'Журнал изменений для обновления открытых окон', _change_log),
+    (9, 'Версии строк для обнаружения одновременной правки', _row_versions),
+    (10, 'Индекс по хэшу содержимого для строк без номера и даты', _keyless_rows),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def backup_before_migration(db_name, version, backup_dir=BACKUP_DIR):
+    # Копия снимается отдельным соединением: у писателя уже открыта транзакция
+    # BEGIN IMMEDIATE, а читатель видит зафиксированное состояние - ровно то,
+    # к которому будут применены миграции
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base = os.path.splitext(os.path.basename(db_name))[0]
+    backup_name = os.path.join(backup_dir, f"{base}_pre_v{version}_{timestamp}.bak")
+    source = sqlite3.connect(db_name)
+    target = sqlite3.connect(backup_name)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return backup_name
+
+
+def migrate(manager, backup_dir=BACKUP_DIR, log=None):
+    # Сообщения (копия, примененные шаги, замечания шагов) передаются в
+    # log(message); stdout не используется - в командной строке он занят JSON.
+    # Если схема актуальна - единственное чтение PRAGMA
+    current = get_schema_version(manager.writer)
+    if current >= LATEST_VERSION:
+        return current
+
+    report = log or (lambda message: None)
+    with manager.transaction() as conn:
+        # Версию перечитываем под блокировкой: базу мог обновить другой клиент,
+        # и копия под той же блокировкой совпадает с мигрируемым состоянием
+        current = get_schema_version(conn)
+        if current >= LATEST_VERSION:
+            return current
+        has_schema = conn.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table'"
+        ).fetchone()[0]
+        if has_schema:
+            backup_name = backup_before_migration(manager.db_name, current, backup_dir)
+            report(f"Копия перед миграцией: {backup_name}")
+        cursor = conn.cursor()
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            report(f"Миграция {version}: {description}")
+            # Шаг может вернуть замечания о найденных в данных проблемах
+            for note in step(cursor) or ():
+                report(f"Миграция {version}: {note}")
+            cursor.execute(f'PRAGMA user_version = {int(version)}')
+        return get_schema_version(conn)
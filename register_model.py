@@ -0,0 +1,166 @@
+from database import DATE_COLUMNS, NUMERIC_COLUMNS, OVERDUE_COLUMN, REGISTER_COLUMNS, to_display_date
+from search import parse_number
+
+PAYMENT_COLUMN = 'Контроль по оплате цены ("-" - переплата; "+" - недоплата)'
+
+
+class RegisterModel:
+    # Данные реестра для виртуальной таблицы: записи хранятся как есть,
+    # строки для отображения и теги строятся только для видимых позиций
+    def __init__(self, file_type):
+        self.file_type = file_type
+        self.columns = REGISTER_COLUMNS[file_type]
+        # Позиции в записи: 0 - id, далее колонки реестра, последняя - версия строки
+        self.date_positions = {self.columns.index(col) + 1 for col in DATE_COLUMNS[file_type]}
+        self.numeric_positions = {self.columns.index(col) + 1 for col in NUMERIC_COLUMNS[file_type]}
+        self.overdue_position = self.columns.index(OVERDUE_COLUMN) + 1
+        self.payment_position = self.columns.index(PAYMENT_COLUMN) + 1
+        self.version_position = len(self.columns) + 1
+        self.records = []
+        self.index_by_id = {}
+        self.order = []
+        self.matches = None  # None - поиск не активен, иначе признак совпадения по записям
+        self.sort_position = None
+        self.sort_reverse = False
+        # Кэш перестановок по колонкам: позиция -> индексы записей по возрастанию
+        self._permutations = {}
+
+    def load(self, records):
+        self.records = list(records)
+        self.index_by_id = {record[0]: i for i, record in enumerate(self.records)}
+        self.matches = None
+        self._permutations = {}
+        self.show_only(None)
+
+    def show_only(self, indices):
+        # None - показываются все записи, иначе только указанные в заданном порядке;
+        # выбранная сортировка сохраняется
+        if indices is None:
+            self.order = list(range(len(self.records)))
+        else:
+            self.order = list(indices)
+        if self.sort_position is not None:
+            self._apply_sort()
+
+    def replace_record(self, record):
+        # Запись обновляется на своем месте: порядок сортировки не меняется,
+        # но перестановки по измененным колонкам придется построить заново
+        index = self.index_by_id[record[0]]
+        old = self.records[index]
+        self.records[index] = record
+        for position in [p for p in self._permutations if old[p] != record[p]]:
+            del self._permutations[position]
+        return index
+
+    def patch(self, records, deleted_ids):
+        # Изменения из журнала: известные записи заменяются на месте, новые
+        # добавляются в конец, удаленные убираются. Возвращает индексы
+        # замененных записей или None, если состав записей изменился и
+        # индексы сдвинулись (фильтры и поиск нужно применить заново)
+        new = [record for record in records if record[0] not in self.index_by_id]
+        deleted = {record_id for record_id in deleted_ids if record_id in self.index_by_id}
+        if not new and not deleted:
+            return [self.replace_record(record) for record in records]
+        updates = {record[0]: record for record in records}
+        self.records = [updates.get(record[0], record) for record in self.records
+                        if record[0] not in deleted] + new
+        self.index_by_id = {record[0]: i for i, record in enumerate(self.records)}
+        self._permutations = {}
+        self.matches = None
+        self.show_only(None)
+        return None
+
+    def version_of(self, record_id):
+        index = self.index_by_id.get(record_id)
+        return None if index is None else self.records[index][self.version_position]
+
+    def __len__(self):
+        return len(self.order)
+
+    def position_of(self, column):
+        return self.columns.index(column) + 1
+
+    def record_at(self, position):
+        return self.records[self.order[position]]
+
+    def display_value(self, record, position):
+        value = record[position]
+        if position in self.date_positions:
+            return to_display_date(value)
+        return '' if value is None else str(value)
+
+    def display_values(self, record):
+        return [self.display_value(record, position) for position in range(self.version_position)]
+
+    def status_tags(self, record):
+        tags = []
+        days_diff = record[self.overdue_position]
+        payment_diff = record[self.payment_position]
+        if days_diff is not None and days_diff < 0:
+            tags.append('overdue')
+        if payment_diff is not None and payment_diff > 0:
+            tags.append('warning')
+        return tags
+
+    def row(self, position):
+        index = self.order[position]
+        record = self.records[index]
+        tags = self.status_tags(record)
+        tags.append('evenrow' if position % 2 == 0 else 'oddrow')
+        if self.matches is not None:
+            tags.append('match' if self.matches[index] else 'nomatch')
+        return self.display_values(record), tags
+
+    def sort_key(self, position):
+        # Типизированные ключи: даты - строки ISO, суммы и площади - числа,
+        # текст - без учета регистра; пустые значения всегда в конце
+        values = [record[position] for record in self.records]
+        if position in self.date_positions:
+            return [(value is None or value == '', value or '') for value in values]
+        numbers = [parse_number(value) for value in values]
+        if position in self.numeric_positions or all(
+                number is not None or value is None or value == ''
+                for number, value in zip(numbers, values)):
+            return [(number is None, number or 0.0) for number in numbers]
+        return [(value is None or value == '', '' if value is None else str(value).casefold())
+                for value in values]
+
+    def permutation(self, position):
+        # Перестановка по возрастанию и число непустых значений в ее начале
+        cached = self._permutations.get(position)
+        if cached is None:
+            keys = self.sort_key(position)
+            permutation = sorted(range(len(keys)), key=keys.__getitem__)
+            filled = sum(1 for key in keys if not key[0])
+            cached = self._permutations[position] = (permutation, filled)
+        return cached
+
+    def _apply_sort(self):
+        permutation, filled = self.permutation(self.sort_position)
+        if len(self.order) != len(self.records):
+            # Отфильтрованный вид упорядочиваем по рангу в общей перестановке
+            rank = [0] * len(self.records)
+            for i, index in enumerate(permutation):
+                rank[index] = i
+            ordered = sorted(self.order, key=rank.__getitem__)
+            filled = sum(1 for index in ordered if rank[index] < filled)
+        else:
+            ordered = permutation
+        if self.sort_reverse:
+            # Пустые значения остаются в конце и при обратном порядке
+            ordered = ordered[filled - 1::-1] + ordered[filled:] if filled else list(ordered)
+        self.order = list(ordered)
+
+    def sort(self, column, reverse):
+        self.sort_position = self.position_of(column)
+        self.sort_reverse = reverse
+        self._apply_sort()
+
+    def column_widths(self, sample_size=1000, char_width=8.5):
+        # Ширина колонок по выборке строк, а не по всей таблице
+        sample = self.records[:sample_size]
+        widths = {}
+        for position, col in enumerate(self.columns, start=1):
+            max_len = max([len(self.display_value(record, position)) for record in sample] + [len(col)])
+            widths[col] = int(max_len * char_width)
+        return widths
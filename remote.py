@@ -0,0 +1,306 @@
+# Клиент сервера реестров (server.py): те же методы, что у DatabaseHandler,
+# которые используют окна, импорт и экспорт. Включается адресом сервера в
+# переменной REGISTERS_SERVER или ключом main.py --server
+import gzip
+import http.client
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlencode, urlsplit
+
+from database import CALCULATED_COLUMNS, ConflictError, DatabaseHandler
+
+PAGE_SIZE = 5000
+IMPORT_BATCH_ROWS = 5000
+GZIP_MIN_SIZE = 1024
+# Ошибки повторно использованного соединения, после которых запрос можно
+# повторить: сервер закрыл простаивающее соединение до получения запроса
+RETRY_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class RemoteError(sqlite3.OperationalError):
+    # Ошибки сервера окна обрабатывают так же, как ошибки БД
+    def __init__(self, message, status=None, payload=None):
+        super().__init__(message)
+        self.status = status
+        self.payload = payload
+
+
+class PageCache:
+    # Страницы записей с их ETag: неизменную страницу сервер не передает
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key, etag, data):
+        with self._lock:
+            self._items[key] = (etag, data)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class RemoteDatabaseHandler:
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url if '://' in url else f'http://{url}')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.token = None
+        self.calculated_columns = CALCULATED_COLUMNS
+        self.pages = PageCache()
+        # Свое постоянное соединение у каждого потока (окна и фоновые задачи)
+        self._local = threading.local()
+
+    # --- HTTP ---
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _send(self, method, path, params=None, data=None, etag=None):
+        if params:
+            path += '?' + urlencode({key: value for key, value in params.items() if value is not None})
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if etag:
+            headers['If-None-Match'] = etag
+        body = None
+        if data is not None:
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+            headers['Content-Type'] = 'application/json; charset=utf-8'
+            if len(body) >= GZIP_MIN_SIZE:
+                body = gzip.compress(body, compresslevel=5)
+                headers['Content-Encoding'] = 'gzip'
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.base + path, body, headers)
+                return conn.getresponse()
+            except RETRY_ERRORS as e:
+                self._drop_connection()
+                if attempt:
+                    raise RemoteError(f"Сервер реестров недоступен: {e}")
+            except OSError as e:
+                self._drop_connection()
+                raise RemoteError(f"Сервер реестров недоступен: {e}")
+
+    def _request(self, method, path, params=None, data=None, etag=None):
+        # Возвращает (данные, ETag); для 304 данные - None
+        response = self._send(method, path, params, data, etag)
+        try:
+            raw = response.read()
+        except OSError as e:
+            self._drop_connection()
+            raise RemoteError(f"Обрыв связи с сервером реестров: {e}")
+        if response.will_close:
+            self._drop_connection()
+        if response.status == 304:
+            return None, response.getheader('ETag')
+        if response.getheader('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        payload = json.loads(raw) if raw else None
+        if response.status >= 400:
+            message = payload.get('error') if isinstance(payload, dict) else None
+            raise RemoteError(message or f"Ошибка сервера: {response.status}", response.status, payload)
+        return payload, response.getheader('ETag')
+
+    def _call(self, method, path, params=None, data=None):
+        return self._request(method, path, params, data)[0]
+
+    # --- пользователи ---
+
+    def authenticate(self, login, password_hash):
+        result = self._call('POST', '/api/login', data={'login': login, 'password_hash': password_hash})
+        self.token = result.pop('token', None) or self.token
+        return result
+
+    def login_exists(self, login):
+        return self._call('GET', f"/api/logins/{quote(login, safe='')}")['exists']
+
+    def create_user(self, fio, login, password_hash):
+        self._call('POST', '/api/users', data={'fio': fio, 'login': login, 'password_hash': password_hash})
+
+    def get_users(self, is_locked=None):
+        params = None if is_locked is None else {'locked': int(is_locked)}
+        return [tuple(row) for row in self._call('GET', '/api/users', params)]
+
+    def unlock_user(self, user_id):
+        self._call('POST', f'/api/users/{int(user_id)}/unlock')
+
+    def reset_login_attempts(self, user_id):
+        self._call('POST', f'/api/users/{int(user_id)}/reset_attempts')
+
+    def update_user_rights(self, rights):
+        self._call('PUT', '/api/users/rights', data={'rights': [list(right) for right in rights]})
+
+    # --- чтение реестров ---
+
+    def data_version(self):
+        return self._call('GET', '/api/version')['data_version']
+
+    def last_change(self):
+        return self._call('GET', '/api/changes/last')['seq']
+
+    def get_records_page(self, file_type, after_id=0, limit=PAGE_SIZE):
+        path = f'/api/registers/{int(file_type)}/records'
+        params = {'after': after_id, 'limit': limit}
+        key = (path, after_id, limit)
+        cached = self.pages.get(key)
+        data, etag = self._request('GET', path, params, etag=cached[0] if cached else None)
+        if data is None:
+            return cached[1]
+        records = [tuple(record) for record in data]
+        if etag:
+            self.pages.put(key, etag, records)
+        return records
+
+    def get_all_records(self, file_type, columns=None):
+        if columns is not None:
+            return list(self.iter_records(file_type, columns))
+        records = []
+        after_id = 0
+        while True:
+            page = self.get_records_page(file_type, after_id)
+            records.extend(page)
+            if len(page) < PAGE_SIZE:
+                return records
+            after_id = page[-1][0]
+
+    def get_record(self, file_type, record_id):
+        try:
+            return tuple(self._call('GET', f'/api/registers/{int(file_type)}/records/{int(record_id)}'))
+        except RemoteError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_changes(self, file_type, since):
+        result = self._call('GET', f'/api/registers/{int(file_type)}/changes', {'since': since})
+        if result is None:
+            return None
+        seq, records, deleted = result
+        return seq, [tuple(record) for record in records], deleted
+
+    def search_records(self, file_type, text, limit=None):
+        return self._call('GET', f'/api/registers/{int(file_type)}/search', {'q': text, 'limit': limit})
+
+    def iter_records(self, file_type, columns=None, date_column=None, start=None, end=None,
+                     overdue_only=False, batch_size=1000):
+        # Построчная выгрузка: строки читаются из ответа по мере поступления
+        params = {
+            'columns': json.dumps(columns, ensure_ascii=False) if columns is not None else None,
+            'date_column': date_column,
+            'start': start,
+            'end': end,
+            'overdue_only': 1 if overdue_only else None
+        }
+        response = self._send('GET', f'/api/registers/{int(file_type)}/export', params)
+        try:
+            if response.status >= 400:
+                payload = json.loads(gzip.decompress(response.read())
+                                     if response.getheader('Content-Encoding') == 'gzip' else response.read())
+                raise RemoteError(payload.get('error'), response.status, payload)
+            stream = response
+            if response.getheader('Content-Encoding') == 'gzip':
+                stream = gzip.GzipFile(fileobj=response)
+            for line in stream:
+                yield tuple(json.loads(line))
+        finally:
+            # Выгрузка заканчивается закрытием соединения
+            self._drop_connection()
+
+    # --- запись ---
+
+    def update_record(self, file_type, record_id, column, value, editor=None, expected_version=None):
+        # Редактора сервер берет из сессии вошедшего пользователя
+        try:
+            result = self._call('PATCH', f'/api/registers/{int(file_type)}/records/{int(record_id)}',
+                                data={'column': column, 'value': value, 'expected_version': expected_version})
+        except RemoteError as e:
+            if e.status == 409:
+                record = e.payload.get('record')
+                raise ConflictError(record_id, tuple(record) if record is not None else None)
+            raise
+        return result['row_version']
+
+    content_hash = staticmethod(DatabaseHandler.content_hash)
+
+    def import_rows(self, file_type, columns, chunks, progress=None, total=None, upsert=True,
+                    row_hashes=None, source=None):
+        # Строки уходят на сервер пачками по IMPORT_BATCH_ROWS, каждая пачка -
+        # отдельная транзакция; повтор импорта безопасен благодаря upsert
+        columns = list(columns)
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        batch = []
+        done = 0
+
+        def send(rows):
+            result = self._call('POST', f'/api/registers/{int(file_type)}/rows',
+                                data={'columns': columns, 'rows': rows, 'upsert': upsert,
+                                      'source': list(source) if source else None})
+            for key in counts:
+                counts[key] += result[key]
+
+        for chunk in chunks:
+            rows = [list(row) for row in chunk]
+            if row_hashes is not None:
+                row_hashes.extend(self.content_hash(row) for row in rows)
+            batch.extend(rows)
+            done += len(rows)
+            if len(batch) >= IMPORT_BATCH_ROWS:
+                send(batch)
+                batch = []
+                if progress:
+                    progress(done, total)
+        if batch:
+            send(batch)
+        if progress:
+            progress(done, total)
+        return counts
+
+    import_from_dataframe = DatabaseHandler.import_from_dataframe
+
+    def find_import(self, file_type, path):
+        return self._call('GET', f'/api/registers/{int(file_type)}/imports', {'path': path})
+
+    def find_import_by_hash(self, file_type, file_hash):
+        return self._call('GET', f'/api/registers/{int(file_type)}/imports', {'hash': file_hash})
+
+    def record_import(self, file_type, path, size, mtime_ns, file_hash, sheets):
+        data = {
+            'path': path,
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'file_hash': file_hash,
+            'sheets': {sheet: [sheet_hash, hashes] for sheet, (sheet_hash, hashes) in sheets.items()}
+        }
+        return self._call('POST', f'/api/registers/{int(file_type)}/imports', data=data)['id']
+
+    def close(self):
+        if self.token:
+            try:
+                self._call('POST', '/api/logout')
+            except RemoteError:
+                pass
+            self.token = None
+        self._drop_connection()
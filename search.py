@@ -0,0 +1,145 @@
+import re
+
+import numpy as np
+
+from database import DATE_COLUMNS, NUMERIC_COLUMNS, to_iso_date
+
+RANGE_RE = re.compile(r'^(.+?)\s*\.\.\s*(.+)$')
+COMPARE_RE = re.compile(r'^(>=|<=|>|<)\s*(.+)$')
+
+
+def parse_number(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(' ', '').replace('\xa0', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+class SearchIndex:
+    # Колоночный индекс для поиска в FileWindow: массивы строятся один раз на
+    # загрузку данных (по требованию для каждой колонки), запросы - векторные
+    def __init__(self, model):
+        self.model = model
+        self.numeric_positions = {model.position_of(col) for col in NUMERIC_COLUMNS[model.file_type]}
+        self.date_positions = {model.position_of(col) for col in DATE_COLUMNS[model.file_type]}
+        self.active = None
+        self.reset()
+
+    def reset(self):
+        self._text = {}
+        self._numbers = {}
+        self._raw = {}
+
+    def _text_column(self, position):
+        # Массив str_ фиксированной ширины: подстрока ищется np.char.find
+        # без цикла Python по строкам
+        column = self._text.get(position)
+        if column is None:
+            display_value = self.model.display_value
+            column = np.array([display_value(record, position).lower() for record in self.model.records],
+                              dtype=str)
+            self._text[position] = column
+        return column
+
+    def _number_column(self, position):
+        column = self._numbers.get(position)
+        if column is None:
+            values = [parse_number(record[position]) for record in self.model.records]
+            column = np.array([np.nan if v is None else v for v in values], dtype=float)
+            self._numbers[position] = column
+        return column
+
+    def _raw_column(self, position):
+        # Даты в ISO: строковое сравнение совпадает с хронологическим
+        column = self._raw.get(position)
+        if column is None:
+            column = np.array([record[position] or '' for record in self.model.records], dtype=object)
+            self._raw[position] = column
+        return column
+
+    def update(self, index, record):
+        # Точечное обновление уже построенных массивов после правки строки
+        for position, column in list(self._text.items()):
+            value = self.model.display_value(record, position).lower()
+            if len(value) > column.dtype.itemsize // 4:
+                # Не помещается в ширину str_ - колонка строится заново при поиске
+                del self._text[position]
+            else:
+                column[index] = value
+        for position, column in self._numbers.items():
+            value = parse_number(record[position])
+            column[index] = np.nan if value is None else value
+        for position, column in self._raw.items():
+            column[index] = record[position] or ''
+
+    def parse(self, position, query):
+        query = query.strip().lower()
+        if not query:
+            return None
+        if position in self.numeric_positions or position in self.date_positions:
+            convert = parse_number if position in self.numeric_positions else self._parse_date
+            low = high = None
+            match = RANGE_RE.match(query)
+            if match:
+                low, high = convert(match.group(1)), convert(match.group(2))
+                if low is not None and high is not None:
+                    return ('range', position, low, high, True, True)
+            match = COMPARE_RE.match(query)
+            if match:
+                bound = convert(match.group(2))
+                if bound is not None:
+                    op = match.group(1)
+                    if op.startswith('>'):
+                        return ('range', position, bound, None, op == '>=', True)
+                    return ('range', position, None, bound, True, op == '<=')
+            if position in self.numeric_positions:
+                number = parse_number(query)
+                if number is not None:
+                    return ('number', position, number)
+        return ('text', position, query)
+
+    @staticmethod
+    def _parse_date(value):
+        try:
+            return to_iso_date(value.strip())
+        except ValueError:
+            return None
+
+    def _evaluate(self, spec, rows=slice(None)):
+        kind, position = spec[0], spec[1]
+        if kind == 'text':
+            column = self._text_column(position)[rows]
+            query = spec[2]
+            return np.char.find(column, query) >= 0
+        if kind == 'number':
+            column = self._number_column(position)[rows]
+            return np.isclose(column, spec[2], rtol=1e-9, atol=0.0)
+        _, _, low, high, include_low, include_high = spec
+        if position in self.numeric_positions:
+            column = self._number_column(position)[rows]
+            mask = ~np.isnan(column)
+        else:
+            column = self._raw_column(position)[rows]
+            mask = column != ''
+        if low is not None:
+            mask &= (column >= low) if include_low else (column > low)
+        if high is not None:
+            mask &= (column <= high) if include_high else (column < high)
+        return mask
+
+    def search(self, column, query):
+        # Возвращает массив признаков совпадения по записям модели или None
+        spec = self.parse(self.model.position_of(column), query)
+        self.active = spec
+        if spec is None:
+            return None
+        return self._evaluate(spec)
+
+    def match_one(self, index):
+        if self.active is None:
+            return None
+        return bool(self._evaluate(self.active, slice(index, index + 1))[0])
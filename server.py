@@ -0,0 +1,475 @@
+# Сервер реестров: единственный процесс, который открывает файл БД.
+# Клиенты (main.py --server http://host:8765) работают с ним по HTTP/JSON.
+#
+#   python server.py [--host 127.0.0.1] [--port 8765] [--db registers.db]
+import argparse
+import gzip
+import hashlib
+import json
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from backup import BackupService
+from database import (CALCULATED_COLUMNS, DB_NAME, REGISTER_COLUMNS, ConflictError, DatabaseHandler,
+                      ConnectionManager)
+
+DEFAULT_PORT = 8765
+PAGE_LIMIT = 5000
+GZIP_MIN_SIZE = 1024
+SESSION_TTL = 12 * 3600  # с без обращений к серверу
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class WriteQueue:
+    # Все изменения выполняет один поток. Запросы, накопившиеся, пока шла
+    # предыдущая запись, фиксируются одной общей транзакцией (каждый - в своей
+    # точке сохранения), поэтому журнал синхронизируется один раз на группу
+    def __init__(self, db, max_batch=64):
+        self.db = db
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='writer', daemon=True)
+        self.thread.start()
+
+    def call(self, func, *args, **kwargs):
+        job = {'func': func, 'args': args, 'kwargs': kwargs, 'done': threading.Event()}
+        self.jobs.put(job)
+        job['done'].wait()
+        if 'error' in job:
+            raise job['error']
+        return job['result']
+
+    def _run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            try:
+                with self.db.manager.transaction():
+                    for job in batch:
+                        try:
+                            results.append(('result', job['func'](*job['args'], **job['kwargs'])))
+                        except Exception as e:
+                            results.append(('error', e))
+            except Exception as e:
+                # Общая фиксация не удалась - не записан ни один запрос группы
+                results = [('error', e)] * len(batch)
+            for job, (key, value) in zip(batch, results):
+                job[key] = value
+                job['done'].set()
+
+
+class RegisterService:
+    # Операции сервера поверх DatabaseHandler: сессии, права и очередь записи
+    def __init__(self, db):
+        self.db = db
+        self.writes = WriteQueue(db)
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+
+    def login(self, login, password_hash):
+        result = self.writes.call(self.db.authenticate, login, password_hash)
+        if result['status'] == 'ok':
+            token = secrets.token_urlsafe(32)
+            with self.sessions_lock:
+                self.sessions[token] = [result['user'], time.monotonic()]
+            result['token'] = token
+        return result
+
+    def logout(self, token):
+        with self.sessions_lock:
+            self.sessions.pop(token, None)
+
+    def user(self, token):
+        now = time.monotonic()
+        with self.sessions_lock:
+            session = self.sessions.get(token)
+            if session is None or now - session[1] > SESSION_TTL:
+                self.sessions.pop(token, None)
+                raise HttpError(401, "Требуется вход")
+            session[1] = now
+            return session[0]
+
+    @staticmethod
+    def check_edit(user, file_type):
+        if not (user['is_admin'] or user.get(f'can_edit_{file_type}')):
+            raise HttpError(403, "Нет прав на изменение реестра")
+
+    @staticmethod
+    def check_admin(user):
+        if not user['is_admin']:
+            raise HttpError(403, "Требуются права администратора")
+
+
+def file_type_of(value):
+    file_type = int(value)
+    if file_type not in REGISTER_COLUMNS:
+        raise HttpError(404, f"Нет реестра {value}")
+    return file_type
+
+
+def check_columns(file_type, columns, editable=False):
+    # Имена колонок попадают в текст SQL - принимаются только колонки реестра
+    allowed = set(REGISTER_COLUMNS[file_type])
+    if editable:
+        allowed -= set(CALCULATED_COLUMNS[file_type]) | {'Редактор'}
+    for column in columns:
+        if column not in allowed:
+            raise HttpError(400, f"Недопустимая колонка: {column}")
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = 64 * 1024  # буферизованный вывод; сбрасывается после каждого запроса
+    service = None  # RegisterService, задается в make_server
+
+    ROUTES = []
+
+    @classmethod
+    def route(cls, method, pattern):
+        def register(func):
+            cls.ROUTES.append((method, re.compile(f'^{pattern}$'), func))
+            return func
+        return register
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- разбор запроса и ответ ---
+
+    def read_body(self):
+        # Тело читается до разбора адреса: при ошибке в соединении не остается
+        # непрочитанных данных, и его можно использовать для следующих запросов
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+    def read_json(self):
+        body = self.body
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body) if body else {}
+
+    def accepts_gzip(self):
+        return 'gzip' in (self.headers.get('Accept-Encoding') or '')
+
+    def send_json(self, data, status=200, cache=False):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        etag = None
+        if cache:
+            # ETag - хэш содержимого: неизменная страница не передается повторно
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if etag:
+            self.send_header('ETag', etag)
+        if len(body) >= GZIP_MIN_SIZE and self.accepts_gzip():
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, lines):
+        # Построчная выгрузка (JSON на строку) без Content-Length: конец
+        # ответа - закрытие соединения; в памяти не накапливается
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.close_connection = True
+        compress = self.accepts_gzip()
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        # GzipFile пишет свой заголовок сразу - только после заголовков HTTP
+        stream = gzip.GzipFile(fileobj=self.wfile, mode='wb', compresslevel=5) if compress else self.wfile
+        for line in lines:
+            stream.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+        if stream is not self.wfile:
+            stream.close()
+        self.wfile.flush()
+
+    def token(self):
+        header = self.headers.get('Authorization') or ''
+        return header[7:] if header.startswith('Bearer ') else None
+
+    def current_user(self):
+        return self.service.user(self.token())
+
+    def dispatch(self, method):
+        self.read_body()
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            for route_method, pattern, func in self.ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    func(self, *match.groups())
+                    return
+            raise HttpError(404, "Неизвестный адрес")
+        except HttpError as e:
+            self.send_json(dict(error=str(e), **e.extra), e.status)
+        except ConflictError as e:
+            self.send_json({'error': str(e), 'record': e.record}, 409)
+        except sqlite3.IntegrityError as e:
+            self.send_json({'error': str(e)}, 409)
+        except (ValueError, KeyError) as e:
+            self.send_json({'error': f"Некорректный запрос: {e}"}, 400)
+        except Exception as e:
+            print("Ошибка обработки запроса:", method, self.path, e)
+            self.send_json({'error': str(e)}, 500)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+
+route = RequestHandler.route
+
+
+# --- пользователи ---
+
+@route('POST', '/api/login')
+def login(handler):
+    data = handler.read_json()
+    handler.send_json(handler.service.login(data['login'], data['password_hash']))
+
+
+@route('POST', '/api/logout')
+def logout(handler):
+    handler.service.logout(handler.token())
+    handler.send_json({})
+
+
+@route('GET', '/api/logins/(.+)')
+def login_exists(handler, name):
+    handler.send_json({'exists': handler.service.db.login_exists(name)})
+
+
+@route('POST', '/api/users')
+def create_user(handler):
+    data = handler.read_json()
+    service = handler.service
+    service.writes.call(service.db.create_user, data['fio'], data['login'], data['password_hash'])
+    handler.send_json({}, 201)
+
+
+@route('GET', '/api/users')
+def get_users(handler):
+    service = handler.service
+    service.check_admin(handler.current_user())
+    locked = handler.query.get('locked')
+    handler.send_json(service.db.get_users(None if locked is None else bool(int(locked))))
+
+
+@route('POST', r'/api/users/(\d+)/(unlock|reset_attempts)')
+def change_user(handler, user_id, action):
+    service = handler.service
+    service.check_admin(handler.current_user())
+    func = service.db.unlock_user if action == 'unlock' else service.db.reset_login_attempts
+    service.writes.call(func, int(user_id))
+    handler.send_json({})
+
+
+@route('PUT', '/api/users/rights')
+def update_user_rights(handler):
+    service = handler.service
+    service.check_admin(handler.current_user())
+    service.writes.call(service.db.update_user_rights, handler.read_json()['rights'])
+    handler.send_json({})
+
+
+# --- реестры ---
+
+@route('GET', '/api/version')
+def version(handler):
+    # Клиенты опрашивают часто: data_version не читает страниц БД
+    handler.current_user()
+    handler.send_json({'data_version': handler.service.db.data_version()})
+
+
+@route('GET', '/api/changes/last')
+def last_change(handler):
+    handler.current_user()
+    handler.send_json({'seq': handler.service.db.last_change()})
+
+
+@route('GET', r'/api/registers/(\d+)/records')
+def records_page(handler, file_type):
+    handler.current_user()
+    limit = min(int(handler.query.get('limit', PAGE_LIMIT)), PAGE_LIMIT)
+    records = handler.service.db.get_records_page(file_type_of(file_type),
+                                                  int(handler.query.get('after', 0)), limit)
+    handler.send_json(records, cache=True)
+
+
+@route('GET', r'/api/registers/(\d+)/records/(\d+)')
+def get_record(handler, file_type, record_id):
+    handler.current_user()
+    record = handler.service.db.get_record(file_type_of(file_type), int(record_id))
+    if record is None:
+        raise HttpError(404, f"Запись {record_id} не найдена")
+    handler.send_json(record)
+
+
+@route('PATCH', r'/api/registers/(\d+)/records/(\d+)')
+def update_record(handler, file_type, record_id):
+    # Правка одной ячейки; редактор - вошедший пользователь, а не значение из запроса
+    service = handler.service
+    user = handler.current_user()
+    file_type = file_type_of(file_type)
+    service.check_edit(user, file_type)
+    data = handler.read_json()
+    check_columns(file_type, [data['column']], editable=True)
+    version = service.writes.call(service.db.update_record, file_type, int(record_id), data['column'],
+                                  data.get('value'), editor=user['id'],
+                                  expected_version=data.get('expected_version'))
+    handler.send_json({'row_version': version})
+
+
+@route('GET', r'/api/registers/(\d+)/search')
+def search(handler, file_type):
+    handler.current_user()
+    limit = handler.query.get('limit')
+    handler.send_json(handler.service.db.search_records(file_type_of(file_type), handler.query.get('q', ''),
+                                                        int(limit) if limit else None))
+
+
+@route('GET', r'/api/registers/(\d+)/changes')
+def changes(handler, file_type):
+    handler.current_user()
+    handler.send_json(handler.service.db.get_changes(file_type_of(file_type), int(handler.query['since'])))
+
+
+@route('POST', r'/api/registers/(\d+)/rows')
+def import_rows(handler, file_type):
+    # Пачка строк массового импорта - одна транзакция на пачку
+    service = handler.service
+    user = handler.current_user()
+    file_type = file_type_of(file_type)
+    service.check_edit(user, file_type)
+    data = handler.read_json()
+    columns, rows = data['columns'], data['rows']
+    if 'Редактор' in columns:
+        # Новая запись из окна реестра: редактор - вошедший пользователь,
+        # а не значение из запроса (как при правке ячейки)
+        i = columns.index('Редактор')
+        rows = [row[:i] + [user['id']] + row[i + 1:] for row in rows]
+    # Вычисляемые колонки заполняет сама БД - как при импорте из файла
+    check_columns(file_type, [column for column in columns if column != 'Редактор'], editable=True)
+    source = data.get('source')
+    counts = service.writes.call(service.db.import_rows, file_type, columns, [rows],
+                                 upsert=data.get('upsert', True), source=tuple(source) if source else None)
+    handler.send_json(counts)
+
+
+@route('GET', r'/api/registers/(\d+)/export')
+def export(handler, file_type):
+    handler.current_user()
+    file_type = file_type_of(file_type)
+    query = handler.query
+    columns = json.loads(query['columns']) if 'columns' in query else None
+    if columns is not None:
+        check_columns(file_type, columns)
+    date_column = query.get('date_column')
+    if date_column is not None:
+        check_columns(file_type, [date_column])
+    rows = handler.service.db.iter_records(file_type, columns, date_column=date_column,
+                                           start=query.get('start'), end=query.get('end'),
+                                           overdue_only=query.get('overdue_only') == '1')
+    # Первая строка читается до заголовков: ошибка запроса вернется обычным ответом
+    first = next(rows, None)
+    handler.send_stream(_chain(first, rows) if first is not None else [])
+
+
+def _chain(first, rows):
+    yield first
+    yield from rows
+
+
+@route('GET', r'/api/registers/(\d+)/imports')
+def find_import(handler, file_type):
+    handler.current_user()
+    db = handler.service.db
+    file_type = file_type_of(file_type)
+    if 'hash' in handler.query:
+        entry = db.find_import_by_hash(file_type, handler.query['hash'])
+    else:
+        entry = db.find_import(file_type, handler.query['path'])
+    handler.send_json(entry)
+
+
+@route('POST', r'/api/registers/(\d+)/imports')
+def record_import(handler, file_type):
+    service = handler.service
+    file_type = file_type_of(file_type)
+    service.check_edit(handler.current_user(), file_type)
+    data = handler.read_json()
+    sheets = {sheet: tuple(value) for sheet, value in data['sheets'].items()}
+    ledger_id = service.writes.call(service.db.record_import, file_type, data['path'], data['size'],
+                                    data['mtime_ns'], data['file_hash'], sheets)
+    handler.send_json({'id': ledger_id})
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, db_name=DB_NAME, db=None):
+    # Сервер с собственным классом обработчика: в одном процессе (например,
+    # в проверках) можно поднять несколько серверов на разных базах
+    db = db or DatabaseHandler(db_name, ConnectionManager(db_name))
+    handler = type('BoundRequestHandler', (RequestHandler,), {'service': RegisterService(db)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер реестров")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--no-backup', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.db)
+    if not args.no_backup:
+        BackupService(args.db).start()
+    print(f"Сервер реестров: http://{args.host}:{server.server_address[1]} (БД {args.db})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+import itertools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    _ids = itertools.count(1)
+
+    def __init__(self, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        self.id = next(self._ids)
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+
+class TaskContext:
+    # Передается в функцию задачи: сообщения о ходе работы и проверка отмены
+    PROGRESS_INTERVAL = 0.1  # с, чаще интерфейс не обновляется
+
+    def __init__(self, runner, task):
+        self.runner = runner
+        self.task = task
+        self._last_progress = 0.0
+
+    @property
+    def cancelled(self):
+        return self.task.cancelled
+
+    def check(self):
+        if self.task.cancelled:
+            raise Cancelled()
+
+    def progress(self, done, total=None, message=None):
+        # Вызывается из рабочего потока; заодно точка отмены задачи
+        self.check()
+        now = time.monotonic()
+        if self.task.on_progress and (now - self._last_progress >= self.PROGRESS_INTERVAL or done == total):
+            self._last_progress = now
+            self.runner.events.put((self.task, 'progress', (done, total, message)))
+
+
+class TaskRunner:
+    # Фоновые задачи для Tk: чтение и экспорт - в пуле потоков (у каждого
+    # потока свои соединения из пула чтения), изменения БД - в отдельном
+    # единственном потоке, по одной. Результаты возвращаются в поток Tk через
+    # очередь, которую опрашивает after()
+    POLL_INTERVAL = 50  # мс
+
+    def __init__(self, widget, workers=2):
+        self.widget = widget
+        self.events = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task')
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+        self.pending = 0
+        self._poll_job = None
+
+    def submit(self, func, *args, on_done=None, on_error=None, on_progress=None, on_cancel=None,
+               write=False, **kwargs):
+        # func(context, *args, **kwargs) выполняется в фоне; обработчики on_* -
+        # в потоке Tk. write=True - задача встает в очередь записи
+        task = Task(on_done, on_error, on_progress, on_cancel)
+        self.pending += 1
+        executor = self.writer if write else self.pool
+        executor.submit(self._run, task, func, args, kwargs)
+        self._schedule_poll()
+        return task
+
+    def _run(self, task, func, args, kwargs):
+        context = TaskContext(self, task)
+        try:
+            context.check()
+            result = func(context, *args, **kwargs)
+        except Cancelled:
+            self.events.put((task, 'cancelled', None))
+        except Exception as e:
+            self.events.put((task, 'error', (e, traceback.format_exc())))
+        else:
+            self.events.put((task, 'done', result))
+
+    def _schedule_poll(self):
+        if self._poll_job is None:
+            self._poll_job = self.widget.after(self.POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                task, kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind != 'progress':
+                self.pending -= 1
+            try:
+                # Обработчики выполняются в потоке Tk: долгий обработчик - зависание окна
+                with instrumentation.span('tk.' + kind, task=task.id):
+                    self._dispatch(task, kind, payload)
+            except Exception as e:
+                # Окно задачи могло быть уже закрыто - опрос очереди продолжается
+                print("Ошибка обработчика задачи:", e)
+        if self.pending > 0:
+            self._schedule_poll()
+
+    @staticmethod
+    def _dispatch(task, kind, payload):
+        if kind == 'progress':
+            if not task.cancelled:
+                task.on_progress(*payload)
+        elif kind == 'done':
+            if task.on_done:
+                task.on_done(payload)
+        elif kind == 'cancelled':
+            if task.on_cancel:
+                task.on_cancel()
+        elif task.on_error:
+            task.on_error(*payload)
+        else:
+            print("Ошибка фоновой задачи:", payload[1])
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.writer.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ConnectionManager, DatabaseHandler  # noqa: E402
+from migrations import MIGRATIONS  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Копии перед миграцией и журналы пишутся относительно текущей папки
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def open_db(workdir):
+    managers = []
+
+    def open_db(name='registers.db'):
+        path = str(workdir / name)
+        manager = ConnectionManager(path)
+        managers.append(manager)
+        return DatabaseHandler(path, manager=manager)
+
+    yield open_db
+    for manager in managers:
+        manager.close()
+
+
+@pytest.fixture
+def db(open_db):
+    return open_db()
+
+
+@pytest.fixture
+def legacy_db(workdir):
+    # База, созданная программой до появления миграций: схема шагов 1-2,
+    # даты ДД.ММ.ГГГГ, user_version = 0
+    def legacy_db(contracts=(), agreements=(), name='registers.db'):
+        path = str(workdir / name)
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        for version, _, step in MIGRATIONS:
+            if version <= 2:
+                step(cursor)
+        for table, rows in (('contracts', contracts), ('agreements', agreements)):
+            for row in rows:
+                columns = ', '.join('"' + col.replace('"', '""') + '"' for col in row)
+                cursor.execute(f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(row))})',
+                               list(row.values()))
+        conn.commit()
+        conn.close()
+        return name
+
+    return legacy_db
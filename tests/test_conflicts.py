@@ -0,0 +1,38 @@
+import pytest
+
+from database import REGISTER_COLUMNS, ConflictError
+from test_reimport import COLUMNS, contract, records
+
+
+def test_stale_version_is_rejected(db):
+    db.import_rows(1, COLUMNS, [[contract('1')]])
+    record = records(db)[0]
+    version = db.update_record(1, record['id'], 'Оплачено', 100.0, expected_version=record['row_version'])
+    assert version == record['row_version'] + 1
+    # Второй пользователь правит по прочитанной раньше версии
+    with pytest.raises(ConflictError) as error:
+        db.update_record(1, record['id'], 'Оплачено', 200.0, expected_version=record['row_version'])
+    current = dict(zip(['id'] + REGISTER_COLUMNS[1] + ['row_version'], error.value.record))
+    assert error.value.record_id == record['id']
+    assert current['Оплачено'] == 100.0
+    assert current['row_version'] == version
+    assert records(db)[0]['Оплачено'] == 100.0
+
+
+def test_deleted_row_conflict_has_no_record(db):
+    db.import_rows(1, COLUMNS, [[contract('1')]])
+    record = records(db)[0]
+    with db.manager.transaction() as conn:
+        conn.execute('DELETE FROM contracts WHERE id = ?', (record['id'],))
+    with pytest.raises(ConflictError) as error:
+        db.update_record(1, record['id'], 'Оплачено', 100.0, expected_version=record['row_version'])
+    assert error.value.record is None
+
+
+def test_update_without_version_always_writes(db):
+    db.import_rows(1, COLUMNS, [[contract('1')]])
+    record = records(db)[0]
+    db.update_record(1, record['id'], 'Оплачено', 100.0)
+    db.update_record(1, record['id'], 'Оплачено', 200.0)
+    assert records(db)[0]['Оплачено'] == 200.0
+    assert records(db)[0]['row_version'] == record['row_version'] + 2
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from test_reimport import COLUMNS, contract, records
+
+
+def test_text_dates_are_stored_as_iso(db):
+    df = pd.DataFrame([contract('1', day='05.05.2023')], columns=COLUMNS)
+    db.import_from_dataframe(1, df)
+    record = records(db)[0]
+    assert record['Дата заключения договора'] == '2023-05-05'
+    assert record['Срок оплаты по договору'] == '2023-05-12'
+
+
+def test_same_date_in_any_format_is_one_row(db):
+    db.import_rows(1, COLUMNS, [[contract('1', day='10.03.2023')]])
+    result = db.import_rows(1, COLUMNS, [[contract('1', day='2023-03-10')]])
+    assert result == {'inserted': 0, 'updated': 0, 'unchanged': 1}
+
+
+def test_bad_date_rolls_back_import(db):
+    with pytest.raises(ValueError):
+        db.import_rows(1, COLUMNS, [[contract('1'), contract('2', day='весной')]])
+    assert records(db) == []
+
+
+def test_update_record_stores_iso_date(db):
+    db.import_rows(1, COLUMNS, [[contract('1')]])
+    record_id = records(db)[0]['id']
+    db.update_record(1, record_id, 'Фактическая дата оплаты', '05.05.2023')
+    assert records(db)[0]['Фактическая дата оплаты'] == '2023-05-05'
+    with pytest.raises(ValueError):
+        db.update_record(1, record_id, 'Фактическая дата оплаты', '31.02.2023')
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+import exporter
+from test_reimport import COLUMNS, contract
+
+
+def test_excel_cells_have_number_formats(db, workdir):
+    db.import_rows(1, COLUMNS, [[contract('1', paid=1000.0)]])
+    path = str(workdir / 'export.xlsx')
+    assert exporter.write_excel(db, 1, path) == 1
+    worksheet = load_workbook(path).active
+    header = [cell.value for cell in worksheet[1]]
+    row = {name: cell for name, cell in zip(header, worksheet[2])}
+    date = row['Дата заключения договора']
+    assert date.value == datetime(2023, 3, 10)
+    assert date.number_format == exporter.DATE_FORMAT
+    assert row['Оплачено'].number_format == exporter.MONEY_FORMAT
+    assert row['Контроль по дате ("-" - просрочка)'].value is None
+    assert row['Покупатель, ИНН'].number_format == 'General'
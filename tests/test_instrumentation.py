@@ -0,0 +1,58 @@
+import json
+import time
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture
+def metrics(workdir):
+    instrumentation.enable(directory=str(workdir / 'logs'), slow_query_ms=50)
+    yield workdir / 'logs' / instrumentation.SLOW_LOG_FILE
+    instrumentation.disable()
+
+
+def slow_entries(path):
+    if not path.exists():
+        return []
+    entries = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    return [entry for entry in entries if entry['kind'] == 'query']
+
+
+def test_python_work_between_statements_is_not_query_time(db, metrics):
+    with db.manager.read() as conn:
+        cursor = conn.execute('SELECT coalesce(max(id), 0) FROM contracts')
+        time.sleep(0.1)
+        cursor.fetchone()
+        time.sleep(0.1)
+        conn.execute('SELECT count(*) FROM agreements').fetchall()
+    assert slow_entries(metrics) == []
+
+
+def test_slow_statement_is_logged_with_plan(db, metrics):
+    with db.manager.read() as conn:
+        conn.create_function('pause', 1, time.sleep)
+        conn.execute('SELECT pause(0.08) FROM contracts LIMIT 1').fetchall()
+        conn.execute('SELECT pause(0.08)').fetchone()
+    entries = slow_entries(metrics)
+    assert [entry['sql'] for entry in entries] == ['SELECT pause(0.08)']
+    assert entries[0]['ms'] >= 80
+    assert entries[0]['plan'] is not None
+
+
+def test_parameterized_statements_get_a_plan(db, metrics):
+    from test_reimport import COLUMNS, contract
+
+    # Порог 0: в журнал попадает каждый запрос, и у каждого должен быть план
+    instrumentation.enable(slow_query_ms=0)
+    db.import_rows(1, COLUMNS, [[contract('1'), contract('2')]])
+    record_id = db.get_all_records(1)[0][0]
+    db.update_record(1, record_id, 'Оплачено', 10.0, expected_version=0)
+    db.get_records_page(1, 0, 10)
+    entries = [entry for entry in slow_entries(metrics) if entry['plan'] is not None]
+    planned = {entry['sql'].split()[0].upper() for entry in entries}
+    assert {'INSERT', 'UPDATE', 'SELECT'} <= planned
+    for entry in entries:
+        assert not any(line.startswith('не удалось') for line in entry['plan']), entry
+    assert any('USING INTEGER PRIMARY KEY' in line for entry in entries for line in entry['plan'])
@@ -0,0 +1,79 @@
+import glob
+import sqlite3
+
+from database import REGISTER_COLUMNS
+from migrations import LATEST_VERSION
+
+CONTRACT = {
+    'Номер договора': 15,
+    'Дата заключения договора': '10.03.2023',
+    'Покупатель, ИНН': 'ООО "Вега", ИНН 6312345678',
+    'Цена ЗУ по договору, руб.': 100000.0,
+    'Фактическая дата оплаты': '20.03.2023',
+    'Оплачено': 60000.0,
+    'примечание': '',
+}
+
+
+def test_legacy_database_is_migrated(legacy_db, open_db):
+    name = legacy_db(contracts=[CONTRACT])
+    db = open_db(name)
+    assert db.schema_version == LATEST_VERSION
+    record = db.get_all_records(1)[0]
+    values = dict(zip(['id'] + REGISTER_COLUMNS[1], record))
+    assert values['Дата заключения договора'] == '2023-03-10'
+    # Срок оплаты дозаполнен миграцией (+7 дней), контрольные колонки вычислены
+    assert values['Срок оплаты по договору'] == '2023-03-17'
+    assert values['Контроль по дате ("-" - просрочка)'] == -3
+    assert values['Контроль по оплате цены ("-" - переплата; "+" - недоплата)'] == 40000
+    assert db.search_records(1, 'вега') == [record[0]]
+
+
+def test_backup_is_taken_before_migration(legacy_db, open_db, workdir):
+    name = legacy_db(contracts=[CONTRACT])
+    db = open_db(name)
+    backups = glob.glob(str(workdir / 'backups' / 'registers_pre_v0_*.bak'))
+    assert len(backups) == 1
+    assert any(message.startswith('Копия перед миграцией') for message in db.migration_log)
+    # В копии - состояние до миграций
+    conn = sqlite3.connect(backups[0])
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+        assert conn.execute('SELECT "Дата заключения договора" FROM contracts').fetchone()[0] == '10.03.2023'
+    finally:
+        conn.close()
+
+
+def test_new_database_needs_no_backup(open_db, workdir):
+    db = open_db()
+    assert db.schema_version == LATEST_VERSION
+    assert not (workdir / 'backups').exists()
+
+
+def test_migrated_database_is_not_migrated_again(legacy_db, open_db):
+    name = legacy_db(contracts=[CONTRACT])
+    open_db(name).manager.close()
+    db = open_db(name)
+    assert db.schema_version == LATEST_VERSION
+    assert db.migration_log == []
+
+
+def test_duplicate_keys_are_merged_not_dropped(legacy_db, open_db):
+    # Старая копия содержит оплату, повторно загруженная новая - пустая
+    paid = dict(CONTRACT, **{'Покупатель, ИНН': 'Петров П.П.'})
+    reimported = dict(CONTRACT, **{'Фактическая дата оплаты': '', 'Оплачено': None,
+                                   'примечание': 'повторная загрузка'})
+    name = legacy_db(contracts=[paid, reimported, dict(CONTRACT, **{'Номер договора': 16})])
+    db = open_db(name)
+    values = [dict(zip(['id'] + REGISTER_COLUMNS[1], record)) for record in db.get_all_records(1)]
+    assert [value['Номер договора'] for value in values] == [15, 16]
+    merged = values[0]
+    assert merged['id'] == 2
+    assert merged['Оплачено'] == 60000.0
+    assert merged['Фактическая дата оплаты'] == '2023-03-20'
+    assert merged['примечание'] == 'повторная загрузка'
+    # Расхождение непустых значений попадает в замечания миграции
+    assert merged['Покупатель, ИНН'] == CONTRACT['Покупатель, ИНН']
+    notes = [message for message in db.migration_log if message.startswith('Миграция 6: ')]
+    assert any('объединено копий строк с одинаковым ключом: 1' in note for note in notes)
+    assert any('15 от 2023-03-10' in note for note in notes)
@@ -0,0 +1,106 @@
+import pandas as pd
+from openpyxl import Workbook
+
+import importer
+from database import REGISTER_COLUMNS
+from importer import import_columns
+
+COLUMNS = import_columns(1)
+SOURCE = ('/data/реестр.xlsx', 'Лист1')
+
+
+def contract(number, day='2023-03-10', paid=None, note=None):
+    values = {
+        'Номер договора': number,
+        'Дата заключения договора': day,
+        'Покупатель, ИНН': 'Иванов И.И., ИНН 631234567890',
+        'Цена ЗУ по договору, руб.': 1000.0,
+        'Оплачено': paid,
+        'примечание': note,
+    }
+    return [values.get(col) for col in COLUMNS]
+
+
+def records(db):
+    names = ['id'] + REGISTER_COLUMNS[1] + ['row_version']
+    return [dict(zip(names, record)) for record in db.get_all_records(1)]
+
+
+def import_sheet(db, rows, source=SOURCE):
+    # Как import_workbook: строки листа, затем запись в журнал импорта
+    hashes = []
+    counts = db.import_rows(1, COLUMNS, [rows], row_hashes=hashes, source=source)
+    db.record_import(1, source[0], 0, 0, 'hash', {source[1]: ('fingerprint', hashes)})
+    return counts
+
+
+def test_same_rows_are_not_imported_twice(db):
+    rows = [contract('1'), contract('2'), contract('б/н'), contract(None, note='без номера')]
+    assert import_sheet(db, rows) == {'inserted': 4, 'updated': 0, 'unchanged': 0}
+    assert import_sheet(db, rows) == {'inserted': 0, 'updated': 0, 'unchanged': 4}
+    assert len(records(db)) == 4
+
+
+def test_identical_keyless_lines_are_separate_rows(db):
+    rows = [contract('б/н'), contract('б/н'), contract('1')]
+    assert import_sheet(db, rows)['inserted'] == 3
+    assert import_sheet(db, rows)['inserted'] == 0
+    # В листе стало на одну такую строку больше - добавляется только она
+    assert import_sheet(db, rows + [contract('б/н')])['inserted'] == 1
+    assert len(records(db)) == 4
+
+
+def test_keyless_row_from_other_source_is_added(db):
+    import_sheet(db, [contract('б/н')])
+    assert import_sheet(db, [contract('б/н')], ('/data/реестр.xlsx', 'Лист2'))['inserted'] == 1
+    assert db.import_rows(1, COLUMNS, [[contract('б/н')]])['inserted'] == 1
+    assert len(records(db)) == 3
+
+
+def test_new_rows_created_twice_on_one_day(db):
+    # "Создать новый" дважды за день дает одинаковые строки без номера
+    df = pd.DataFrame([contract('', day='05.05.2023')], columns=COLUMNS)
+    df['Редактор'] = None
+    db.import_from_dataframe(1, df, upsert=False)
+    db.import_from_dataframe(1, df, upsert=False)
+    assert len(records(db)) == 2
+
+
+def test_workbook_reimport_keeps_keyless_rows(db, workdir):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(COLUMNS)
+    for row in [contract('1'), contract('б/н'), contract('б/н')]:
+        sheet.append(row)
+    path = str(workdir / 'реестр.xlsx')
+    workbook.save(path)
+    assert importer.import_workbook(db, 1, path)['inserted'] == 3
+    result = importer.import_workbook(db, 1, path, force=True)
+    assert (result['inserted'], result['unchanged']) == (0, 3)
+
+
+def test_changed_row_is_updated_in_place(db):
+    db.import_rows(1, COLUMNS, [[contract('1'), contract('2')]])
+    before = {record['Номер договора']: record for record in records(db)}
+    result = db.import_rows(1, COLUMNS, [[contract('1', paid=1000.0), contract('2')]])
+    assert result == {'inserted': 0, 'updated': 1, 'unchanged': 1}
+    after = {record['Номер договора']: record for record in records(db)}
+    assert after[1]['id'] == before[1]['id']
+    assert after[1]['Оплачено'] == 1000.0
+    assert after[1]['row_version'] == before[1]['row_version'] + 1
+    assert after[2]['row_version'] == before[2]['row_version']
+
+
+def test_changed_keyless_row_is_added(db):
+    # Строку без ключа не с чем сопоставить: измененная строка - новая строка
+    import_sheet(db, [contract('б/н')])
+    result = import_sheet(db, [contract('б/н', paid=500.0)])
+    assert result['inserted'] == 1
+    assert len(records(db)) == 2
+
+
+def test_insert_mode_adds_duplicates(db):
+    rows = [contract('б/н')]
+    db.import_rows(1, COLUMNS, [rows], upsert=False)
+    db.import_rows(1, COLUMNS, [rows], upsert=False)
+    assert len(records(db)) == 2
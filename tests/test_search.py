@@ -0,0 +1,57 @@
+from register_model import RegisterModel
+from search import SearchIndex
+from test_reimport import COLUMNS, contract
+
+
+def make_index(db):
+    rows = [contract('1', day='2019-12-31', note='оплата частями'),
+            contract('2', day='2020-01-01', paid=1000.0),
+            contract('3', day='2021-06-15', note='Передано в суд'),
+            contract('4', day='2022-01-01')]
+    db.import_rows(1, COLUMNS, [rows])
+    model = RegisterModel(1)
+    model.load(db.get_all_records(1))
+    return model, SearchIndex(model)
+
+
+def numbers(model, mask):
+    position = model.position_of('Номер договора')
+    return sorted(record[position] for record, match in zip(model.records, mask) if match)
+
+
+def test_date_range(db):
+    model, index = make_index(db)
+    column = 'Дата заключения договора'
+    spec = index.parse(model.position_of(column), '01.01.2020..31.12.2021')
+    assert spec[0] == 'range' and spec[1] in index.date_positions
+    assert spec[2:4] == ('2020-01-01', '2021-12-31')
+    assert numbers(model, index.search(column, '01.01.2020..31.12.2021')) == [2, 3]
+    assert numbers(model, index.search(column, '> 01.01.2020')) == [3, 4]
+    # Без ".." это не диапазон, а поиск подстроки
+    assert index.parse(model.position_of(column), '01.01.2020 - 31.12.2021')[0] == 'text'
+
+
+def test_number_range_and_value(db):
+    model, index = make_index(db)
+    assert numbers(model, index.search('Оплачено', '500..1 000,00')) == [2]
+    assert numbers(model, index.search('Оплачено', '1000')) == [2]
+    assert numbers(model, index.search('Оплачено', '< 500')) == []
+
+
+def test_text_is_case_insensitive_substring(db):
+    model, index = make_index(db)
+    assert numbers(model, index.search('примечание', 'передано')) == [3]
+    assert numbers(model, index.search('примечание', 'ОПЛАТА')) == [1]
+    assert index.search('примечание', '  ') is None
+
+
+def test_update_longer_than_column(db):
+    model, index = make_index(db)
+    index.search('примечание', 'суд')
+    position = model.position_of('примечание')
+    record = list(model.records[0])
+    record[position] = 'направлена претензия, ответ не получен, готовится иск в суд'
+    model.records[0] = record
+    index.update(0, record)
+    assert index.match_one(0)
+    assert numbers(model, index.search('примечание', 'суд')) == [1, 3]
@@ -0,0 +1,111 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from database import REGISTER_COLUMNS, ConflictError
+from remote import RemoteDatabaseHandler, RemoteError
+from server import make_server
+from test_reimport import COLUMNS, contract
+
+PASSWORD = 'hash'
+
+
+@pytest.fixture
+def server(db):
+    # Сервер на свободном порту localhost в фоновом потоке
+    db.create_user('Иванов И.И.', 'editor', PASSWORD)
+    db.create_user('Петров П.П.', 'reader', PASSWORD)
+    users = {login: user_id for user_id, _, login, *_ in db.get_users()}
+    db.update_user_rights([(users['editor'], 0, 1, 0), (users['reader'], 0, 0, 0)])
+    httpd = make_server('127.0.0.1', 0, db=db)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    clients = []
+
+    def client(login='editor'):
+        remote = RemoteDatabaseHandler(server)
+        clients.append(remote)
+        if login is not None:
+            assert remote.authenticate(login, PASSWORD)['status'] == 'ok'
+        return remote
+
+    yield client
+    for remote in clients:
+        remote.close()
+
+
+def test_requests_need_login_and_rights(client):
+    anonymous = client(None)
+    with pytest.raises(RemoteError) as error:
+        anonymous.data_version()
+    assert error.value.status == 401
+    assert anonymous.authenticate('editor', 'wrong')['status'] == 'wrong'
+    with pytest.raises(RemoteError) as error:
+        client('reader').import_rows(1, COLUMNS, [[contract('1')]])
+    assert error.value.status == 403
+
+
+def test_import_and_reimport(client):
+    remote = client()
+    rows = [contract('1'), contract('2', day='05.05.2023'), contract('3')]
+    assert remote.import_rows(1, COLUMNS, [rows]) == {'inserted': 3, 'updated': 0, 'unchanged': 0}
+    assert remote.import_rows(1, COLUMNS, [rows]) == {'inserted': 0, 'updated': 0, 'unchanged': 3}
+    records = remote.get_all_records(1)
+    assert len(records) == 3
+    assert '2023-05-05' in records[1]
+
+
+def test_generated_columns_are_rejected(client):
+    remote = client()
+    column = 'Контроль по оплате цены ("-" - переплата; "+" - недоплата)'
+    with pytest.raises(RemoteError) as error:
+        remote.import_rows(1, COLUMNS + [column], [[contract('1') + [1]]])
+    assert error.value.status == 400
+    assert remote.get_all_records(1) == []
+
+
+def test_new_record_editor_is_session_user(client, db):
+    # Запрос "Создать новый" (main.py create_new): строка без номера и колонка
+    # "Редактор"; сервер подставляет вошедшего пользователя
+    remote = client()
+    df = pd.DataFrame([contract('', day='2023-05-05')], columns=COLUMNS)
+    df['Редактор'] = 999
+    remote.import_from_dataframe(1, df, upsert=False)
+    remote.import_from_dataframe(1, df, upsert=False)
+    records = db.get_all_records(1)
+    assert len(records) == 2
+    # В выборке вместо id редактора - его ФИО
+    assert [dict(zip(['id'] + REGISTER_COLUMNS[1], record))['Редактор'] for record in records] == ['Иванов И.И.'] * 2
+
+
+def test_unchanged_page_is_not_sent_again(client):
+    remote = client()
+    remote.import_rows(1, COLUMNS, [[contract('1'), contract('2')]])
+    path, params = '/api/registers/1/records', {'after': 0, 'limit': 100}
+    data, etag = remote._request('GET', path, params)
+    assert len(data) == 2 and etag
+    assert remote._request('GET', path, params, etag=etag) == (None, etag)
+    first = remote.get_records_page(1, 0, 100)
+    assert remote.get_records_page(1, 0, 100) == first
+    remote.update_record(1, first[0][0], 'Оплачено', 100.0)
+    assert remote._request('GET', path, params, etag=etag)[1] != etag
+
+
+def test_stale_edit_is_a_conflict(client):
+    first, second = client(), client()
+    first.import_rows(1, COLUMNS, [[contract('1')]])
+    record = first.get_all_records(1)[0]
+    version = record[-1]
+    assert first.update_record(1, record[0], 'Оплачено', 100.0, expected_version=version) == version + 1
+    with pytest.raises(ConflictError) as error:
+        second.update_record(1, record[0], 'Оплачено', 200.0, expected_version=version)
+    assert error.value.record[-1] == version + 1
+    assert second.get_record(1, record[0])[-1] == version + 1